@@ -0,0 +1,101 @@
+"""
+Benchmark results as JSON, and their comparison with an earlier run
+
+A result file holds one entry per measurement:
+
+    {"metrics": {"scan.latency": {"value": 1.2, "unit": "s", "higher_is_better": false}, ...},
+     "environment": {...}}
+"""
+
+import json
+import os
+import platform
+import sys
+import time
+
+
+def metric(value: float, unit: str, higher_is_better: bool = False) -> dict:
+    """Returns a measurement entry"""
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+
+def environment() -> dict:
+    """Returns what the results were measured on, differences make comparisons less meaningful"""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def save(path: str, metrics: dict) -> None:
+    """Write metrics, with the environment, to path"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="UTF-8") as o:
+        json.dump({"metrics": metrics, "environment": environment()}, o, indent=1, sort_keys=True)
+
+
+def load(path: str) -> dict:
+    """Returns the metrics stored at path"""
+    with open(path, encoding="UTF-8") as o:
+        return json.load(o)["metrics"]
+
+
+def compare(metrics: dict, baseline: dict, tolerance: float = 0.2) -> list:
+    """
+    Returns a description of each metric that got worse than baseline by more than tolerance
+
+    Metrics missing from either side are skipped
+
+    Args:
+        metrics: this run
+        baseline: an earlier run, see load()
+        tolerance: allowed relative change, e.g. 0.2 for 20% (optional, default: 0.2)
+    """
+    regressions = []
+    for name, current in sorted(metrics.items()):
+        if name not in baseline or not baseline[name]["value"]:
+            continue
+        before = baseline[name]["value"]
+        change = (current["value"] - before) / before
+        worse = -change if current.get("higher_is_better") else change
+        if worse > tolerance:
+            regressions.append(
+                f"{name}: {current['value']:.4g} {current['unit']} against {before:.4g} ({change:+.0%})"
+            )
+    return regressions
+
+
+def report(metrics: dict, baseline: None | dict = None) -> None:
+    """Print metrics, with the change from baseline if given"""
+    for name, current in sorted(metrics.items()):
+        line = f"{name:<40}{current['value']:>12.4g} {current['unit']}"
+        if baseline and name in baseline and baseline[name]["value"]:
+            line += f"  ({(current['value'] - baseline[name]['value']) / baseline[name]['value']:+.0%})"
+        print(line)
+
+
+def finish(metrics: dict, save_path: None | str, baseline_path: None | str, tolerance: float) -> int:
+    """
+    Report a run, save it and check it against a baseline
+
+    Returns the exit status: 1 if anything regressed past tolerance, else 0
+    """
+    baseline = load(baseline_path) if baseline_path and os.path.exists(baseline_path) else None
+    report(metrics, baseline)
+
+    if save_path:
+        save(save_path, metrics)
+        print(f"saved to {save_path}")
+
+    if baseline is None:
+        if baseline_path:
+            print(f"no baseline at {baseline_path} yet", file=sys.stderr)
+        return 0
+    regressions = compare(metrics, baseline, tolerance)
+    for regression in regressions:
+        print(f"regression: {regression}", file=sys.stderr)
+    return 1 if regressions else 0
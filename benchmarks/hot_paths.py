@@ -0,0 +1,301 @@
+"""
+Microbenchmarks of the hot paths: command capture, settings access, the page
+viewer, PDF export, PDF loading and page post-processing
+
+Each is timed (best of --repeat) with nothing traced. Memory is measured
+apart from the timings: the growth of the process's peak resident memory
+over the first run, which takes in the pixel buffers of PIL, NumPy and
+pymupdf, and the peak Python allocation traced by tracemalloc over an extra
+run. As the resident peak is a high-water mark, it only grows for a
+benchmark needing more memory than any run before it.
+
+Qt runs on the offscreen platform, so no display is needed. Benchmarks
+whose dependencies (PyQt6, Pillow, pymupdf, NumPy) are missing are skipped.
+With --baseline, exits 1 if anything got worse than the stored run by more
+than --tolerance
+
+usage: python -m benchmarks.hot_paths [--only cmd settings ...] [--repeat 3]
+           [--save FILE] [--baseline FILE]
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.baseline import finish, metric
+
+try:
+    import resource
+except ImportError:
+    # Windows, where the resident memory is not reported
+    resource = None
+
+# output of the command capture benchmarks
+CMD_BYTES = 64 * 1024 * 1024
+VIEWER_PAGES = (10, 100, 500)
+EXPORT_DPIS = (75, 150, 300)
+EXPORT_PAGES = 10
+PDF_PAGES = 100
+POSTPROCESS_DPI = 300
+
+
+def max_rss() -> None | int:
+    """Returns the peak resident memory of the process so far in bytes, None where unknown"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def measure(function, repeat: int = 3) -> tuple:
+    """
+    Returns the best time of function in seconds, its peak traced Python
+    allocation in bytes, and the growth of the process's peak resident memory
+    over its first run in bytes (None where unknown)
+
+    The timed runs are not traced, as tracemalloc slows down every
+    allocation, the traced one comes after them
+
+    Args:
+        function: called with no arguments
+        repeat: timed runs, the fastest is kept (optional, default: 3)
+    """
+    best = None
+    rss = None
+    for run in range(repeat):
+        gc.collect()
+        before = max_rss()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if run == 0 and before is not None:
+            rss = max_rss() - before
+        best = elapsed if best is None else min(best, elapsed)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak, rss
+
+
+def timed(name: str, function, repeat: int, per: int = 1, unit: str = "s") -> dict:
+    """Returns the time (per call, if per > 1) and peak memory metrics of function"""
+    seconds, peak, rss = measure(function, repeat)
+    scale = {"s": 1, "ms": 1e3, "us": 1e6}[unit]
+    metrics = {
+        f"{name}.time": metric(seconds / per * scale, unit),
+        f"{name}.peak": metric(peak / 1024 ** 2, "MiB"),
+    }
+    if rss is not None:
+        metrics[f"{name}.rss"] = metric(rss / 1024 ** 2, "MiB")
+    return metrics
+
+
+def bench_cmd(repeat: int) -> dict:
+    """CMD.exec capturing large binary and text outputs, and streaming into a sink"""
+    from bridge.connection.cmd import CMD  # pylint: disable=import-outside-toplevel
+    from bridge.connection.sinks import Sink  # pylint: disable=import-outside-toplevel
+
+    binary = f"head -c {CMD_BYTES} /dev/zero"
+    lines = f"seq 1 {CMD_BYTES // 64}"
+    return {
+        **timed("cmd.capture_binary", lambda: CMD(binary, binary=True).exec(), repeat),
+        **timed("cmd.sink_binary", lambda: CMD(binary, binary=True).exec(sink=Sink()), repeat),
+        **timed("cmd.capture_text", lambda: CMD(lines).exec(), repeat),
+    }
+
+
+def bench_settings(repeat: int) -> dict:
+    """Settings.get and set, repeated"""
+    from bridge.gui.settings import Settings  # pylint: disable=import-outside-toplevel
+
+    with tempfile.TemporaryDirectory() as directory:
+        settings = Settings(os.path.join(directory, "settings.ini"))
+
+        def gets():
+            for _ in range(10000):
+                settings.get("resolution")
+
+        def sets():
+            for i in range(100):
+                settings.set("scan_timeout", i)
+
+        return {
+            **timed("settings.get", gets, repeat, per=10000, unit="us"),
+            **timed("settings.set", sets, repeat, per=100, unit="us"),
+        }
+
+
+def qt_app():
+    """Returns the QApplication, created on the offscreen platform"""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt6.QtWidgets import QApplication  # pylint: disable=import-outside-toplevel
+
+    return QApplication.instance() or QApplication([])
+
+
+def page_images(count: int, size: tuple = (850, 1100)) -> list:
+    """Returns count distinct plain pages"""
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    return [Image.new("RGB", size, (i % 256, 128, 255 - i % 256)) for i in range(count)]
+
+
+def bench_viewer(repeat: int) -> dict:
+    """Adding pages to the viewer, and PageViewerWidget.update_display, at several page counts"""
+    app = qt_app()
+    from bridge.gui.subcontainers.pageviewer import PageViewerWidget  # pylint: disable=import-outside-toplevel
+
+    metrics = {}
+    for count in VIEWER_PAGES:
+        images = page_images(count)
+        widget = PageViewerWidget()
+        widget.resize(600, 800)
+        widget.show()
+
+        def add():
+            widget.model.clear()
+            widget.add_pages(images)
+            app.processEvents()
+
+        def display():
+            widget.update_display()
+            # painted now rather than on the next event loop pass
+            widget.list_view.viewport().repaint()
+            app.processEvents()
+
+        metrics.update(timed(f"viewer.add_{count}", add, repeat, unit="ms"))
+        metrics.update(timed(f"viewer.update_display_{count}", display, repeat, unit="ms"))
+        widget.close_workers()
+        widget.close()
+    return metrics
+
+
+def bench_export(repeat: int) -> dict:
+    """PDF export, as save_to_file runs it, at several target resolutions"""
+    from bridge.document.export import PDFExporter  # pylint: disable=import-outside-toplevel
+    from bridge.document.page import Page  # pylint: disable=import-outside-toplevel
+
+    # letter pages scanned at 300 dpi
+    pages = [Page(image, dpi=300) for image in page_images(EXPORT_PAGES, (2550, 3300))]
+    metrics = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for dpi in EXPORT_DPIS:
+            exporter = PDFExporter(os.path.join(directory, f"out-{dpi}.pdf"), dpi_target=dpi)
+            metrics.update(
+                timed(f"export.{dpi}dpi", lambda e=exporter: e.export(pages, default_dpi=300), repeat)
+            )
+            metrics[f"export.{dpi}dpi.size"] = metric(
+                os.path.getsize(exporter.filename) / 1024 ** 2, "MiB"
+            )
+    return metrics
+
+
+def bench_pdf_load(repeat: int) -> dict:
+    """Loading a multipage PDF, as load_image runs it, then making every preview"""
+    import pymupdf  # pylint: disable=import-outside-toplevel
+
+    from bridge.document.loader import load_files  # pylint: disable=import-outside-toplevel
+    from bridge.document.thumbnails import make_thumbnail  # pylint: disable=import-outside-toplevel
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "document.pdf")
+        with pymupdf.open() as doc:
+            for i in range(PDF_PAGES):
+                page = doc.new_page()
+                page.insert_text((72, 72), f"page {i + 1}\n" + "lorem ipsum " * 200)
+            doc.save(path)
+
+        def load():
+            return [page for _, pages, _ in load_files([path], dpi=300) for page in pages]
+
+        def previews():
+            for page in load():
+                make_thumbnail(page.source)
+
+        return {
+            **timed(f"pdf_load.{PDF_PAGES}_pages", load, repeat, unit="ms"),
+            **timed(f"pdf_load.{PDF_PAGES}_previews", previews, repeat),
+        }
+
+
+def bench_postprocess(repeat: int) -> dict:
+    """Cropping, straightening and the blank check of a skewed and a blank page"""
+    from PIL import Image, ImageDraw  # pylint: disable=import-outside-toplevel
+
+    from bridge.document.page import Page  # pylint: disable=import-outside-toplevel
+    from bridge.document.postprocess import PostProcessor  # pylint: disable=import-outside-toplevel
+
+    dpi = POSTPROCESS_DPI
+    # lines of "words" on a letter page
+    image = Image.new("L", (int(8.5 * dpi), 11 * dpi), 255)
+    draw = ImageDraw.Draw(image)
+    for y in range(dpi, 10 * dpi, dpi // 4):
+        for x in range(dpi, int(7.5 * dpi) - dpi // 3, dpi // 2):
+            draw.rectangle([x, y, x + dpi // 3, y + dpi // 12], fill=0)
+    skewed = Page(image.convert("RGB").rotate(1.5, fillcolor="white"), dpi=dpi)
+    blank = Page(Image.new("RGB", image.size, "white"), dpi=dpi)
+
+    processor = PostProcessor(blank="drop")
+    try:
+        return {
+            **timed(f"postprocess.skewed_{dpi}dpi", lambda: processor.process(skewed), repeat, unit="ms"),
+            **timed(f"postprocess.blank_{dpi}dpi", lambda: processor.process(blank), repeat, unit="ms"),
+        }
+    finally:
+        processor.close()
+
+
+# name: (function, modules it needs)
+BENCHMARKS = {
+    "cmd": (bench_cmd, []),
+    "settings": (bench_settings, []),
+    "viewer": (bench_viewer, ["PyQt6", "PIL"]),
+    "export": (bench_export, ["PIL", "pymupdf"]),
+    "pdf_load": (bench_pdf_load, ["PIL", "pymupdf"]),
+    "postprocess": (bench_postprocess, ["PIL", "numpy"]),
+}
+
+
+def available(modules: list) -> bool:
+    """Returns True if every module can be imported"""
+    try:
+        for module in modules:
+            __import__(module)
+    except ImportError:
+        return False
+    return True
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="hot path microbenchmarks")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="benchmarks to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each, the fastest is kept")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown (default: 20%%)")
+    args = parser.parse_args(argv)
+
+    metrics = {}
+    for name in args.only or BENCHMARKS:
+        function, modules = BENCHMARKS[name]
+        if not available(modules):
+            print(f"skipping {name}, it needs {', '.join(modules)}", file=sys.stderr)
+            continue
+        print(f"running {name}...", file=sys.stderr)
+        metrics.update(function(args.repeat))
+
+    return finish(metrics, args.save, args.baseline, args.tolerance)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""
+End to end scan throughput, against a simulated scanner host
+
+Runs single scans and a feeder batch through the real Scanner, Connection and
+CMD code, with the scanner speed, page size and link set on the command line,
+and reports per page latency and pages per minute. With --baseline, exits 1
+if anything got slower than the stored run by more than --tolerance
+
+usage: python -m benchmarks.scan_throughput [--pages 5] [--resolution 150]
+           [--scan-seconds 0.2] [--bandwidth 10] [--latency 5]
+           [--transfer pnm] [--save FILE] [--baseline FILE]
+"""
+
+import argparse
+import statistics
+import sys
+import time
+
+from benchmarks.baseline import finish, metric
+from bridge.scan.simulator import FakeSANE
+
+
+def time_single(scanner, resolution: int, pages: int) -> list:
+    """Returns the seconds each of pages single scans took"""
+    times = []
+    for _ in range(pages):
+        start = time.perf_counter()
+        scanner.scan_page(resolution)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def time_batch(scanner, resolution: int, pages: int, fmt: str) -> tuple:
+    """Returns (seconds to the first page, seconds for all) of a feeder batch"""
+    start = time.perf_counter()
+    first = None
+    for _ in scanner.scan_batch(resolution, count=pages, fmt=fmt, as_pages=True):
+        if first is None:
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="scan throughput benchmark, on a simulated scanner")
+    parser.add_argument("--pages", type=int, default=5, help="pages per measurement")
+    parser.add_argument("--resolution", type=int, default=150)
+    parser.add_argument("--scan-seconds", type=float, default=0.2, help="simulated scanner time per page")
+    parser.add_argument("--bandwidth", type=float, default=10.0, help="simulated link, MB/s (0: unlimited)")
+    parser.add_argument("--latency", type=float, default=5.0, help="simulated round trip, ms")
+    parser.add_argument("--transfer", default="pnm", help="wire format, or auto")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown (default: 20%%)")
+    args = parser.parse_args(argv)
+
+    with FakeSANE(
+        scan_seconds=args.scan_seconds,
+        bandwidth=args.bandwidth * 1e6 or None,
+        latency=args.latency / 1000,
+    ) as sim:
+        scanner = sim.scanner(transfer=args.transfer)
+        scanner.connect()
+        # the first scan pays for the device probe, which is not what is measured
+        scanner.scan_page(args.resolution)
+
+        single = time_single(scanner, args.resolution, args.pages)
+        fmt, _ = scanner.transfer_format(args.resolution)
+        first, batch = time_batch(scanner, args.resolution, args.pages, fmt)
+        scanner.close()
+
+    metrics = {
+        "single.latency.median": metric(statistics.median(single), "s"),
+        "single.latency.max": metric(max(single), "s"),
+        "single.pages_per_minute": metric(60 * len(single) / sum(single), "pages/min", higher_is_better=True),
+        "batch.first_page": metric(first, "s"),
+        "batch.pages_per_minute": metric(60 * args.pages / batch, "pages/min", higher_is_better=True),
+    }
+    return finish(metrics, args.save, args.baseline, args.tolerance)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
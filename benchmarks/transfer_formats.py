@@ -0,0 +1,62 @@
+"""
+Compare scan wire formats end to end, against the transfer model
+
+Scans a page in every format (and gzipped, for the uncompressed ones) at each
+resolution, timing the scan, transfer and local decode together
+
+usage: python -m benchmarks.transfer_formats user@host [--resolutions 75 150 300] [--repeat 2]
+"""
+
+import argparse
+import io
+import time
+
+from bridge.scan.scan import Scanner, decode
+from bridge.scan.transfer import LinkProfile, page_bytes
+
+
+def time_scan(scanner: Scanner, resolution: int, fmt: str, compress: bool) -> tuple:
+    """Returns (seconds, bytes received) for one scan, decode included"""
+    buffer = io.BytesIO()
+    start = time.perf_counter()
+    scanner.scan_to(buffer, resolution, fmt=fmt, compress=compress)
+    decode(buffer.getvalue())
+    return time.perf_counter() - start, buffer.tell()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="scan transfer format benchmark")
+    parser.add_argument("userhost")
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[75, 150, 300])
+    parser.add_argument("--repeat", type=int, default=1, help="scans per option, the fastest is kept")
+    parser.add_argument("--lossy", action="store_true", help="include jpeg")
+    args = parser.parse_args(argv)
+
+    scanner = Scanner(args.userhost)
+    scanner.connect()
+
+    link = LinkProfile.measure(scanner.conn)
+    print(link)
+
+    for resolution in args.resolutions:
+        raw = page_bytes(resolution)
+        print(f"\n{resolution} dpi, {raw / 1e6:.1f} MB raw")
+        print(f"{'option':<12}{'model s':>10}{'actual s':>10}{'MB':>8}")
+
+        measured = []
+        for estimate, fmt, compress in link.rank(raw, lossy=args.lossy):
+            seconds, size = min(
+                time_scan(scanner, resolution, fmt, compress) for _ in range(args.repeat)
+            )
+            name = f"{fmt}+gzip" if compress else fmt
+            measured.append((seconds, name))
+            print(f"{name:<12}{estimate:>10.2f}{seconds:>10.2f}{size / 1e6:>8.2f}")
+
+        fmt, compress = link.choose(raw, lossy=args.lossy)
+        print(f"fastest: {min(measured)[1]}, model picked: {fmt}{'+gzip' if compress else ''}")
+
+    scanner.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+"""
+Runs the command line, see bridge.cli
+"""
+
+import sys
+
+from bridge.cli import main
+
+sys.exit(main())
@@ -0,0 +1,269 @@
+"""
+Scan agent, run on the machine hosting the scanner
+
+Keeps the SANE device open between scans, so the backend initialisation,
+USB enumeration and lamp warm-up are paid once instead of on every scanimage
+call. Requests are read from stdin (normally the ssh channel) or from a unix
+socket when run as a daemon.
+
+This file is shipped to the remote host as-is, so it must only depend on the
+standard library (plus python-sane and Pillow for the sane backend) and stay
+compatible with the older Python found on a Raspberry Pi.
+
+Protocol, one JSON object per line:
+
+    agent  -> {"agent": "pysanebridge", "version": 1, "backend": ..., "device": ...}
+    client -> {"op": "scan", "resolution": 300, "format": "png", "mode": ..., "source": ...}
+    agent  -> {"ok": true, "format": "png", "size": N} followed by N bytes of image
+    client -> {"op": "options"}
+    agent  -> {"ok": true, "options": {...}}
+    client -> {"op": "ping"}
+    client -> {"op": "quit"} ends the session, {"op": "shutdown"} also stops a daemon
+
+Any failure is answered with {"ok": false, "error": "..."}
+"""
+
+import argparse
+import io
+import json
+import os
+import socket
+import sys
+import threading
+
+PROTOCOL_VERSION = 1
+
+# scanimage style format names, mapped to the PIL encoder names
+PIL_FORMATS = {"pnm": "PPM", "png": "PNG", "jpeg": "JPEG", "tiff": "TIFF"}
+
+
+class FakeBackend:
+    """
+    Backend producing a generated test page, for testing without a scanner
+
+    Args:
+        width: page width in inches
+        height: page height in inches
+    """
+
+    name = "fake"
+
+    def __init__(self, width=8.5, height=11.0):
+        self.width = width
+        self.height = height
+        self.device = "fake:0"
+        self.scans = 0
+
+    def options(self):
+        """Returns the options the fake device pretends to support"""
+        return {
+            "resolution": [75, 150, 300, 600],
+            "mode": ["Color", "Gray"],
+            "source": ["Flatbed"],
+        }
+
+    def scan(self, resolution=300, fmt="pnm", mode="Color", source=None):
+        """Returns (format, encoded bytes) of a horizontal gradient page"""
+        self.scans += 1
+        width = int(self.width * resolution)
+        height = int(self.height * resolution)
+        channels = 1 if mode == "Gray" else 3
+
+        row = bytearray()
+        for x in range(width):
+            row += bytes([x * 255 // max(width - 1, 1)]) * channels
+        magic = b"P5" if channels == 1 else b"P6"
+        data = magic + b"\n%d %d\n255\n" % (width, height) + bytes(row) * height
+
+        if fmt == "pnm":
+            return "pnm", data
+        try:
+            from PIL import Image
+        except ImportError:
+            # without Pillow the page is sent as pnm, the client decodes either
+            return "pnm", data
+        return fmt, encode(Image.open(io.BytesIO(data)), fmt)
+
+
+class SaneBackend:
+    """
+    Backend holding a real SANE device open, through python-sane
+
+    Args:
+        device: SANE device name (optional, default: the first device found)
+    """
+
+    name = "sane"
+
+    def __init__(self, device=None):
+        import sane  # pylint: disable=import-outside-toplevel
+
+        sane.init()
+        if device is None:
+            devices = sane.get_devices()
+            if not devices:
+                raise RuntimeError("no SANE devices found")
+            device = devices[0][0]
+
+        self.device = device
+        self._dev = sane.open(device)
+
+    def options(self):
+        """Returns the constraints of the device options, keyed by option name"""
+        options = {}
+        for opt in self._dev.get_options():
+            name, constraint = opt[1], opt[8]
+            if name and constraint is not None:
+                options[name.replace("-", "_")] = constraint
+        return options
+
+    def scan(self, resolution=300, fmt="pnm", mode=None, source=None):
+        """Returns (format, encoded bytes) of a fresh scan"""
+        self._dev.resolution = resolution
+        if mode is not None:
+            self._dev.mode = mode
+        if source is not None:
+            self._dev.source = source
+
+        return fmt, encode(self._dev.scan(), fmt)
+
+
+def encode(image, fmt):
+    """Encode a PIL image as fmt (a scanimage style format name)"""
+    buffer = io.BytesIO()
+    image.save(buffer, format=PIL_FORMATS[fmt])
+    return buffer.getvalue()
+
+
+def make_backend(name, device=None):
+    """Create the backend called name"""
+    if name == "fake":
+        return FakeBackend()
+    return SaneBackend(device)
+
+
+def serve(backend, instream, outstream, lock):
+    """
+    Answer requests from instream until it closes or asks to quit
+
+    Returns True if the client asked the agent to shut down
+    """
+    write_line(outstream, {
+        "agent": "pysanebridge",
+        "version": PROTOCOL_VERSION,
+        "backend": backend.name,
+        "device": backend.device,
+    })
+
+    for line in iter(instream.readline, b""):
+        try:
+            request = json.loads(line.decode())
+        except ValueError:
+            write_line(outstream, {"ok": False, "error": "malformed request"})
+            continue
+
+        op = request.get("op")
+        if op in ("quit", "shutdown"):
+            write_line(outstream, {"ok": True})
+            return op == "shutdown"
+
+        try:
+            with lock:
+                if op == "ping":
+                    write_line(outstream, {"ok": True})
+                elif op == "options":
+                    write_line(outstream, {"ok": True, "options": backend.options()})
+                elif op == "scan":
+                    fmt, data = backend.scan(
+                        resolution=int(request.get("resolution", 300)),
+                        fmt=request.get("format", "pnm"),
+                        mode=request.get("mode"),
+                        source=request.get("source"),
+                    )
+                    write_line(outstream, {"ok": True, "format": fmt, "size": len(data)})
+                    outstream.write(data)
+                    outstream.flush()
+                else:
+                    write_line(outstream, {"ok": False, "error": "unknown op %r" % op})
+        except Exception as ex:  # pylint: disable=broad-except
+            write_line(outstream, {"ok": False, "error": "%s: %s" % (type(ex).__name__, ex)})
+
+    return False
+
+
+def write_line(outstream, message):
+    """Send one protocol line"""
+    outstream.write(json.dumps(message).encode() + b"\n")
+    outstream.flush()
+
+
+def serve_socket(backend, path):
+    """Run as a daemon, serving each client connecting to the unix socket at path"""
+    if os.path.exists(path):
+        os.remove(path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o600)
+    server.listen()
+
+    lock = threading.Lock()
+    try:
+        while True:
+            client, _ = server.accept()
+            stream = client.makefile("rwb")
+            try:
+                if serve(backend, stream, stream, lock):
+                    break
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                stream.close()
+                client.close()
+    finally:
+        server.close()
+        os.remove(path)
+
+
+def relay(path):
+    """Connect stdin/stdout to a daemon listening at path"""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(path)
+
+    def upstream():
+        for chunk in iter(lambda: sys.stdin.buffer.read1(65536), b""):
+            client.sendall(chunk)
+        client.shutdown(socket.SHUT_WR)
+
+    threading.Thread(target=upstream, daemon=True).start()
+    for chunk in iter(lambda: client.recv(65536), b""):
+        sys.stdout.buffer.write(chunk)
+        sys.stdout.buffer.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="pySANEBridge scan agent")
+    parser.add_argument("--backend", choices=["sane", "fake"], default="sane")
+    parser.add_argument("--device", default=None, help="SANE device name")
+    parser.add_argument("--socket", default=None, help="serve clients on this unix socket")
+    parser.add_argument("--connect", default=None, help="relay stdio to the daemon on this socket")
+    args = parser.parse_args(argv)
+
+    if args.connect is not None:
+        relay(args.connect)
+        return
+
+    try:
+        backend = make_backend(args.backend, args.device)
+    except Exception as ex:  # pylint: disable=broad-except
+        write_line(sys.stdout.buffer, {"ok": False, "error": "%s: %s" % (type(ex).__name__, ex)})
+        sys.exit(1)
+
+    if args.socket is not None:
+        serve_socket(backend, args.socket)
+    else:
+        serve(backend, sys.stdin.buffer, sys.stdout.buffer, threading.Lock())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+Client for the scan agent running on the scanner host
+"""
+
+import base64
+import json
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import zlib
+
+from bridge.connection.cmd import chunk_capture, kill_process
+from bridge.connection.connection import Connection
+from bridge.connection.sinks import RingBufferSink
+
+AGENT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent.py")
+
+
+def agent_command(python: str = "python3", *args: str) -> str:
+    """
+    Build a shell command that runs the agent without installing it
+
+    The agent source travels inline, compressed and base64 encoded, so the
+    remote host only needs a python interpreter
+
+    Args:
+        python: interpreter to run the agent with (optional, default: python3)
+        args: arguments for the agent, e.g. "--backend", "fake"
+    """
+    with open(AGENT_PATH, "rb") as o:
+        payload = base64.b64encode(zlib.compress(o.read(), 9)).decode()
+
+    loader = f"import base64,zlib;exec(zlib.decompress(base64.b64decode('{payload}')))"
+    return " ".join([python, "-u", "-c", shlex.quote(loader)] + [shlex.quote(arg) for arg in args])
+
+
+class AgentClient:
+    """
+    Talks to a scan agent over a pipe, normally an ssh channel
+
+    The agent is started on the first request and kept running, with the
+    scanner open, until close()
+
+    Args:
+        launch: shell command that starts the agent on stdin/stdout
+    """
+
+    __slots__ = ["_launch", "_proc", "_info", "_log", "_lock"]
+
+    def __init__(self, launch: str):
+        self._launch = launch
+
+        self._proc = None
+        self._info = None
+        self._log = RingBufferSink(4096)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def over_ssh(
+        cls,
+        conn: Connection,
+        backend: str = "sane",
+        device: None | str = None,
+        socket: None | str = None,
+        python: str = "python3",
+    ) -> "AgentClient":
+        """
+        Create a client for an agent on the remote end of conn
+
+        Args:
+            conn: Connection to the scanner host
+            backend: agent backend, sane or fake (optional, default: sane)
+            device: SANE device name (optional, default: the first device)
+            socket: path of an agent daemon's unix socket to relay to, instead
+                of starting a private agent (optional)
+            python: remote interpreter (optional, default: python3)
+        """
+        if socket is not None:
+            args = ["--connect", socket]
+        else:
+            args = ["--backend", backend]
+            if device is not None:
+                args += ["--device", device]
+
+        return cls(conn.ssh_command(agent_command(python, *args)))
+
+    @classmethod
+    def local(cls, backend: str = "fake", *args: str) -> "AgentClient":
+        """
+        Create a client for an agent on this machine
+
+        Args:
+            backend: agent backend, sane or fake (optional, default: fake)
+            args: any further agent arguments
+        """
+        return cls(agent_command(sys.executable, "--backend", backend, *args))
+
+    @property
+    def info(self) -> None | dict:
+        """Returns the agent's greeting, or None if it is not running"""
+        return self._info
+
+    @property
+    def running(self) -> bool:
+        """Returns True if the agent process is alive"""
+        return self._proc is not None and self._proc.poll() is None
+
+    def start(self) -> dict:
+        """
+        Start the agent if needed, returning its greeting
+
+        Raises ConnectionError if the agent could not be started
+        """
+        if self.running:
+            return self._info
+
+        self._proc = subprocess.Popen(
+            self._launch,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            shell=True,
+            start_new_session=os.name != "nt",
+        )
+        threading.Thread(target=chunk_capture, args=[self._proc.stderr, self._log], daemon=True).start()
+
+        greeting = self._read_header()
+        if greeting.get("agent") != "pysanebridge":
+            self.close()
+            raise ConnectionError(f"agent failed to start: {greeting.get('error', greeting)}")
+
+        self._info = greeting
+        return greeting
+
+    def request(self, op: str, sink=None, timeout: None | float = None, **params) -> dict:
+        """
+        Send a request and return the response header
+
+        Any payload following the header is written to sink
+
+        Args:
+            op: operation name (scan, options, ping)
+            sink: object with a write(bytes) method for the payload (optional)
+            timeout: seconds before the agent is killed and ConnectionError raised (optional)
+            params: request parameters
+        """
+        with self._lock:
+            self.start()
+
+            timer = None
+            if timeout is not None:
+                timer = threading.Timer(timeout, kill_process, args=[self._proc])
+                timer.start()
+            try:
+                self._proc.stdin.write(json.dumps({"op": op, **params}).encode() + b"\n")
+                self._proc.stdin.flush()
+
+                header = self._read_header()
+                remaining = header.get("size", 0)
+                while remaining > 0:
+                    chunk = self._proc.stdout.read1(min(remaining, 64 * 1024))
+                    if chunk == b"":
+                        raise ConnectionError("agent closed the connection mid-transfer")
+                    if sink is not None:
+                        sink.write(chunk)
+                    remaining -= len(chunk)
+            except (BrokenPipeError, OSError) as ex:
+                raise ConnectionError(f"lost the agent: {ex}") from ex
+            finally:
+                if timer is not None:
+                    timer.cancel()
+
+        return header
+
+    def scan_to(
+        self,
+        sink,
+        resolution: int = 300,
+        fmt: str = "png",
+        mode: None | str = None,
+        source: None | str = None,
+        timeout: None | float = None,
+    ) -> str:
+        """
+        Request a scan, writing the encoded image into sink
+
+        Returns the format actually sent, which may differ from fmt if the
+        agent could not encode it. Raises RuntimeError if the scan failed
+
+        Args:
+            sink: object with a write(bytes) method
+            resolution: scan resolution in DPI
+            fmt: requested format (pnm, tiff, png, jpeg)
+            mode: scan mode, e.g. Color (optional)
+            source: scan source, e.g. ADF (optional)
+            timeout: seconds before the agent is killed and ConnectionError raised (optional)
+        """
+        header = self.request(
+            "scan",
+            sink=sink,
+            timeout=timeout,
+            resolution=resolution,
+            format=fmt,
+            mode=mode,
+            source=source,
+        )
+        if not header.get("ok"):
+            raise RuntimeError(f"agent scan failed: {header.get('error')}")
+
+        return header["format"]
+
+    def options(self) -> dict:
+        """Returns the option constraints reported by the device"""
+        header = self.request("options")
+        if not header.get("ok"):
+            raise RuntimeError(f"agent could not list options: {header.get('error')}")
+
+        return header["options"]
+
+    def kill(self) -> None:
+        """Kill the agent process, e.g. to abort a scan from another thread"""
+        if self._proc is not None:
+            kill_process(self._proc)
+
+    def close(self) -> None:
+        """Ask the agent to quit, killing it if it does not"""
+        if self._proc is None:
+            return
+
+        try:
+            if self.running:
+                self._proc.stdin.write(b'{"op": "quit"}\n')
+                self._proc.stdin.flush()
+                self._proc.wait(timeout=5)
+        except (BrokenPipeError, OSError, subprocess.TimeoutExpired):
+            kill_process(self._proc)
+            self._proc.wait()
+        finally:
+            self._proc = None
+            self._info = None
+
+    def _read_header(self) -> dict:
+        """Read one protocol line from the agent"""
+        line = self._proc.stdout.readline()
+        if line == b"":
+            log = self._log.getvalue().decode(errors="replace").strip()
+            raise ConnectionError(f"agent exited: {log}")
+
+        return json.loads(line.decode())
@@ -0,0 +1,251 @@
+"""
+Location of the on-disk caches, and size bounded caches in memory and on disk
+"""
+
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def cache_dir(*parts: str) -> str:
+    """
+    Returns (creating it if needed) a directory within the user cache directory
+
+    Honours XDG_CACHE_HOME, and LOCALAPPDATA on Windows
+
+    Args:
+        parts: subdirectory names
+    """
+    if os.name == "nt":
+        root = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+    else:
+        root = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+
+    path = os.path.join(root, "pysanebridge", *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class LRUCache:
+    """
+    Mapping that drops its least recently used entries to stay within a size budget
+
+    Safe to use from several threads
+
+    Args:
+        max_size: total size of the entries to keep
+        sizeof: function returning the size of a value (optional, default: every value counts 1)
+        on_evict: function called with (key, value) for every entry dropped to
+            make room, outside the cache lock (optional)
+        on_evicting: as on_evict, but called under the cache lock as the entry
+            leaves, so no other thread sees it gone first. Must be quick and
+            must not use the cache (optional)
+    """
+
+    __slots__ = ["_max_size", "_sizeof", "_on_evict", "_on_evicting", "_entries", "_size", "_lock"]
+
+    def __init__(self, max_size: int, sizeof=None, on_evict=None, on_evicting=None):
+        self._max_size = max_size
+        self._sizeof = sizeof if sizeof is not None else lambda _: 1
+        self._on_evict = on_evict
+        self._on_evicting = on_evicting
+
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def size(self) -> int:
+        """Returns the total size of the cached entries"""
+        return self._size
+
+    @property
+    def max_size(self) -> int:
+        """Returns the size budget"""
+        return self._max_size
+
+    def get(self, key, default=None):
+        """Returns the value for key, marking it as recently used"""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value) -> None:
+        """Store value under key, evicting old entries if over budget"""
+        size = self._sizeof(value)
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._size += size
+
+            # the newest entry is always kept, even if it alone is over budget
+            while self._size > self._max_size and len(self._entries) > 1:
+                old_key, (old_value, old_size) = self._entries.popitem(last=False)
+                self._size -= old_size
+                if self._on_evicting is not None:
+                    self._on_evicting(old_key, old_value)
+                evicted.append((old_key, old_value))
+
+        if self._on_evict is not None:
+            for old_key, old_value in evicted:
+                self._on_evict(old_key, old_value)
+
+    def pop(self, key, default=None):
+        """Remove key, returning its value"""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value, size = self._entries.pop(key)
+            self._size -= size
+            return value
+
+    def clear(self) -> None:
+        """Remove every entry"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+class DiskCache:
+    """
+    Directory of files that drops its least recently used ones to stay within a size budget
+
+    Entries survive restarts. Use is tracked through file modification times,
+    so the directory is what counts, and several processes may share it.
+    Entries are written under a temporary name first, a reader never sees
+    half a file
+
+    Args:
+        directory: where the entries are kept, created if needed
+        max_size: total bytes of entries to keep
+    """
+
+    __slots__ = ["_directory", "_max_size", "_size", "_lock"]
+
+    # suffix of entries being written
+    PARTIAL = ".part"
+
+    def __init__(self, directory: str, max_size: int):
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._size = sum(size for _, _, size in self._entries())
+
+    def __contains__(self, name):
+        return os.path.isfile(self._path(name))
+
+    @property
+    def directory(self) -> str:
+        """Returns the cache directory"""
+        return self._directory
+
+    @property
+    def size(self) -> int:
+        """Returns the total bytes of the cached entries, as last counted"""
+        return self._size
+
+    @property
+    def max_size(self) -> int:
+        """Returns the size budget"""
+        return self._max_size
+
+    def get(self, name: str) -> None | bytes:
+        """Returns the content of entry name, marking it as recently used, None if not cached"""
+        path = self._path(name)
+        try:
+            with open(path, "rb") as o:
+                data = o.read()
+            os.utime(path)
+        except OSError:
+            # not cached, or evicted by another process while reading
+            return None
+        return data
+
+    def put(self, name: str, data: bytes) -> None:
+        """Store data as entry name, evicting old entries if over budget"""
+        path = self._path(name)
+        fd, temp = tempfile.mkstemp(suffix=self.PARTIAL, dir=self._directory)
+        try:
+            with os.fdopen(fd, "wb") as o:
+                o.write(data)
+            with self._lock:
+                try:
+                    self._size -= os.path.getsize(path)
+                except OSError:
+                    pass
+                os.replace(temp, path)
+                self._size += len(data)
+        except OSError as ex:
+            # a cache that cannot be written is only slower
+            print(f"could not cache {name}: {ex}")
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            return
+
+        if self._size > self._max_size:
+            self._evict(keep=path)
+
+    def clear(self) -> None:
+        """Remove every entry"""
+        with self._lock:
+            for path, _, _ in self._entries():
+                _remove(path)
+            self._size = 0
+
+    def _path(self, name: str) -> str:
+        if not name or os.path.basename(name) != name or name.endswith(self.PARTIAL):
+            raise ValueError(f"invalid cache entry name: {name!r}")
+        return os.path.join(self._directory, name)
+
+    def _entries(self) -> list:
+        """Returns (path, last use, size) of every entry"""
+        entries = []
+        with os.scandir(self._directory) as scan:
+            for entry in scan:
+                if entry.name.endswith(self.PARTIAL) or not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((entry.path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def _evict(self, keep: str) -> None:
+        """Remove the least recently used entries until within budget"""
+        with self._lock:
+            # recounted, as other processes may have added or removed entries
+            entries = sorted(self._entries(), key=lambda entry: entry[1])
+            size = sum(entry[2] for entry in entries)
+            for path, _, entry_size in entries:
+                if size <= self._max_size:
+                    break
+                # the newest entry is always kept, even if it alone is over budget
+                if path == keep:
+                    continue
+                if _remove(path):
+                    size -= entry_size
+            self._size = size
+
+
+def _remove(path: str) -> bool:
+    """Remove a cache entry, returning False if it could not be"""
+    try:
+        os.remove(path)
+    except OSError:
+        return False
+    return True
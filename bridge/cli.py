@@ -0,0 +1,255 @@
+"""
+Command line scanning, without the GUI
+
+Only the standard library is imported up front, the scanner (and PIL, and
+pymupdf for PDF output) once a command needs them, so the command starts
+quickly and runs without Qt or a display
+
+usage:
+    bridge scan pi@pisane -o "scan-{n:03}.png"
+    bridge scan pi@pisane --batch -o "letters-{date}.pdf" --dpi-target 150
+    bridge devices pi@pisane
+"""
+
+import argparse
+import datetime
+import os
+import signal
+import sys
+
+# extensions written as one file holding every page
+MULTIPAGE = {".pdf", ".tif", ".tiff"}
+# exit status of a failed scan or save, and of an interrupted one
+EXIT_FAILED = 1
+EXIT_INTERRUPTED = 130
+
+
+def output_name(pattern: str, n: int, resolution: int, now: None | datetime.datetime = None) -> str:
+    """
+    Returns the file name for a page (or document) from pattern
+
+    The pattern is a str.format() string, with the fields
+        n: page number, from 1
+        resolution: scan resolution in DPI
+        date: YYYY-MM-DD
+        time: HHMMSS
+
+    Args:
+        pattern: e.g. scan-{n:03}.png
+        n: page number
+        resolution: scan resolution in DPI
+        now: time of the scan (optional, default: now)
+    """
+    now = now or datetime.datetime.now()
+    try:
+        return pattern.format(
+            n=n, resolution=resolution, date=now.strftime("%Y-%m-%d"), time=now.strftime("%H%M%S")
+        )
+    except (KeyError, IndexError, ValueError) as ex:
+        raise ValueError(f"invalid output pattern {pattern!r}: {ex}") from ex
+
+
+def is_multipage(pattern: str) -> bool:
+    """Returns True if pattern names a single file holding every page (PDF or TIFF)"""
+    return os.path.splitext(pattern)[1].lower() in MULTIPAGE and "{n" not in pattern
+
+
+def save_page(page, path: str) -> None:
+    """Write a single page to path, in the format of its extension"""
+    ext = os.path.splitext(path)[1].lower()
+    # a scan received as jpeg is written as it came
+    if page.encoded is not None and ext in (".jpg", ".jpeg") and page.encoded[:2] == b"\xff\xd8":
+        with open(path, "wb") as o:
+            o.write(page.encoded)
+        return
+
+    image = page.image
+    if ext in (".jpg", ".jpeg") and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    kwargs = {"dpi": (page.dpi, page.dpi)} if page.dpi else {}
+    image.save(path, **kwargs)
+
+
+def save_tiff(pages: list, path: str) -> None:
+    """Write pages to a multipage TIFF"""
+    images = [page.image for page in pages]
+    dpi = pages[0].dpi
+    kwargs = {"dpi": (dpi, dpi)} if dpi else {}
+    images[0].save(path, save_all=True, append_images=images[1:], compression="tiff_lzw", **kwargs)
+
+
+def save_document(pages: list, path: str, resolution: int, dpi_target: None | int) -> None:
+    """Write every page to a single PDF or TIFF"""
+    if os.path.splitext(path)[1].lower() != ".pdf":
+        save_tiff(pages, path)
+        return
+
+    # pymupdf is only needed here
+    from bridge.document.export import PDFExporter  # pylint: disable=import-outside-toplevel
+
+    PDFExporter(path, dpi_target or resolution).export(pages, default_dpi=resolution)
+
+
+def save_partial(pages: list, args, now: datetime.datetime) -> None | str:
+    """
+    Write the pages of a document scanned before a failure, returning the
+    path, or None if there were none or they could not be saved
+
+    Args:
+        pages: pages scanned so far
+        args: the scan command's arguments
+        now: time of the scan
+    """
+    if not pages:
+        return None
+    path = output_name(args.output, len(pages), args.resolution, now)
+    try:
+        save_document(pages, path, args.resolution, args.dpi_target)
+    except (RuntimeError, OSError, ValueError) as ex:
+        print(f"could not save the {len(pages)} pages scanned: {ex}", file=sys.stderr)
+        return None
+    print(f"warning: partial document of {len(pages)} pages written to {path}", file=sys.stderr)
+    print(path)
+    return path
+
+
+def scan(args) -> int:
+    """Run the scan command, returning the exit status"""
+    now = datetime.datetime.now()
+    multipage = is_multipage(args.output)
+    if not multipage and "{n" not in args.output and (args.batch or (args.count or 1) > 1):
+        print("several pages need {n} in the output pattern, or a .pdf or .tif output", file=sys.stderr)
+        return EXIT_FAILED
+
+    # deferred, as it brings in PIL
+    from bridge.connection.cmd import CancelHandle  # pylint: disable=import-outside-toplevel
+    from bridge.scan.scan import Scanner  # pylint: disable=import-outside-toplevel
+
+    try:
+        scanner = Scanner(args.userhost, stream=not args.no_stream, agent=args.agent, transfer=args.transfer)
+    except ValueError as ex:
+        print(ex, file=sys.stderr)
+        return EXIT_FAILED
+    cancel = CancelHandle()
+    # ctrl-c (or a service stopping) aborts the scan on the remote host too
+    signal.signal(signal.SIGTERM, lambda *_: cancel.cancel())
+
+    pages = []
+    written = []
+    try:
+        if not scanner.connect():
+            print(f"could not connect to {args.userhost}", file=sys.stderr)
+            return EXIT_FAILED
+
+        if args.batch:
+            scanned = scanner.scan_batch(
+                args.resolution,
+                count=args.count,
+                source=args.source,
+                timeout=args.timeout,
+                cancel=cancel,
+                as_pages=True,
+            )
+        else:
+            scanned = (
+                scanner.scan_page(args.resolution, timeout=args.timeout, cancel=cancel)
+                for _ in range(args.count or 1)
+            )
+
+        for n, page in enumerate(scanned, start=1):
+            if multipage:
+                pages.append(page)
+                continue
+            # pages are written as they arrive, a failure later on keeps them
+            path = output_name(args.output, n, args.resolution, now)
+            save_page(page, path)
+            written.append(path)
+            print(path)
+
+        if multipage and pages:
+            path = output_name(args.output, len(pages), args.resolution, now)
+            # taken off the list once saved, so a failed save is not tried again
+            pages, document = [], pages
+            save_document(document, path, args.resolution, args.dpi_target)
+            written.append(path)
+            print(path)
+    except (KeyboardInterrupt, InterruptedError):
+        cancel.cancel()
+        # the pages of a document scanned so far are kept
+        path = save_partial(pages, args, now)
+        if path is not None:
+            written.append(path)
+        print(f"interrupted, {len(written)} files written", file=sys.stderr)
+        return EXIT_INTERRUPTED
+    except (RuntimeError, TimeoutError, OSError, ValueError) as ex:
+        print(f"scan failed: {ex}", file=sys.stderr)
+        save_partial(pages, args, now)
+        return EXIT_FAILED
+    finally:
+        scanner.close()
+
+    if not written:
+        print("no pages scanned", file=sys.stderr)
+        return EXIT_FAILED
+    return 0
+
+
+def devices(args) -> int:
+    """Run the devices command, returning the exit status"""
+    from bridge.scan.scan import Scanner  # pylint: disable=import-outside-toplevel
+
+    scanner = Scanner(args.userhost)
+    try:
+        if not scanner.connect():
+            print(f"could not connect to {args.userhost}", file=sys.stderr)
+            return EXIT_FAILED
+        for device in scanner.get_devices():
+            print(device)
+    except (RuntimeError, OSError) as ex:
+        print(f"could not list devices: {ex}", file=sys.stderr)
+        return EXIT_FAILED
+    finally:
+        scanner.close()
+    return 0
+
+
+def parser() -> argparse.ArgumentParser:
+    """Returns the command line parser"""
+    main_parser = argparse.ArgumentParser(prog="bridge", description="scan over ssh with SANE")
+    commands = main_parser.add_subparsers(dest="command", required=True)
+
+    scan_parser = commands.add_parser("scan", help="scan pages to files")
+    scan_parser.add_argument("userhost", help="user@host of the machine running SANE")
+    scan_parser.add_argument(
+        "-o", "--output", default="scan-{date}-{time}-{n:03}.png",
+        help="output file pattern, with {n}, {resolution}, {date} and {time}. "
+        "A .pdf or .tif name without {n} gets every page (default: %(default)s)",
+    )
+    scan_parser.add_argument("-r", "--resolution", type=int, default=300, help="scan DPI (default: %(default)s)")
+    scan_parser.add_argument("--batch", action="store_true", help="scan until the document feeder is empty")
+    scan_parser.add_argument("--count", type=int, help="number of pages (default: 1, or the whole feeder)")
+    scan_parser.add_argument("--source", help="scanimage --source, e.g. ADF")
+    scan_parser.add_argument("--timeout", type=float, help="seconds to wait for each page")
+    scan_parser.add_argument("--dpi-target", type=int, help="resolution of PDF pages (default: the scan's)")
+    scan_parser.add_argument(
+        "--transfer", default="auto", help="wire format: auto, pnm, tiff, png or jpeg (default: %(default)s)"
+    )
+    scan_parser.add_argument("--agent", action="store_true", help="scan through the scan agent")
+    scan_parser.add_argument("--no-stream", action="store_true", help="copy scans with scp")
+    scan_parser.set_defaults(run=scan)
+
+    devices_parser = commands.add_parser("devices", help="list the scanners of a host")
+    devices_parser.add_argument("userhost", help="user@host of the machine running SANE")
+    devices_parser.set_defaults(run=devices)
+
+    return main_parser
+
+
+def main(argv=None) -> int:
+    """Entry point of the bridge command"""
+    args = parser().parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
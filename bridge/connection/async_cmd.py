@@ -0,0 +1,183 @@
+"""
+asyncio counterpart of the CMD module
+
+Lets one event loop drive many commands at once, without the reader threads CMD needs
+"""
+
+import asyncio
+import io
+import os
+
+from bridge.connection.cmd import CHUNK_SIZE, kill_process
+
+
+class AsyncCMD:
+    """
+    Asynchronous command instance
+
+    Either await run() to capture the whole output, or await start() then
+    iterate iter_stdout() / iter_stderr() as the output arrives
+
+    Args:
+        cmd: cmd string to execute
+        binary: yield stdout as raw byte chunks instead of text lines (optional, default: False)
+    """
+
+    __slots__ = ["_cmd", "_binary", "_proc", "_stdout", "_stderr", "_returncode", "_cancelled"]
+
+    def __init__(self, cmd: str, binary: bool = False):
+        self._cmd = cmd
+        self._binary = binary
+
+        self._proc = None
+        self._stdout = None
+        self._stderr = None
+        self._returncode = None
+        self._cancelled = False
+
+    async def start(self) -> "AsyncCMD":
+        """Start the subprocess without waiting for it"""
+        self._proc = await asyncio.create_subprocess_shell(
+            self._cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=os.name != "nt",
+        )
+        return self
+
+    async def iter_stdout(self):
+        """Iterate over stdout, as text lines or byte chunks depending on the binary flag"""
+        async for item in iter_reader(self._proc.stdout, self._binary):
+            yield item
+
+    async def iter_stderr(self):
+        """Iterate over stderr as text lines"""
+        async for item in iter_reader(self._proc.stderr, False):
+            yield item
+
+    async def wait(self) -> int:
+        """Wait for the process to exit, returning the returncode"""
+        self._returncode = await self._proc.wait()
+        return self._returncode
+
+    async def run(
+        self,
+        stream: bool = False,
+        sink=None,
+        timeout: None | float = None,
+        stderr_sink=None,
+    ) -> "AsyncCMD":
+        """
+        Execute the stored command, capturing its output
+
+        Cancelling the awaiting task kills the process
+
+        Args:
+            stream: print text output as it arrives if True, default False
+            sink: binary mode only, object with a write(bytes) method that stdout
+                chunks are passed to as they arrive instead of being cached (optional)
+            timeout: seconds to wait before killing the process and raising
+                TimeoutError (optional, default: wait forever)
+            stderr_sink: binary mode only, as sink but for stderr (optional)
+        """
+        if self._proc is None:
+            await self.start()
+
+        stdout_cache = io.BytesIO() if self._binary else []
+        stderr_cache = []
+
+        async def capture_stdout():
+            if self._binary:
+                target = stdout_cache if sink is None else sink
+                async for chunk in self.iter_stdout():
+                    target.write(chunk)
+                return
+
+            async for line in self.iter_stdout():
+                if stream:
+                    print(line, end="")
+                stdout_cache.append(line)
+
+        async def capture_stderr():
+            if stderr_sink is not None and self._binary:
+                async for chunk in iter_reader(self._proc.stderr, True):
+                    stderr_sink.write(chunk)
+                return
+
+            async for line in self.iter_stderr():
+                if stream:
+                    print(line, end="")
+                stderr_cache.append(line)
+
+        timed_out = False
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(capture_stdout(), capture_stderr(), self.wait()),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            timed_out = True
+            self.kill()
+            await self.wait()
+        except asyncio.CancelledError:
+            self._cancelled = True
+            self.kill()
+            raise
+        finally:
+            if self._binary:
+                self._stdout = stdout_cache.getvalue()
+            else:
+                self._stdout = "".join(stdout_cache)
+            self._stderr = "".join(stderr_cache)
+
+        if timed_out:
+            raise TimeoutError(f"command timed out after {timeout}s: {self._cmd}")
+
+        return self
+
+    def kill(self) -> None:
+        """Kill the process, along with anything else in its process group"""
+        if self._proc is not None and self._proc.returncode is None:
+            kill_process(self._proc)
+
+    @property
+    def binary(self) -> bool:
+        """Returns True if stdout is captured as bytes"""
+        return self._binary
+
+    @property
+    def returncode(self) -> None | int:
+        """Access the returncode of the subprocess"""
+        return self._returncode
+
+    @property
+    def cancelled(self) -> bool:
+        """Returns True if the awaiting task was cancelled"""
+        return self._cancelled
+
+    @property
+    def stdout(self) -> None | str | bytes:
+        """Returns the captured stdout (bytes in binary mode, empty if a sink was used)"""
+        return self._stdout
+
+    @property
+    def stderr(self) -> None | str:
+        """Returns the captured stderr"""
+        return self._stderr
+
+
+async def iter_reader(reader: asyncio.StreamReader, binary: bool = False):
+    """
+    Iterate over an asyncio stream
+
+    :param reader:
+        subprocess stream
+    :param binary:
+        yield byte chunks if True, otherwise decoded lines
+    """
+    if binary:
+        while chunk := await reader.read(CHUNK_SIZE):
+            yield chunk
+    else:
+        while line := await reader.readline():
+            yield line.decode(errors="replace")
@@ -2,58 +2,181 @@
 Small module to handle an instance of a command execution
 """
 
+import io
+import os
+import signal
 import subprocess
 import threading
 
+CHUNK_SIZE = 64 * 1024
+
+
+class CancelHandle:
+    """
+    Handle for cancelling running commands from another thread
+
+    Pass the same handle to one or more CMD.exec() calls, then cancel() it
+    """
+
+    __slots__ = ["_event", "_callbacks", "_lock"]
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        """Returns True once cancel() has been called"""
+        return self._event.is_set()
+
+    def add_callback(self, callback) -> None:
+        """
+        Register a function to call on cancellation
+
+        Called immediately if the handle was already cancelled
+        """
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback) -> None:
+        """Forget a previously registered function"""
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def cancel(self) -> None:
+        """Cancel, calling every registered function"""
+        with self._lock:
+            self._event.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+
+        for callback in callbacks:
+            callback()
+
 
 class CMD:
     """
     Command instance
 
     Set up the command then exec() the instance
+
+    Args:
+        cmd: cmd string to execute
+        binary: capture stdout as raw bytes instead of text (optional, default: False)
     """
 
-    __slots__ = ["_cmd", "_stdout", "_stderr", "_returncode"]
+    __slots__ = ["_cmd", "_binary", "_stdout", "_stderr", "_returncode", "_cancelled"]
 
-    def __init__(self, cmd: str):
+    def __init__(self, cmd: str, binary: bool = False):
         self._cmd = cmd
+        self._binary = binary
 
         self._stdout = None
         self._stderr = None
         self._returncode = None
+        self._cancelled = False
 
-    def exec(self, stream: bool = False) -> None:
+    def exec(
+        self,
+        stream: bool = False,
+        sink=None,
+        timeout: None | float = None,
+        cancel: None | CancelHandle = None,
+        stderr_sink=None,
+    ) -> None:
         """
         Generates a subprocess instance to execute the stored command
+
+        Blocks until the process exits, is cancelled or times out. The process
+        is started in its own process group, which is killed as a whole
+
+        In binary mode, output is read in fixed size chunks. Passing sinks
+        (see bridge.connection.sinks) keeps memory use bounded however much
+        the command prints
+
+        Args:
+            stream: print output as it arrives if True, default False
+            sink: binary mode only, object with a write(bytes) method that stdout
+                chunks are written to as they arrive instead of being cached (optional)
+            timeout: seconds to wait before killing the process and raising
+                TimeoutError (optional, default: wait forever)
+            cancel: CancelHandle that kills the process when cancelled (optional)
+            stderr_sink: binary mode only, as sink but for stderr (optional)
         """
         with subprocess.Popen(
             self._cmd,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             shell=True,
-            text=True,
+            text=not self._binary,
+            start_new_session=os.name != "nt",
             # executable="bash"
         ) as proc:
+            def kill():
+                self._cancelled = True
+                kill_process(proc)
+
+            if cancel is not None:
+                cancel.add_callback(kill)
+
             stdout_cache = []
-            stdout_thread = threading.Thread(
-                target=stream_capture, args=[proc.stdout, stdout_cache, stream]
-            )
+            if self._binary:
+                stdout_cache = io.BytesIO()
+                stdout_thread = threading.Thread(
+                    target=chunk_capture,
+                    args=[proc.stdout, stdout_cache if sink is None else sink],
+                )
+            else:
+                stdout_thread = threading.Thread(
+                    target=stream_capture, args=[proc.stdout, stdout_cache, stream]
+                )
             stderr_cache = []
-            stderr_thread = threading.Thread(
-                target=stream_capture, args=[proc.stderr, stderr_cache, stream]
-            )
+            if self._binary and stderr_sink is not None:
+                stderr_thread = threading.Thread(
+                    target=chunk_capture, args=[proc.stderr, stderr_sink]
+                )
+            else:
+                stderr_thread = threading.Thread(
+                    target=stream_capture, args=[proc.stderr, stderr_cache, stream]
+                )
 
             stdout_thread.start()
             stderr_thread.start()
 
-            while proc.poll() is None:
-                pass
+            timed_out = False
+            try:
+                proc.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                timed_out = True
+                kill_process(proc)
+                proc.wait()
+            finally:
+                if cancel is not None:
+                    cancel.remove_callback(kill)
 
             stdout_thread.join()
             stderr_thread.join()
 
-            self._stdout = "".join(stdout_cache)
-            self._stderr = "".join(stderr_cache)
+            if self._binary:
+                self._stdout = stdout_cache.getvalue()
+                self._stderr = b"".join(stderr_cache).decode(errors="replace")
+            else:
+                self._stdout = "".join(stdout_cache)
+                self._stderr = "".join(stderr_cache)
+            self._returncode = proc.returncode
+
+        if timed_out:
+            raise TimeoutError(f"command timed out after {timeout}s: {self._cmd}")
+
+    @property
+    def binary(self) -> bool:
+        """Returns True if stdout is captured as bytes"""
+        return self._binary
 
     @property
     def returncode(self) -> None | int:
@@ -62,8 +185,13 @@ class CMD:
         return self._returncode
 
     @property
-    def stdout(self) -> None | str:
-        """Returns the captured stdout"""
+    def cancelled(self) -> bool:
+        """Returns True if the process was killed through a CancelHandle"""
+        return self._cancelled
+
+    @property
+    def stdout(self) -> None | str | bytes:
+        """Returns the captured stdout (bytes in binary mode, empty if a sink was used)"""
         return self._stdout
 
     @property
@@ -79,7 +207,7 @@ def stream_capture(pipe, cache: list, passthrough: bool = False) -> None:
     Stores the output in place within the provided cache
 
     :param pipe:
-        subprocess redirect
+        subprocess redirect, text or binary
     :param cache:
         list to cache lines into
     :param passthrough:
@@ -87,12 +215,40 @@ def stream_capture(pipe, cache: list, passthrough: bool = False) -> None:
     :return:
         None
     """
-    for line in iter(pipe.readline, ""):
+    sentinel = "" if isinstance(pipe, io.TextIOBase) else b""
+    for line in iter(pipe.readline, sentinel):
         if passthrough:
-            print(line, end="")
+            print(line if sentinel == "" else line.decode(errors="replace"), end="")
         cache.append(line)
 
 
+def chunk_capture(pipe, sink) -> None:
+    """
+    Captures a binary pipe in chunks, used with threading like stream_capture
+
+    :param pipe:
+        binary subprocess redirect
+    :param sink:
+        object with a write(bytes) method to pass chunks to as they arrive
+    :return:
+        None
+    """
+    for chunk in iter(lambda: pipe.read1(CHUNK_SIZE), b""):
+        sink.write(chunk)
+
+
+def kill_process(proc: subprocess.Popen) -> None:
+    """Kill proc along with anything else in its process group"""
+    try:
+        if os.name == "nt":
+            proc.kill()
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        # already exited
+        pass
+
+
 if __name__ == "__main__":
     TEST_CMD = """for ((i=0; i < 10; i++)); do
     echo $i
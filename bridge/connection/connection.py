@@ -2,20 +2,38 @@
 The Connection class handles ssh calls to the remote host
 """
 
-from bridge.connection.cmd import CMD
+import asyncio
+import os
+import shlex
+import tempfile
+import threading
+import time
+
+from bridge.connection.async_cmd import AsyncCMD
+from bridge.connection.cmd import CMD, CancelHandle
+
+# characters with a special meaning in the extended regex used by pkill
+REGEX_SPECIAL = set(".^$*+?()[]{}|\\")
 
 
 class Connection:
     """
     Represents a connection to a remote machine
 
+    Remote commands are multiplexed over a single persistent ssh master
+    session (ControlMaster), so only the first command pays for the key
+    exchange. The master is opened on demand, or ahead of time with connect()
+
     Args:
         userhost: user@host string
+        multiplex: share one master session between commands
+            (optional, default: True except on Windows, where OpenSSH has no ControlMaster)
+        persist: seconds the idle master is kept open (optional, default: 600)
     """
 
-    __slots__ = ["_user", "_host", "_cmd_obj"]
+    __slots__ = ["_user", "_host", "_cmd_obj", "_multiplex", "_persist", "_latency"]
 
-    def __init__(self, userhost: str):
+    def __init__(self, userhost: str, multiplex: bool | None = None, persist: int = 600):
 
         if "@" in userhost:
             user, host = userhost.split("@")
@@ -26,6 +44,13 @@ class Connection:
         self._user: str = user
         self._host: str = host
 
+        if multiplex is None:
+            multiplex = os.name != "nt"
+
+        self._multiplex: bool = multiplex
+        self._persist: int = persist
+        self._latency: None | float = None
+
         self._cmd_obj: None | CMD = None
 
     @property
@@ -45,12 +70,56 @@ class Connection:
             return self.host
         return f"{self.user}@{self.host}"
 
+    @property
+    def multiplex(self) -> bool:
+        """Returns True if commands share a master session"""
+        return self._multiplex
+
+    @property
+    def control_path(self) -> str:
+        """Returns the socket path of the master session (%C is expanded by ssh)"""
+        return os.path.join(tempfile.gettempdir(), "pysanebridge-%C")
+
+    @property
+    def latency(self) -> None | float:
+        """Returns the round trip time of the last ping() in seconds"""
+        return self._latency
+
+    @property
+    def ssh_options(self) -> str:
+        """Returns the option string shared by ssh and scp calls"""
+        options = ["-o", "ServerAliveInterval=30"]
+        if self.multiplex:
+            options += [
+                "-o", "ControlMaster=auto",
+                "-o", f"ControlPath={self.control_path}",
+                "-o", f"ControlPersist={self._persist}",
+            ]
+        return " ".join(shlex.quote(opt) for opt in options)
+
+    def ssh_command(self, cmd: str) -> str:
+        """
+        Wrap cmd in the ssh call that runs it on the remote machine
+
+        cmd is quoted as a whole, so it reaches the remote shell unchanged
+        rather than being expanded ($?, globs) by the local one
+
+        Args:
+            cmd: cmd string to execute remotely
+        """
+        return f"ssh {self.ssh_options} {self.userhost} {shlex.quote(cmd)}"
+
     def cmd(
         self,
         cmd: str,
         local: bool = False,
         verbose: bool = False,
         stream: bool = False,
+        binary: bool = False,
+        sink=None,
+        timeout: None | float = None,
+        cancel: None | CancelHandle = None,
+        stderr_sink=None,
     ) -> CMD:
         """
         Execute a command on the remote machine
@@ -60,14 +129,214 @@ class Connection:
             local: Executes locally if True (optional, default: False)
             verbose: Prints verbose info if True
             stream: Stream output if True, default False
+            binary: Capture stdout as bytes if True, default False
+            sink: object with a write(bytes) method that binary stdout is passed to
+                as it arrives, see bridge.connection.sinks (optional)
+            timeout: seconds before the command is killed and TimeoutError is raised (optional)
+            cancel: CancelHandle that kills the command when cancelled (optional)
+            stderr_sink: as sink, but for stderr (optional)
+
+        Killing a remote command also kills its remote process, since closing
+        the ssh channel alone leaves e.g. a hung scanimage running
         """
+        remote_cmd = cmd
         if not local:
-            cmd = f'ssh {self.userhost} "{cmd}"'
+            cmd = self.ssh_command(cmd)
 
         if verbose:
             print(f"executing command {cmd}")
 
-        self._cmd_obj = CMD(cmd)
-        self._cmd_obj.exec(stream=stream)
+        def kill_remote():
+            # cancel() may come from the GUI thread, so don't wait on the round trip
+            threading.Thread(target=self.kill_remote, args=[remote_cmd], daemon=True).start()
+
+        if cancel is not None and not local:
+            cancel.add_callback(kill_remote)
+
+        # commands run from several threads at once (batch pages), so the
+        # result returned must be this call's own
+        cmd_obj = self._cmd_obj = CMD(cmd, binary=binary)
+        try:
+            cmd_obj.exec(
+                stream=stream, sink=sink, timeout=timeout, cancel=cancel, stderr_sink=stderr_sink
+            )
+        except TimeoutError:
+            if not local:
+                self.kill_remote(remote_cmd)
+            raise
+        finally:
+            if cancel is not None and not local:
+                cancel.remove_callback(kill_remote)
+
+        return cmd_obj
+
+    def kill_remote(self, cmd: str) -> None:
+        """
+        Kill any remote process running cmd
+
+        Args:
+            cmd: the remote cmd string, as passed to cmd()
+        """
+        CMD(self.ssh_command(f"pkill -f -- {shlex.quote(kill_pattern(cmd))}")).exec(timeout=30)
+
+    async def run(
+        self,
+        cmd: str,
+        local: bool = False,
+        verbose: bool = False,
+        stream: bool = False,
+        binary: bool = False,
+        sink=None,
+        timeout: None | float = None,
+        stderr_sink=None,
+    ) -> AsyncCMD:
+        """
+        Execute a command on the remote machine from an asyncio event loop
+
+        Takes the same arguments as cmd(), cancelling the awaiting task takes
+        the place of a CancelHandle. Either way the remote process is killed too
+
+        Args:
+            cmd: cmd string to execute
+            local: Executes locally if True (optional, default: False)
+            verbose: Prints verbose info if True
+            stream: Stream output if True, default False
+            binary: Capture stdout as bytes if True, default False
+            sink: object with a write(bytes) method that binary stdout is passed to
+                as it arrives, see bridge.connection.sinks (optional)
+            timeout: seconds before the command is killed and TimeoutError is raised (optional)
+            stderr_sink: as sink, but for stderr (optional)
+        """
+        proc = await self.open(cmd, local=local, verbose=verbose, binary=binary)
+        try:
+            await proc.run(stream=stream, sink=sink, timeout=timeout, stderr_sink=stderr_sink)
+        except (TimeoutError, asyncio.CancelledError):
+            if not local:
+                await asyncio.shield(self.akill_remote(cmd))
+            raise
+
+        return proc
+
+    async def open(
+        self,
+        cmd: str,
+        local: bool = False,
+        verbose: bool = False,
+        binary: bool = False,
+    ) -> AsyncCMD:
+        """
+        Start a command and return it without waiting, for use with
+        AsyncCMD.iter_stdout() / iter_stderr()
 
-        return self._cmd_obj
+        Args:
+            cmd: cmd string to execute
+            local: Executes locally if True (optional, default: False)
+            verbose: Prints verbose info if True
+            binary: stdout is iterated as bytes if True, default False
+        """
+        if not local:
+            cmd = self.ssh_command(cmd)
+
+        if verbose:
+            print(f"executing command {cmd}")
+
+        return await AsyncCMD(cmd, binary=binary).start()
+
+    async def akill_remote(self, cmd: str) -> None:
+        """
+        Kill any remote process running cmd, see kill_remote()
+
+        Args:
+            cmd: the remote cmd string, as passed to run()
+        """
+        await AsyncCMD(self.ssh_command(f"pkill -f -- {shlex.quote(kill_pattern(cmd))}")).run(timeout=30)
+
+    async def aping(self) -> None | float:
+        """
+        Time a no-op round trip to the remote machine, see ping()
+
+        Returns the latency in seconds, or None if the host could not be reached
+        """
+        start = time.perf_counter()
+        result = await self.run("true")
+        if result.returncode != 0:
+            self._latency = None
+        else:
+            self._latency = time.perf_counter() - start
+
+        return self._latency
+
+    def copy(self, remote: str, local: str = ".", verbose: bool = False) -> CMD:
+        """
+        Copy a file from the remote machine, through the master session if there is one
+
+        Args:
+            remote: path on the remote machine
+            local: local target path (optional, default: ".")
+            verbose: Prints verbose info if True
+        """
+        cmd = f"scp {self.ssh_options} {self.userhost}:{remote} {shlex.quote(local)}"
+        return self.cmd(cmd, local=True, verbose=verbose)
+
+    def is_connected(self) -> bool:
+        """Returns True if a master session is currently open"""
+        if not self.multiplex:
+            return False
+
+        check = CMD(f"ssh -O check -o {shlex.quote(f'ControlPath={self.control_path}')} {self.userhost}")
+        check.exec()
+        return check.returncode == 0
+
+    def connect(self) -> bool:
+        """
+        Open the master session ahead of the first command
+
+        Returns True if the host could be reached
+        """
+        if self.is_connected():
+            return True
+
+        self.ping()
+        return self._latency is not None
+
+    def ping(self) -> None | float:
+        """
+        Time a no-op round trip to the remote machine
+
+        Returns the latency in seconds, or None if the host could not be reached
+        """
+        start = time.perf_counter()
+        result = self.cmd("true")
+        if result.returncode != 0:
+            self._latency = None
+        else:
+            self._latency = time.perf_counter() - start
+
+        return self._latency
+
+    def close(self) -> None:
+        """Close the master session, if one is open"""
+        if not self.multiplex:
+            return
+
+        CMD(f"ssh -O exit -o {shlex.quote(f'ControlPath={self.control_path}')} {self.userhost}").exec()
+
+
+def kill_pattern(cmd: str) -> str:
+    """
+    Build a pkill -f pattern matching exactly the command line cmd
+
+    The first character is bracketed so that the pattern does not match the
+    command line of the shell running pkill itself. For a pipeline only the
+    first command is matched, e.g. scanimage in scanimage | gzip, which takes
+    its shell with it and leaves the rest of the pipeline to see end of input.
+    The same goes for the first command of a group, { scanimage; echo; } | gzip
+
+    Args:
+        cmd: cmd string to match
+    """
+    cmd = cmd.split("|")[0].strip().removeprefix("{").split(";")[0].strip()
+    pattern = "".join(f"\\{char}" if char in REGEX_SPECIAL else char for char in cmd[1:])
+    if cmd[0].isalnum():
+        return f"[{cmd[0]}]{pattern}"
+    return f"\\{cmd[0]}{pattern}"
@@ -0,0 +1,56 @@
+"""
+Runs an asyncio event loop on a background thread
+
+Lets synchronous code (such as the Qt frontend) share one loop for all async
+commands, while headless code can simply use asyncio.run()
+"""
+
+import asyncio
+import concurrent.futures
+import threading
+
+
+class BackgroundLoop:
+    """
+    An asyncio event loop living on a daemon thread
+
+    Coroutines are handed over with submit(), which returns a
+    concurrent.futures.Future that is safe to wait on from any thread
+    """
+
+    __slots__ = ["_loop", "_thread"]
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """Returns the underlying event loop"""
+        return self._loop
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        """
+        Schedule a coroutine on the loop
+
+        Args:
+            coro: coroutine to run
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro, timeout: None | float = None):
+        """
+        Run a coroutine on the loop and block until it returns
+
+        Args:
+            coro: coroutine to run
+            timeout: seconds to wait for the result (optional)
+        """
+        return self.submit(coro).result(timeout=timeout)
+
+    def stop(self) -> None:
+        """Stop the loop and wait for its thread to exit"""
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
@@ -0,0 +1,256 @@
+"""
+Output sinks for binary command capture
+
+Any object with a write(bytes) method can be passed to CMD.exec() as a sink,
+these cover the common cases while keeping memory use bounded
+"""
+
+import tempfile
+import time
+import zlib
+
+
+class Sink:
+    """
+    Base class for sinks
+
+    Receives output chunks through write(), and can be used as a context
+    manager to close() any resources it holds
+    """
+
+    __slots__ = ["_size"]
+
+    def __init__(self):
+        self._size = 0
+
+    @property
+    def size(self) -> int:
+        """Returns the total number of bytes written so far"""
+        return self._size
+
+    def write(self, data: bytes) -> int:
+        """
+        Receive a chunk of output
+
+        Args:
+            data: chunk to store
+        """
+        self._size += len(data)
+        return len(data)
+
+    def close(self) -> None:
+        """Release any held resources"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class CallbackSink(Sink):
+    """
+    Passes each chunk to a function, storing nothing
+
+    Args:
+        callback: function called with every chunk
+    """
+
+    __slots__ = ["_callback"]
+
+    def __init__(self, callback):
+        super().__init__()
+        self._callback = callback
+
+    def write(self, data: bytes) -> int:
+        self._callback(data)
+        return super().write(data)
+
+
+class FileSink(Sink):
+    """
+    Writes chunks straight to a file
+
+    Args:
+        file: path to open for writing, or an already open binary file object
+            (which is left open on close)
+    """
+
+    __slots__ = ["_file", "_owned"]
+
+    def __init__(self, file):
+        super().__init__()
+        self._owned = isinstance(file, str)
+        self._file = open(file, "wb") if self._owned else file
+
+    def write(self, data: bytes) -> int:
+        self._file.write(data)
+        return super().write(data)
+
+    def close(self) -> None:
+        if self._owned:
+            self._file.close()
+
+
+class RingBufferSink(Sink):
+    """
+    Keeps only the most recent output, e.g. the tail of a chatty log
+
+    Args:
+        maxsize: number of bytes to keep
+    """
+
+    __slots__ = ["_maxsize", "_buffer"]
+
+    def __init__(self, maxsize: int = 64 * 1024):
+        super().__init__()
+        self._maxsize = maxsize
+        self._buffer = bytearray()
+
+    @property
+    def dropped(self) -> int:
+        """Returns the number of bytes discarded to stay within maxsize"""
+        return self.size - len(self._buffer)
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data[-self._maxsize:]
+        if len(self._buffer) > self._maxsize:
+            del self._buffer[:len(self._buffer) - self._maxsize]
+        return super().write(data)
+
+    def getvalue(self) -> bytes:
+        """Returns the retained output"""
+        return bytes(self._buffer)
+
+
+class SpoolSink(Sink):
+    """
+    Buffers output in memory, moving it to a temporary file past a size limit
+
+    Args:
+        max_memory: bytes to hold in memory before spilling to disk
+    """
+
+    __slots__ = ["_file"]
+
+    def __init__(self, max_memory: int = 16 * 1024 * 1024):
+        super().__init__()
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_memory)
+
+    @property
+    def spilled(self) -> bool:
+        """Returns True if the output has been moved to disk"""
+        return self._file._rolled  # pylint: disable=protected-access
+
+    def write(self, data: bytes) -> int:
+        self._file.write(data)
+        return super().write(data)
+
+    def open(self):
+        """Rewind and return the underlying file object for reading"""
+        self._file.seek(0)
+        return self._file
+
+    def getvalue(self) -> bytes:
+        """Returns the whole output, reading it back from disk if it was spilled"""
+        return self.open().read()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class LineSink(Sink):
+    """
+    Splits output into text lines, passing each complete line to a function
+
+    Args:
+        callback: function called with every line, without its newline
+    """
+
+    __slots__ = ["_callback", "_partial"]
+
+    def __init__(self, callback):
+        super().__init__()
+        self._callback = callback
+        self._partial = b""
+
+    def write(self, data: bytes) -> int:
+        *lines, self._partial = (self._partial + data).split(b"\n")
+        for line in lines:
+            self._callback(line.decode(errors="replace"))
+        return super().write(data)
+
+    def close(self) -> None:
+        """Pass on any final line that had no trailing newline"""
+        if self._partial:
+            self._callback(self._partial.decode(errors="replace"))
+            self._partial = b""
+
+
+class DecompressSink(Sink):
+    """
+    Inflates a gzip (or zlib) stream as it arrives, passing the output on
+
+    size counts the decompressed bytes, compressed the bytes received
+
+    Args:
+        sink: object with a write(bytes) method for the decompressed output
+    """
+
+    __slots__ = ["_sink", "_inflate", "_compressed"]
+
+    def __init__(self, sink):
+        super().__init__()
+        self._sink = sink
+        # 32 + 15: accept either a gzip or a zlib header
+        self._inflate = zlib.decompressobj(wbits=47)
+        self._compressed = 0
+
+    @property
+    def compressed(self) -> int:
+        """Returns the number of compressed bytes received"""
+        return self._compressed
+
+    def write(self, data: bytes) -> int:
+        self._compressed += len(data)
+        self._emit(self._inflate.decompress(data))
+        return len(data)
+
+    def close(self) -> None:
+        """Pass on whatever the decompressor still holds"""
+        self._emit(self._inflate.flush())
+
+    def _emit(self, data: bytes) -> None:
+        if data:
+            self._sink.write(data)
+            super().write(data)
+
+
+class MeterSink(Sink):
+    """
+    Passes chunks on unchanged, noting when the first one arrived
+
+    Splits a streamed command into the wait for output (e.g. the scanner
+    warming up and moving) and the transfer of it
+
+    Args:
+        sink: object with a write(bytes) method for the output
+    """
+
+    __slots__ = ["_sink", "_first"]
+
+    def __init__(self, sink):
+        super().__init__()
+        self._sink = sink
+        self._first = None
+
+    @property
+    def first(self) -> None | float:
+        """Returns the time.perf_counter() of the first chunk, None if nothing arrived"""
+        return self._first
+
+    def write(self, data: bytes) -> int:
+        if self._first is None and data:
+            self._first = time.perf_counter()
+        self._sink.write(data)
+        return super().write(data)
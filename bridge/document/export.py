@@ -0,0 +1,205 @@
+"""
+PDF export, with pages resampled and encoded in parallel
+"""
+
+import io
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import pymupdf
+from PIL import Image
+
+from bridge.connection.cmd import CancelHandle
+from bridge.document.page import Page, PDFPageRef
+
+# JPEG quality of exported colour and grey pages
+QUALITY = 85
+
+
+def render_page(image: Image, scale: float, quality: int = QUALITY) -> bytes:
+    """
+    Resample a page and encode it for embedding, run in a worker process
+
+    Colour and grey pages become JPEG, bilevel and palette pages PNG, which
+    keeps them sharp
+
+    Args:
+        image: the page
+        scale: resampling factor, 1 or more leaves the pixels alone
+        quality: JPEG quality (optional, default: QUALITY)
+    """
+    if scale < 1:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.Resampling.LANCZOS)
+
+    buffer = io.BytesIO()
+    if image.mode in ("1", "P"):
+        image.save(buffer, format="PNG", optimize=False)
+    else:
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+class PDFExporter:
+    """
+    Writes pages to a PDF, one at a time
+
+    Pages are taken from the iterable given to export() only as workers free
+    up, and resampled and encoded on a process pool while earlier ones are
+    added, so only a few are decoded at once. The encoded pages (about
+    0.15 MB at 100 dpi to 2 MB at 400 dpi each) are held by pymupdf until
+    the file is saved, so memory does grow with the size of the output,
+    though not with the decoded document. Pages of a loaded PDF are copied
+    across as they are, keeping their text and vectors. The file is written
+    under a temporary name and only replaces filename once complete
+
+    Args:
+        filename: output path
+        dpi_target: resolution of the exported pages
+        workers: worker processes (optional, default: one per core)
+        quality: JPEG quality (optional, default: QUALITY)
+    """
+
+    __slots__ = ["_filename", "_dpi_target", "_workers", "_quality"]
+
+    def __init__(
+        self,
+        filename: str,
+        dpi_target: int = 100,
+        workers: None | int = None,
+        quality: int = QUALITY,
+    ):
+        self._filename = filename
+        self._dpi_target = dpi_target
+        self._workers = workers or os.cpu_count() or 1
+        self._quality = quality
+
+    @property
+    def filename(self) -> str:
+        """Returns the output path"""
+        return self._filename
+
+    @property
+    def dpi_target(self) -> int:
+        """Returns the resolution of the exported pages"""
+        return self._dpi_target
+
+    def export(
+        self,
+        pages,
+        default_dpi: float,
+        progress=None,
+        cancel: None | CancelHandle = None,
+        total: None | int = None,
+    ) -> None:
+        """
+        Write the pages out to the PDF
+
+        Each page is scaled from its own resolution to dpi_target, and never
+        up. A page that needs no scaling and kept its encoded data (e.g. a
+        JPEG) is embedded as it is, without decoding it, and a page of a loaded
+        PDF is copied from it without being rendered
+
+        Raises InterruptedError if cancelled, leaving no output behind
+
+        Args:
+            pages: Page objects (or plain images), in order, in a list or any
+                iterable, e.g. a generator fetching them from a PageStore
+            default_dpi: resolution of pages that do not know theirs
+            progress: function called with (pages done, total) after each page (optional)
+            cancel: CancelHandle that stops the export (optional)
+            total: number of pages expected, for progress, needed if pages has
+                no len(). Pages may turn out fewer (e.g. deleted while the export
+                runs), progress then ends on the number written (optional)
+        """
+        if total is None:
+            total = len(pages)
+        temp = f"{self._filename}.part"
+
+        # spawned rather than forked, as forking a process running Qt threads is unsafe
+        context = multiprocessing.get_context("spawn")
+        doc = pymupdf.open()
+        # loaded PDFs that pages are copied from, opened once each, by id of their data
+        sources = {}
+        try:
+            with ProcessPoolExecutor(max_workers=self._workers, mp_context=context) as pool:
+                in_flight = []
+                remaining = iter(pages)
+                done = 0
+                while True:
+                    # keep every worker busy, with one page queued behind each
+                    while len(in_flight) < 2 * self._workers:
+                        page = next(remaining, None)
+                        if page is None:
+                            break
+                        in_flight.append(self._submit(pool, page, default_dpi))
+                    if not in_flight:
+                        break
+
+                    rect, data = in_flight.pop(0)
+                    if isinstance(data, Future):
+                        data = data.result()
+                    if cancel is not None and cancel.cancelled:
+                        for _, pending in in_flight:
+                            if isinstance(pending, Future):
+                                pending.cancel()
+                        raise InterruptedError(f"export cancelled after {done} of {total} pages")
+
+                    if isinstance(data, PDFPageRef):
+                        self._copy_page(doc, sources, data)
+                    else:
+                        pdf_page = doc.new_page(width=rect[0], height=rect[1])
+                        pdf_page.insert_image(pdf_page.rect, stream=data)
+
+                    done += 1
+                    if progress is not None:
+                        progress(done, max(done, total))
+
+            if done == 0:
+                raise RuntimeError("no pages to export")
+            if done != total and progress is not None:
+                progress(done, done)
+            doc.save(temp, garbage=1, deflate=True)
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        finally:
+            for source in sources.values():
+                source.close()
+            doc.close()
+
+        os.replace(temp, self._filename)
+
+    def _submit(self, pool: ProcessPoolExecutor, page, default_dpi: float) -> tuple:
+        """
+        Returns the page size in points, and either the data to embed, the
+        PDFPageRef to copy, or the Future of a worker preparing the data
+        """
+        if not isinstance(page, Page):
+            page = Page(page)
+
+        if page.pdf is not None:
+            # a loaded PDF page carries its own size, and is never resampled
+            return None, page.pdf
+
+        dpi = page.dpi or default_dpi
+        # the page keeps the physical size of the scan
+        rect = (page.size[0] / dpi * 72, page.size[1] / dpi * 72)
+
+        scale = self._dpi_target / dpi
+        if scale >= 1 and page.encoded is not None:
+            return rect, page.encoded
+        return rect, pool.submit(render_page, page.image, scale, self._quality)
+
+    @staticmethod
+    def _copy_page(doc: pymupdf.Document, sources: dict, ref: PDFPageRef) -> None:
+        """Append a page of a loaded PDF to doc, as it is"""
+        source = sources.get(id(ref.data))
+        if source is None:
+            source = pymupdf.open(stream=ref.data, filetype="pdf")
+            sources[id(ref.data)] = source
+        doc.insert_pdf(source, from_page=ref.number, to_page=ref.number)
@@ -0,0 +1,70 @@
+"""
+Loading of image and PDF files, several at once
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from bridge.connection.cmd import CancelHandle
+from bridge.document.page import Page
+
+
+def load_file(path: str, dpi: float) -> list:
+    """
+    Returns the pages of a file
+
+    PDF pages are not rendered, image files keep their own resolution, and
+    their data if a PDF can hold it as is
+
+    Args:
+        path: image or PDF file
+        dpi: resolution PDF pages are rendered at when needed
+    """
+    if os.path.splitext(path)[1].lower() == ".pdf":
+        return Page.from_pdf(path, dpi)
+    return [Page.from_file(path)]
+
+
+def load_files(
+    paths: list,
+    dpi: float,
+    workers: None | int = None,
+    cancel: None | CancelHandle = None,
+):
+    """
+    Load files on a thread pool, yielding (path, pages, error) in the order of paths
+
+    Decoding releases the GIL, so files are decoded in parallel. Only a few
+    files are loaded ahead of the one being yielded, so memory stays bounded
+    however many are asked for. A file that fails yields no pages and the error
+
+    Args:
+        paths: files to load
+        dpi: resolution PDF pages are rendered at when needed
+        workers: files loaded at once (optional, default: one per core)
+        cancel: CancelHandle that stops loading further files (optional)
+    """
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = []
+        remaining = iter(paths)
+        try:
+            while True:
+                # keep every worker busy, with one file queued behind each
+                while len(in_flight) < 2 * workers and not (cancel is not None and cancel.cancelled):
+                    path = next(remaining, None)
+                    if path is None:
+                        break
+                    in_flight.append((path, pool.submit(load_file, path, dpi)))
+                if not in_flight:
+                    return
+
+                path, future = in_flight.pop(0)
+                try:
+                    yield path, future.result(), None
+                except (OSError, ValueError, RuntimeError) as ex:
+                    # PIL raises OSError subclasses for unreadable files, pymupdf RuntimeError ones
+                    yield path, [], ex
+        finally:
+            for _, future in in_flight:
+                future.cancel()
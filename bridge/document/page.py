@@ -0,0 +1,252 @@
+"""
+A page of the document, with its resolution and the data it came from
+"""
+
+import io
+import math
+
+from PIL import Image
+
+from bridge.document.rendercache import content_digest
+
+# formats a PDF can hold without decoding: JPEG (DCT) and JPEG 2000 (JPX),
+# group 4 fax TIFF (CCITT) is checked for separately
+PASSTHROUGH = {"JPEG", "JPEG2000"}
+# pymupdf ignores this much of a pixel when rounding a page out to whole pixels
+PIXEL_FUZZ = 0.001
+
+
+def is_passthrough(image: Image) -> bool:
+    """Returns True if the file image was opened from can go into a PDF as it is"""
+    if image.format in PASSTHROUGH:
+        return True
+    return image.format == "TIFF" and image.info.get("compression") == "group4"
+
+
+class PDFPageRef:
+    """
+    A page of a loaded PDF, rendered only at the size needed
+
+    The pages of a file share one copy of its data, so the page can still be
+    rendered (or copied as it is) if the file changes on disk
+
+    Args:
+        data: the PDF file content
+        number: page index within the file
+        width: page width in points
+        height: page height in points
+        digest: content digest of data (optional, default: computed)
+    """
+
+    __slots__ = ["_data", "_number", "_width", "_height", "_digest"]
+
+    def __init__(self, data: bytes, number: int, width: float, height: float, digest: None | str = None):
+        self._data = data
+        self._number = number
+        self._width = width
+        self._height = height
+        self._digest = digest if digest is not None else content_digest(data)
+
+    @classmethod
+    def from_file(cls, path: str) -> list:
+        """Returns a reference to every page of the PDF at path"""
+        # pymupdf is only needed once a PDF is involved
+        import pymupdf  # pylint: disable=import-outside-toplevel
+
+        with open(path, "rb") as o:
+            data = o.read()
+        # hashed once for the whole file
+        digest = content_digest(data)
+        with pymupdf.open(stream=data, filetype="pdf") as doc:
+            return [cls(data, page.number, page.rect.width, page.rect.height, digest) for page in doc]
+
+    @property
+    def data(self) -> bytes:
+        """Returns the PDF file content"""
+        return self._data
+
+    @property
+    def number(self) -> int:
+        """Returns the page index"""
+        return self._number
+
+    @property
+    def digest(self) -> str:
+        """Returns the content digest of the file"""
+        return self._digest
+
+    def pixel_size(self, dpi: float) -> tuple:
+        """Returns the (width, height) of the page rendered at dpi"""
+        # rounded outwards, as pymupdf sizes its pixmaps
+        return (
+            math.ceil(self._width / 72 * dpi - PIXEL_FUZZ),
+            math.ceil(self._height / 72 * dpi - PIXEL_FUZZ),
+        )
+
+    def render(self, dpi: float) -> Image:
+        """Returns the page rendered at dpi"""
+        import pymupdf  # pylint: disable=import-outside-toplevel
+
+        # opened per call, as a pymupdf document must not be shared between threads
+        with pymupdf.open(stream=self._data, filetype="pdf") as doc:
+            # a zoom rather than get_pixmap(dpi=), which only takes whole numbers
+            zoom = dpi / 72
+            pix = doc[self._number].get_pixmap(matrix=pymupdf.Matrix(zoom, zoom))
+        return Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+
+
+class Page:
+    """
+    A page: the decoded image, its resolution, and optionally where it came
+    from, either its original encoded data or a page of a loaded PDF. Export
+    uses those instead of encoding the pixels again
+
+    Args:
+        image: decoded page, or None if it is to be decoded (or rendered) when needed
+        dpi: resolution of the page (optional, default: unknown)
+        encoded: original file data of a passthrough format (optional)
+        size: (width, height), needed if image is None (optional)
+        pdf: PDFPageRef to render the page from (optional)
+        origin: (content digest, page index) of the file the page was loaded
+            from, used to find its cached renders (optional)
+    """
+
+    __slots__ = ["_image", "_dpi", "_encoded", "_size", "_pdf", "_origin"]
+
+    def __init__(
+        self,
+        image: None | Image.Image = None,
+        dpi: None | float = None,
+        encoded: None | bytes = None,
+        size: None | tuple = None,
+        pdf: None | PDFPageRef = None,
+        origin: None | tuple = None,
+    ):
+        if image is None and encoded is None and pdf is None:
+            raise ValueError("a page needs an image, encoded data or a PDF page")
+        if pdf is not None and dpi is None:
+            raise ValueError("a PDF page needs the dpi to render it at")
+
+        self._image = image
+        self._dpi = dpi
+        self._encoded = encoded
+        self._pdf = pdf
+        if origin is None and pdf is not None:
+            origin = (pdf.digest, pdf.number)
+        self._origin = origin
+        if size is None:
+            if image is not None:
+                size = image.size
+            elif pdf is not None:
+                size = pdf.pixel_size(dpi)
+            else:
+                # only the header is read
+                with Image.open(io.BytesIO(encoded)) as imgfile:
+                    size = imgfile.size
+        self._size = size
+
+    def __repr__(self):
+        if self._pdf is not None:
+            source = f"PDF page {self._pdf.number + 1}"
+        elif self._encoded is not None:
+            source = f"{len(self._encoded)} encoded bytes"
+        else:
+            source = "decoded"
+        return f"Page({self._size[0]}x{self._size[1]}, {self._dpi} dpi, {source})"
+
+    @classmethod
+    def from_pdf(cls, path: str, dpi: float) -> list:
+        """
+        Create a page for each page of a PDF, without rendering any
+
+        Args:
+            path: PDF file
+            dpi: resolution the pages are rendered at when their pixels are needed
+        """
+        return [cls(dpi=dpi, pdf=ref) for ref in PDFPageRef.from_file(path)]
+
+    @classmethod
+    def from_bytes(cls, data: bytes, dpi: None | float = None, origin: None | tuple = None) -> "Page":
+        """
+        Create a page from an encoded image, keeping the data if it can pass
+        through to a PDF
+
+        Args:
+            data: encoded image, in any format PIL can read
+            dpi: resolution (optional, default: as recorded in the file, if at all)
+            origin: see Page (optional)
+        """
+        with Image.open(io.BytesIO(data)) as imgfile:
+            keep = is_passthrough(imgfile)
+            if dpi is None:
+                dpi = file_dpi(imgfile)
+            image = imgfile.copy()
+
+        return cls(image, dpi=dpi, encoded=data if keep else None, origin=origin)
+
+    @classmethod
+    def from_file(cls, path: str, dpi: None | float = None) -> "Page":
+        """
+        Create a page from an image file, see from_bytes()
+
+        Args:
+            path: image file
+            dpi: resolution (optional, default: as recorded in the file, if at all)
+        """
+        with open(path, "rb") as o:
+            data = o.read()
+        return cls.from_bytes(data, dpi=dpi, origin=(content_digest(data), 0))
+
+    @property
+    def image(self) -> Image:
+        """Returns the decoded page, decoding (or rendering) it if it is not held"""
+        if self._image is not None:
+            return self._image
+        if self._pdf is not None:
+            return self._pdf.render(self._dpi)
+        with Image.open(io.BytesIO(self._encoded)) as imgfile:
+            return imgfile.copy()
+
+    @property
+    def decoded(self) -> bool:
+        """Returns True if the decoded image is held"""
+        return self._image is not None
+
+    @property
+    def dpi(self) -> None | float:
+        """Returns the resolution, None if unknown"""
+        return self._dpi
+
+    @property
+    def pdf(self) -> None | PDFPageRef:
+        """Returns the PDF page this page is rendered from, if any"""
+        return self._pdf
+
+    @property
+    def origin(self) -> None | tuple:
+        """Returns the (content digest, page index) of the file the page was loaded from, if any"""
+        return self._origin
+
+    @property
+    def source(self):
+        """Returns what the page can be remade from: a PDFPageRef, encoded bytes, or None"""
+        return self._pdf if self._pdf is not None else self._encoded
+
+    @property
+    def encoded(self) -> None | bytes:
+        """Returns the original encoded data, None if the page is only held decoded"""
+        return self._encoded
+
+    @property
+    def size(self) -> tuple:
+        """Returns the (width, height) in pixels"""
+        return self._size
+
+
+def file_dpi(image: Image) -> None | float:
+    """Returns the horizontal resolution recorded in an image file, if any"""
+    dpi = image.info.get("dpi")
+    # 1 or 72 dpi is usually a default written by software, not a measurement
+    if not dpi or dpi[0] is None or dpi[0] <= 1 or dpi[0] == 72:
+        return None
+    return float(dpi[0])
@@ -0,0 +1,105 @@
+"""
+Renders and previews of loaded documents, kept on disk between runs
+"""
+
+import hashlib
+import io
+
+from PIL import Image
+
+from bridge.cache import DiskCache, cache_dir
+
+# disk used for cached renders by default
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+
+def content_digest(data: bytes) -> str:
+    """Returns the key of a file's content, the same wherever the file is and whatever it is called"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class RenderCache:
+    """
+    Rendered pages and previews of loaded files, by file content, page and resolution
+
+    As entries are found by content, a file that is renamed or loaded from
+    elsewhere still hits, and a file that changed misses. Entries are stored
+    as fast to decode PNGs
+
+    Args:
+        max_size: bytes of disk to use (optional, default: 512 MiB)
+        directory: where entries go (optional, default: within the user cache)
+    """
+
+    __slots__ = ["_disk"]
+
+    def __init__(self, max_size: int = DEFAULT_CACHE_BYTES, directory: None | str = None):
+        self._disk = DiskCache(directory or cache_dir("renders"), max_size)
+
+    @property
+    def directory(self) -> str:
+        """Returns the cache directory"""
+        return self._disk.directory
+
+    @property
+    def size(self) -> int:
+        """Returns the bytes of disk used"""
+        return self._disk.size
+
+    def get(self, origin: tuple, dpi: float) -> None | Image.Image:
+        """
+        Returns a cached render, None if there is none
+
+        Args:
+            origin: (content digest, page index), see Page.origin
+            dpi: resolution the page was rendered at
+        """
+        return self._load(render_name(origin, f"{dpi:g}dpi"))
+
+    def put(self, origin: tuple, dpi: float, image: Image.Image) -> None:
+        """
+        Cache a render
+
+        Args:
+            origin: (content digest, page index), see Page.origin
+            dpi: resolution the page was rendered at
+            image: the render
+        """
+        self._store(render_name(origin, f"{dpi:g}dpi"), image)
+
+    def get_thumbnail(self, origin: tuple, width: int) -> None | Image.Image:
+        """Returns a cached preview width pixels wide, None if there is none"""
+        return self._load(render_name(origin, f"{width}w"))
+
+    def put_thumbnail(self, origin: tuple, width: int, image: Image.Image) -> None:
+        """Cache a preview width pixels wide"""
+        self._store(render_name(origin, f"{width}w"), image)
+
+    def clear(self) -> None:
+        """Remove every cached render"""
+        self._disk.clear()
+
+    def _load(self, name: str) -> None | Image.Image:
+        data = self._disk.get(name)
+        if data is None:
+            return None
+        try:
+            with Image.open(io.BytesIO(data)) as imgfile:
+                imgfile.load()
+                return imgfile.copy()
+        except OSError as ex:
+            # e.g. truncated by a crash: treated as a miss, and replaced on the next put
+            print(f"discarding cached render {name}: {ex}")
+            return None
+
+    def _store(self, name: str, image: Image.Image) -> None:
+        buffer = io.BytesIO()
+        # light compression, decoding speed matters more than size here
+        image.save(buffer, format="PNG", compress_level=1)
+        self._disk.put(name, buffer.getvalue())
+
+
+def render_name(origin: tuple, variant: str) -> str:
+    """Returns the cache entry name of a page render"""
+    digest, number = origin
+    return f"{digest}-{number}-{variant}.png"
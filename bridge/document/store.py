@@ -0,0 +1,345 @@
+"""
+Page storage within a memory budget
+"""
+
+import itertools
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from bridge.cache import LRUCache, cache_dir
+from bridge.document.page import Page
+from bridge.document.rendercache import RenderCache
+
+# decoded page memory kept by default
+DEFAULT_BUDGET = 1024 * 1024 * 1024
+# rows written at a time when spilling, so a page is never copied whole
+STRIP_ROWS = 256
+
+
+def image_bytes(image: Image) -> int:
+    """Returns the memory held by a decoded image, as PIL lays it out"""
+    if image.mode in ("1", "L", "P"):
+        pixel = 1
+    elif image.mode.startswith("I;16"):
+        pixel = 2
+    else:
+        # RGB and two band modes are padded to 4 bytes a pixel
+        pixel = 4
+    return image.width * image.height * pixel
+
+
+class StoredPage:
+    """
+    What the store keeps of a page besides its pixels
+
+    Args:
+        page: the page stored
+        image: its decoded image, if any
+    """
+
+    __slots__ = ["mode", "size", "palette", "info", "dpi", "encoded", "pdf", "origin"]
+
+    def __init__(self, page: Page, image: None | Image.Image = None):
+        self.size = page.size
+        self.dpi = page.dpi
+        self.encoded = page.encoded
+        self.pdf = page.pdf
+        self.origin = page.origin
+
+        # needed to map a spilled image back
+        self.mode = image.mode if image is not None else None
+        self.palette = image.getpalette() if image is not None and image.mode == "P" else None
+        self.info = dict(image.info) if image is not None else {}
+
+    @property
+    def lazy(self) -> bool:
+        """Returns True if the page can be decoded (or rendered) again rather than spilled"""
+        return self.encoded is not None or self.pdf is not None
+
+    def page(self, image: None | Image.Image = None) -> Page:
+        """Returns the page, with image if given"""
+        return Page(
+            image, dpi=self.dpi, encoded=self.encoded, size=self.size, pdf=self.pdf, origin=self.origin
+        )
+
+
+class PageStore:
+    """
+    Holds the pages of a document, keeping only the recently used ones decoded in memory
+
+    Past the budget, the least recently used pages are written once, on a
+    background thread, as packed raw pixels, and read back through a memory
+    map when needed. Grey, palette and RGBA pages are used straight from the
+    map, costing no heap, and the OS can drop them under memory pressure.
+    RGB pages are unpacked into a copy on the way back, which counts against
+    the budget again. Pages that kept their encoded data, or come from a
+    loaded PDF, are not written, just decoded (or rendered) again. With a
+    RenderCache, PDF pages rendered in an earlier run are read back rather
+    than rendered again
+
+    Args:
+        budget: bytes of decoded pages to keep in memory (optional, default: 1 GiB)
+        directory: where spilled pages go (optional, default: within the user cache)
+        render_cache: RenderCache for PDF page renders (optional, default: none)
+    """
+
+    __slots__ = [
+        "_directory", "_resident", "_held", "_spilled", "_meta", "_counter", "_lock",
+        "_render_cache", "_writer", "_finalizer", "__weakref__",
+    ]
+
+    def __init__(
+        self,
+        budget: int = DEFAULT_BUDGET,
+        directory: None | str = None,
+        render_cache: None | RenderCache = None,
+    ):
+        self._render_cache = render_cache
+        self._directory = tempfile.mkdtemp(prefix="pages-", dir=directory or cache_dir())
+        # removed with the store, or at exit at the latest
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self._directory, True)
+
+        # evicted pages are handed to _held under the LRU lock, so get() never misses them
+        self._resident = LRUCache(
+            budget, sizeof=image_bytes, on_evict=self._spill, on_evicting=self._hold
+        )
+        # writes spilled pages, so add() and get() never wait on the disk
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="page-spill")
+        # pages out of the LRU but still in memory, being written or unwritable
+        self._held = {}
+        self._spilled = {}
+        self._meta = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._meta)
+
+    def __contains__(self, key):
+        return key in self._meta
+
+    @property
+    def directory(self) -> str:
+        """Returns the directory spilled pages are written to"""
+        return self._directory
+
+    @property
+    def memory(self) -> int:
+        """Returns the bytes of pages held in memory, decoded or encoded"""
+        with self._lock:
+            held = sum(image_bytes(image) for image in self._held.values())
+            encoded = sum(len(meta.encoded) for meta in self._meta.values() if meta.encoded is not None)
+        return self._resident.size + held + encoded
+
+    @property
+    def disk(self) -> int:
+        """Returns the bytes of spilled pages on disk"""
+        with self._lock:
+            return sum(size for _, size in self._spilled.values())
+
+    @property
+    def stats(self) -> dict:
+        """Returns the page counts and memory use"""
+        return {
+            "pages": len(self._meta),
+            "in_memory": len(self._resident),
+            "memory": self.memory,
+            "on_disk": len(self._spilled),
+            "disk": self.disk,
+        }
+
+    def add(self, page: Page | Image.Image) -> int:
+        """
+        Store a page, returning its key
+
+        Args:
+            page: Page, or a decoded image, which must not be modified afterwards
+        """
+        if not isinstance(page, Page):
+            page = Page(page)
+
+        key = next(self._counter)
+        if not page.decoded:
+            # nothing decoded to hold on to yet
+            with self._lock:
+                self._meta[key] = StoredPage(page)
+            return key
+
+        image = page.image
+        with self._lock:
+            self._meta[key] = StoredPage(page, image)
+        self._resident.put(key, image)
+        return key
+
+    def size(self, key: int) -> tuple:
+        """Returns the (width, height) of a page, without loading it"""
+        return self._meta[key].size
+
+    def dpi(self, key: int) -> None | float:
+        """Returns the resolution of a page, None if unknown"""
+        return self._meta[key].dpi
+
+    def origin(self, key: int) -> None | tuple:
+        """Returns the (content digest, page index) a page was loaded from, see Page.origin"""
+        return self._meta[key].origin
+
+    def source(self, key: int):
+        """Returns what a page can be remade from, see Page.source"""
+        meta = self._meta[key]
+        return meta.pdf if meta.pdf is not None else meta.encoded
+
+    def page(self, key: int) -> Page:
+        """
+        Returns a page with its details
+
+        A page with encoded data or from a PDF is only decoded (or rendered)
+        if its image is asked for
+
+        Args:
+            key: key returned by add()
+        """
+        meta = self._meta[key]
+        if meta.lazy:
+            return meta.page(self._resident.get(key))
+        return meta.page(self.get(key))
+
+    def get(self, key: int, keep: bool = True) -> Image:
+        """
+        Returns a page, mapping it back from disk if it was spilled
+
+        A mapped page is read-only, changes to it are made on a copy
+
+        Args:
+            key: key returned by add()
+            keep: keep a page decoded (or unpacked) on the way back in memory,
+                for the next get() (optional, default: True)
+        """
+        image = self._resident.get(key)
+        if image is not None:
+            return image
+
+        with self._lock:
+            if key in self._held:
+                return self._held[key]
+            meta = self._meta[key]
+            path = None if meta.lazy else self._spilled[key][0]
+
+        if meta.lazy:
+            image = self._render(meta)
+            if keep:
+                self._resident.put(key, image)
+            return image
+
+        with open(path, "rb") as o:
+            buffer = mmap.mmap(o.fileno(), 0, access=mmap.ACCESS_READ)
+        image = Image.frombuffer(meta.mode, meta.size, buffer, "raw", meta.mode, 0, 1)
+        if meta.palette is not None:
+            image.putpalette(meta.palette)
+        image.info.update(meta.info)
+        if keep and not image.readonly:
+            # unpacked into a copy rather than mapped (e.g. RGB), which takes memory
+            # again; on the next eviction it is just dropped, the file is still there
+            self._resident.put(key, image)
+        return image
+
+    def remove(self, key: int) -> None:
+        """Drop a page, from memory and disk"""
+        self._resident.pop(key)
+        with self._lock:
+            self._meta.pop(key, None)
+            self._held.pop(key, None)
+            spilled = self._spilled.pop(key, None)
+
+        if spilled is not None:
+            remove_file(spilled[0])
+
+    def clear(self) -> None:
+        """Drop every page"""
+        for key in list(self._meta):
+            self.remove(key)
+
+    def flush(self) -> None:
+        """Wait for the pages being moved to disk"""
+        self._writer.submit(lambda: None).result()
+
+    def close(self) -> None:
+        """Drop every page and remove the spill directory"""
+        self._writer.shutdown(wait=True)
+        self._resident.clear()
+        with self._lock:
+            self._meta.clear()
+            self._held.clear()
+            self._spilled.clear()
+        self._finalizer()
+
+    def _render(self, meta: StoredPage) -> Image:
+        """Returns the image of a page that is decoded (or rendered) on demand"""
+        # only renders are worth caching, encoded data decodes about as fast as a cached copy
+        cache = self._render_cache if meta.pdf is not None else None
+        if cache is not None:
+            image = cache.get(meta.origin, meta.dpi)
+            if image is not None:
+                return image
+
+        image = meta.page().image
+        if cache is not None:
+            cache.put(meta.origin, meta.dpi, image)
+        return image
+
+    def _hold(self, key: int, image: Image) -> None:
+        """Keep a page leaving the LRU until it is written to disk, called under the LRU lock"""
+        with self._lock:
+            # pages with encoded data, or from a PDF, are just decoded again
+            if key not in self._meta or key in self._spilled or self._meta[key].lazy:
+                return
+            # still served from here while it is being written
+            self._held[key] = image
+
+    def _spill(self, key: int, image: Image) -> None:
+        """Queue a page held by _hold() to be written to disk"""
+        with self._lock:
+            if self._held.get(key) is not image:
+                return
+        try:
+            self._writer.submit(self._write, key, image)
+        except RuntimeError:
+            # the store is closing
+            with self._lock:
+                self._held.pop(key, None)
+
+    def _write(self, key: int, image: Image) -> None:
+        """Write a spilled page, on the writer thread"""
+        path = os.path.join(self._directory, f"{key}.raw")
+        try:
+            with open(path, "wb") as o:
+                for top in range(0, image.height, STRIP_ROWS):
+                    strip = image.crop((0, top, image.width, min(top + STRIP_ROWS, image.height)))
+                    o.write(strip.tobytes("raw", image.mode))
+        except OSError as ex:
+            # e.g. out of disk space: keep the page in memory, over budget, rather than lose it
+            print(f"could not move page {key} to disk: {ex}")
+            remove_file(path)
+            return
+
+        with self._lock:
+            self._held.pop(key, None)
+            removed = key not in self._meta
+            if not removed:
+                self._spilled[key] = (path, os.path.getsize(path))
+        if removed:
+            remove_file(path)
+
+
+def remove_file(path: str) -> None:
+    """Remove a spilled page, leaving it if it is still mapped (on Windows) or gone"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,59 @@
+"""
+Page previews, made at reduced scale
+"""
+
+import io
+
+from PIL import Image
+
+from bridge.document.page import PDFPageRef
+
+# preview width of a page, in pixels
+THUMBNAIL_WIDTH = 400
+
+
+def thumbnail_size(size: tuple, width: int = THUMBNAIL_WIDTH) -> tuple:
+    """
+    Returns the (width, height) of the preview of a page of size (width, height)
+
+    Args:
+        size: page size in pixels
+        width: preview width (optional, default: THUMBNAIL_WIDTH)
+    """
+    return width, max(1, int(size[1] * (width / size[0])))
+
+
+def make_thumbnail(source, width: int = THUMBNAIL_WIDTH) -> Image:
+    """
+    Returns an RGB preview of a page, doing as little full size work as possible
+
+    Encoded JPEGs are decoded straight at a fraction of their size, PDF pages
+    are rendered at preview size, and large images are box reduced by a whole
+    factor before the final resample
+
+    Args:
+        source: PIL Image, encoded image bytes, PDFPageRef, or a file path
+        width: preview width (optional, default: THUMBNAIL_WIDTH)
+    """
+    if isinstance(source, PDFPageRef):
+        # the dpi at which the page comes out width pixels wide
+        source = source.render(width / source.pixel_size(72)[0] * 72)
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    if isinstance(source, Image.Image):
+        image = source
+    else:
+        image = Image.open(source)
+        # only JPEG honours this, decoding at 1/2, 1/4 or 1/8 scale
+        image.draft("RGB", thumbnail_size(image.size, width))
+
+    # reducing averages pixel values, which is meaningless for palette indices
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    size = thumbnail_size(image.size, width)
+    factor = image.size[0] // width
+    if factor >= 2:
+        image = image.reduce(factor)
+
+    return image.convert("RGB").resize(size, Image.Resampling.BILINEAR)
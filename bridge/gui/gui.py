@@ -3,8 +3,9 @@ UI module
 """
 import io
 import os
+import time
+from collections import deque
 
-from PIL import Image
 from PyQt6.QtGui import QAction
 from PyQt6.QtWidgets import (
     QLabel,
@@ -12,47 +13,194 @@ from PyQt6.QtWidgets import (
     QGridLayout,
     QToolBar,
     QPushButton,
-    QLineEdit, QFileDialog,
+    QLineEdit, QFileDialog, QProgressDialog,
 )
-from PyQt6.QtCore import QThread, pyqtSignal, pyqtSlot
-
+from PyQt6.QtCore import QThread, QTimer, pyqtSignal, pyqtSlot
+
+from bridge.connection.cmd import CancelHandle
+from bridge.connection.loop import BackgroundLoop
+from bridge.document.export import PDFExporter
+from bridge.document.loader import load_files
+from bridge.document.page import Page
+from bridge.document.postprocess import PostProcessor
+from bridge.document.rendercache import RenderCache
 from bridge.gui.subcontainers.popup import Popup
 from bridge.gui.settings import Settings
 from bridge.gui.subcontainers.pageviewer import PageViewerWidget
+from bridge.metrics import recorder
+from bridge.scan.farm import ScanFarm
 from bridge.scan.scan import Scanner
+from bridge.watchdog import ENV_PROFILE, StallWatchdog, instrumented
 from gui.subcontainers.confirmation_popup import ConfirmationWindow
 from gui.subcontainers.question_window import QuestionWindow
 
-import pymupdf as fitz
 
 
 class ScanWorker(QThread):
     finished = pyqtSignal()
 
-    def __init__(self, scanner, resolution):
+    def __init__(self, scanner, resolution, timeout=None):
         super().__init__()
         print(f"scanner created with resolution {resolution}")
         self.scanner = scanner
         self.resolution = resolution
+        self.timeout = timeout
+        self.cancel_handle = CancelHandle()
 
-        self.image = None
+        self.page = None
+        self.error = None
 
     @pyqtSlot()
     def run(self):
         """request a scan"""
         print("scanning...")
-        self.image = self.scanner.scan_image(self.resolution)
+        try:
+            self.page = self.scanner.scan_page(
+                self.resolution, timeout=self.timeout, cancel=self.cancel_handle
+            )
+        except (RuntimeError, TimeoutError, InterruptedError, OSError, ValueError) as ex:
+            print(f"scan failed: {ex}")
+            self.error = ex
+        self.finished.emit()
+
+    def cancel(self):
+        """abort the scan, killing the remote scanimage"""
+        self.cancel_handle.cancel()
+
+
+class BatchScanWorker(ScanWorker):
+    page_ready = pyqtSignal(object)
+
+    def __init__(self, scanner, resolution, timeout=None):
+        super().__init__(scanner, resolution, timeout=timeout)
+        self.pages = 0
+
+    @pyqtSlot()
+    def run(self):
+        """request a batch scan, handing over each page as it arrives"""
+        print("batch scanning...")
+        try:
+            for page in self.scanner.scan_batch(
+                self.resolution, timeout=self.timeout, cancel=self.cancel_handle, as_pages=True
+            ):
+                self.pages += 1
+                self.page_ready.emit(page)
+        except (RuntimeError, TimeoutError, InterruptedError, OSError, ValueError) as ex:
+            print(f"batch scan stopped: {ex}")
+            self.error = ex
+        self.finished.emit()
+
+
+class ExportWorker(QThread):
+    finished = pyqtSignal()
+    progress = pyqtSignal(int, int)
+
+    def __init__(self, exporter, store, keys, default_dpi):
+        super().__init__()
+        self.exporter = exporter
+        self.store = store
+        self.keys = keys
+        self.default_dpi = default_dpi
+        self.cancel_handle = CancelHandle()
+
+        self.error = None
+
+    def pages(self):
+        """yield each page, fetched from the store (and loaded from disk) only when the exporter is ready for it"""
+        for key in self.keys:
+            try:
+                yield self.store.page(key)
+            except KeyError:
+                # deleted from the viewer since the export started
+                continue
+
+    @pyqtSlot()
+    def run(self):
+        """write the pdf, reporting each page"""
+        try:
+            self.exporter.export(
+                self.pages(),
+                self.default_dpi,
+                progress=self.progress.emit,
+                cancel=self.cancel_handle,
+                total=len(self.keys),
+            )
+        except (InterruptedError, OSError, RuntimeError) as ex:
+            print(f"export stopped: {ex}")
+            self.error = ex
+        self.finished.emit()
+
+    def cancel(self):
+        """stop the export, leaving no file behind"""
+        self.cancel_handle.cancel()
+
+
+class LoadWorker(QThread):
+    """
+    Loads files in the background, sending their pages on in file order
+
+    Pages are sent in batches at most every BATCH_SECONDS, so the view is
+    updated a few times a second rather than once per page
+    """
+
+    BATCH_SECONDS = 0.2
+
+    loaded = pyqtSignal(list)
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal()
+
+    def __init__(self, paths, dpi):
+        super().__init__()
+
+        self.paths = paths
+        self.dpi = dpi
+        self.cancel_handle = CancelHandle()
+
+        self.errors = []
+
+    @pyqtSlot()
+    def run(self):
+        """load the files, reporting each"""
+        batch = []
+        last_sent = time.monotonic()
+        for done, (path, pages, error) in enumerate(
+            load_files(self.paths, self.dpi, cancel=self.cancel_handle), start=1
+        ):
+            if error is not None:
+                print(f"could not load {path}: {error}")
+                self.errors.append((path, error))
+            batch.extend(pages)
+            self.progress.emit(done, len(self.paths))
+
+            if batch and time.monotonic() - last_sent >= self.BATCH_SECONDS:
+                self.loaded.emit(batch)
+                batch = []
+                last_sent = time.monotonic()
+
+        if batch:
+            self.loaded.emit(batch)
         self.finished.emit()
 
+    def cancel(self):
+        """stop loading, keeping the files already loaded"""
+        self.cancel_handle.cancel()
+
 
 class MainWindow(QMainWindow):
     """
     Main GUI Window
     """
 
+    latency_updated = pyqtSignal()
+    farm_job_done = pyqtSignal(object)
+    page_processed = pyqtSignal(object)
+
     def __init__(self):
         super().__init__()
 
+        # shared event loop for async connection work (pings, probes)
+        self.loop = BackgroundLoop()
+
         self._settings = Settings("settings.ini")
 
         self._current_popup = None
@@ -60,15 +208,121 @@ class MainWindow(QMainWindow):
         self.setWindowTitle("Scanner SANE Bridge")
         self.setGeometry(100, 100, 600, 400)
 
-        self.image_widget = PageViewerWidget()
+        memory_budget = self.settings.get("memory_budget")
+        render_cache = self.settings.get("render_cache")
+        self.image_widget = PageViewerWidget(
+            memory_budget=int(memory_budget) * 1024 * 1024 if memory_budget else None,
+            render_cache=RenderCache(int(render_cache) * 1024 * 1024) if render_cache else None,
+        )
         self.setCentralWidget(self.image_widget)
 
         self._waiting_for_scan = False
 
+        self._scanner = None
+        self._farm = None
+        self.exportworker = None
+        self.loadworker = None
+        self._ping_future = None
+        self.latency_updated.connect(self.connection_checked)
+        self.farm_job_done.connect(self.farm_scan_complete)
+
+        # scanned pages being cleaned up, oldest first, as (future, page)
+        self._postprocessor = None
+        self._postprocess_config = None
+        self._processing = deque()
+        self.page_processed.connect(self.postprocess_complete)
+
+        # opt-in diagnostics of a GUI that stops responding, see bridge.watchdog
+        self.watchdog = StallWatchdog.from_env()
+        self.profile_dir = os.environ.get(ENV_PROFILE) or None
+
         self.UISetup()
 
         self.show()
 
+        if self.watchdog is not None:
+            # only beats while the event loop is free to run it
+            self.heartbeat_timer = QTimer(self)
+            self.heartbeat_timer.timeout.connect(self.watchdog.beat)
+            self.heartbeat_timer.start(max(1, round(self.watchdog.interval * 1000)))
+            self.watchdog.start()
+
+        if not self.settings.get("skip_scan"):
+            # pre-connect, then ping periodically so the master session survives idle time
+            self.keepalive_timer = QTimer(self)
+            self.keepalive_timer.timeout.connect(self.check_connection)
+            self.keepalive_timer.start(60_000)
+            self.check_connection()
+
+    @property
+    def hosts(self) -> list:
+        """Returns the user@host strings of the userhost setting, which may list several"""
+        return [host.strip() for host in str(self.settings.get("userhost")).split(",") if host.strip()]
+
+    @property
+    def scanner(self) -> Scanner:
+        """Returns the Scanner for the (first) host of the userhost setting"""
+        userhost = self.hosts[0]
+        if self._scanner is None or self._scanner.conn.userhost != userhost:
+            self._scanner = Scanner(userhost)
+        self._scanner.stream = bool(self.settings.get("stream_scan"))
+        self._scanner.use_agent = bool(self.settings.get("use_agent"))
+        self._scanner.transfer = self.settings.get("transfer_format") or "auto"
+        return self._scanner
+
+    @property
+    def farm(self) -> None | ScanFarm:
+        """Returns a ScanFarm over the hosts, or None if only one host is set"""
+        hosts = self.hosts
+        if len(hosts) < 2:
+            return None
+
+        if self._farm is None or self._farm.hosts != hosts:
+            if self._farm is not None:
+                self._farm.shutdown(wait=False)
+            timeout = self.settings.get("scan_timeout")
+            self._farm = ScanFarm.from_hosts(hosts, timeout=timeout if timeout else None)
+        return self._farm
+
+    def check_connection(self):
+        """Connect to (or ping) the host in the background"""
+        if self._ping_future is not None and not self._ping_future.done():
+            return
+
+        # the first ping opens the master session, later ones keep it alive
+        self._ping_future = self.loop.submit(self.scanner.conn.aping())
+        # emitted from the loop thread, the slot is queued onto the GUI thread
+        self._ping_future.add_done_callback(lambda _: self.latency_updated.emit())
+
+    def connection_checked(self):
+        latency = self.scanner.conn.latency
+        if latency is None:
+            self.connectionlabel.setText(f"Unreachable: {self.scanner.conn.userhost} ")
+        else:
+            self.connectionlabel.setText(
+                f"Connected: {self.scanner.conn.userhost} ({latency * 1000:.0f} ms) "
+            )
+            if self.scanner.registry.stale:
+                self.scanner.registry.refresh_async()
+
+    def closeEvent(self, event):
+        if self._scanner is not None:
+            self._scanner.close()
+        if self._farm is not None:
+            self._farm.shutdown(wait=False)
+            for station in self._farm.stations:
+                station.scanner.close()
+        if self.loadworker is not None and self.loadworker.isRunning():
+            self.loadworker.cancel()
+            self.loadworker.wait()
+        self.image_widget.close_workers()
+        if self._postprocessor is not None:
+            self._postprocessor.close(wait=False)
+        self.loop.stop()
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        super().closeEvent(event)
+
     def close_current_popup(self):
         if self._current_popup is not None:
             self._current_popup.close()
@@ -78,6 +332,10 @@ class MainWindow(QMainWindow):
         """Returns the internal Settings object"""
         return self._settings
 
+    def hooked(self, name: str, slot):
+        """Returns slot wrapped as a named action for the stall watchdog, and profiled if enabled"""
+        return instrumented(name, slot, watchdog=self.watchdog, directory=self.profile_dir)
+
     def UISetup(self):
         """Create the ui elements"""
 
@@ -92,65 +350,109 @@ class MainWindow(QMainWindow):
         # scan button
         self.scanbutton = QAction("Scan", self)
         self.scanbutton.setStatusTip("Request a scan from the server")
-        self.scanbutton.triggered.connect(self.perform_scan)
+        self.scanbutton.triggered.connect(self.hooked("Scan", self.perform_scan))
 
         toolBar.addAction(self.scanbutton)
 
+        # batch scan button
+        self.batchbutton = QAction("Batch", self)
+        self.batchbutton.setStatusTip("Scan every page in the document feeder")
+        self.batchbutton.triggered.connect(self.hooked("Batch", self.perform_batch_scan))
+
+        toolBar.addAction(self.batchbutton)
+
+        # cancel button
+        self.cancelbutton = QAction("Cancel", self)
+        self.cancelbutton.setStatusTip("Abort the running scan")
+        self.cancelbutton.triggered.connect(self.hooked("Cancel", self.cancel_scan))
+        self.cancelbutton.setEnabled(False)
+
+        toolBar.addAction(self.cancelbutton)
+
         # load button
         self.loadbutton = QAction("Load", self)
         self.loadbutton.setStatusTip("Load a document from file")
-        self.loadbutton.triggered.connect(self.load_image)
+        self.loadbutton.triggered.connect(self.hooked("Load", self.load_image))
 
         toolBar.addAction(self.loadbutton)
 
         # save button
         self.savebutton = QAction("Save", self)
         self.savebutton.setStatusTip("Save the image")
-        self.savebutton.triggered.connect(self.save_images)
+        self.savebutton.triggered.connect(self.hooked("Save", self.save_images))
 
         toolBar.addAction(self.savebutton)
 
         # clear button
         self.clearbutton = QAction("Clear", self)
         self.clearbutton.setStatusTip("Clears all pages from storage")
-        self.clearbutton.triggered.connect(self.clear_images)
+        self.clearbutton.triggered.connect(self.hooked("Clear", self.clear_images))
 
         toolBar.addAction(self.clearbutton)
 
         resolutionLabel = QLabel(f"Resolution: {self.settings.get('resolution')} ")
         toolBar.addWidget(resolutionLabel)
 
-        connectionLabel = QLabel(f"Connected: {self.settings.get('userhost')} ")
-        toolBar.addWidget(connectionLabel)
+        self.connectionlabel = QLabel(f"Connected: {self.settings.get('userhost')} ")
+        toolBar.addWidget(self.connectionlabel)
 
         self.statuslabel = QLabel(f"Ready")
         toolBar.addWidget(self.statuslabel)
 
+        # mean time of each scan phase so far, see bridge.metrics
+        self.timinglabel = QLabel("")
+        toolBar.addWidget(self.timinglabel)
+
         self.addToolBar(toolBar)
 
     def save_setting(self, name, entry: QLineEdit):
         value = entry.text()
-        self.settings.set(name, value)
+        try:
+            self.settings.set(name, value)
+        except ValueError as ex:
+            self.statuslabel.setText(f"Not saved: {ex}")
 
-    def perform_scan(self):
-        userhost = self.settings.get("userhost")
+    def ask_dpi(self):
+        """Ask for the scan dpi, returns None if cancelled"""
         resolution = self.settings.get("resolution")
 
-        scanner = Scanner(userhost)
         questionwindow = QuestionWindow(self, "Choose DPI", default=str(resolution))
 
         if not questionwindow.state:
-            return
-        else:
-            dpi = questionwindow.value
+            return None
+
+        dpi = questionwindow.value
+        dpi = int(dpi) if dpi != "" else resolution
 
-            if dpi != "":
-                dpi = int(dpi)
-            else:
-                dpi = resolution
+        if not self.settings.get("skip_scan"):
+            # checked against the cached device options, no round trip
+            try:
+                self.scanner.check_options(dpi)
+            except ValueError as ex:
+                self.statuslabel.setText(str(ex))
+                return None
+
+        return dpi
+
+    def perform_scan(self):
+        userhost = self.settings.get("userhost")
+
+        scanner = self.scanner
+        dpi = self.ask_dpi()
+        if dpi is None:
+            return
 
         print(f"Scanning at {userhost} with dpi {dpi}")
 
+        farm = None if self.settings.get("skip_scan") else self.farm
+        if farm is not None:
+            # jobs queue up on the least loaded station, so scanning stays enabled
+            future = farm.submit(dpi)
+            # called from a station thread, the slot is queued onto the GUI thread
+            future.add_done_callback(self.farm_job_done.emit)
+            self.statuslabel.setText(f"{farm.pending} scans queued")
+            return
+
         skip_path = None
         skip = self.settings.get("skip_scan")
         if skip is not None and skip:
@@ -158,25 +460,61 @@ class MainWindow(QMainWindow):
             skip_path = os.path.join(os.path.split(bridge.__file__)[0], "..", "tests", "load.png")
 
             print(f"skipping scan, loading {skip_path}")
-            with Image.open(skip_path) as imgfile:
-                image = imgfile.copy().convert("RGB")
-            self.scan_complete(image=image)
+            self.scan_complete(image=Page.from_file(skip_path))
 
         else:
             print("creating connection to scanner")
-            self.scanworker = ScanWorker(scanner, dpi)
+            timeout = self.settings.get("scan_timeout")
+            self.scanworker = ScanWorker(scanner, dpi, timeout=timeout if timeout else None)
 
             self.scanworker.finished.connect(self.scan_complete)
             self.scanworker.start()
             self.waiting_for_scan = True
 
+    def perform_batch_scan(self):
+        if self.settings.get("skip_scan"):
+            self.perform_scan()
+            return
+
+        dpi = self.ask_dpi()
+        if dpi is None:
+            return
+
+        print(f"Batch scanning at {self.settings.get('userhost')} with dpi {dpi}")
+        timeout = self.settings.get("scan_timeout")
+        self.scanworker = BatchScanWorker(self.scanner, dpi, timeout=timeout if timeout else None)
+
+        self.scanworker.page_ready.connect(self.page_scanned)
+        self.scanworker.finished.connect(self.batch_complete)
+        self.scanworker.start()
+        self.waiting_for_scan = True
+
+    def page_scanned(self, page):
+        print(f"page {self.scanworker.pages} received")
+        self.add_scanned(page)
+        self.statuslabel.setText(f"Scanning... {self.scanworker.pages} pages ({self.memory_use})")
+        self.show_timings()
+
+    def batch_complete(self):
+        self.waiting_for_scan = False
+
+        pages = self.scanworker.pages
+        if self.scanworker.error is not None:
+            self.statuslabel.setText(f"Batch stopped after {pages} pages: {self.scanworker.error}")
+        else:
+            self.statuslabel.setText(f"Scanned {pages} pages")
+        self.show_timings()
+
     @property
     def waiting_for_scan(self):
         return self._waiting_for_scan
 
     @waiting_for_scan.setter
     def waiting_for_scan(self, wait: bool):
+        self._waiting_for_scan = wait
         self.scanbutton.setEnabled(not wait)
+        self.batchbutton.setEnabled(not wait)
+        self.cancelbutton.setEnabled(wait)
         self.clearbutton.setEnabled(not wait)
         self.savebutton.setEnabled(not wait)
 
@@ -185,20 +523,110 @@ class MainWindow(QMainWindow):
         else:
             self.statuslabel.setText("Ready")
 
+    def cancel_scan(self):
+        if self.waiting_for_scan:
+            print("cancelling scan")
+            self.scanworker.cancel()
+
     def scan_complete(self, image=None):
         print("scan complete")
         self.waiting_for_scan = False
 
         if image is None:
             print("retrieving image")
-            image = self.scanworker.image
+            image = self.scanworker.page
+
+        if image is None:
+            self.statuslabel.setText(f"Scan failed: {self.scanworker.error}")
+            return
 
         print("adding image to canvas")
-        self.image_widget.add_image(image)
+        self.add_scanned(image)
+        self.statuslabel.setText(f"Ready, {len(self.image_widget.model.store)} pages ({self.memory_use})")
+        self.show_timings()
+
+    @property
+    def postprocessor(self) -> None | PostProcessor:
+        """Returns the PostProcessor for the auto_crop, deskew and blank_pages settings, None if all are off"""
+        config = (
+            bool(self.settings.get("auto_crop")),
+            bool(self.settings.get("deskew")),
+            self.settings.get("blank_pages") or "keep",
+        )
+        if config != self._postprocess_config:
+            if self._postprocessor is not None:
+                # pages already submitted still finish
+                self._postprocessor.close(wait=False)
+            crop, deskew, blank = config
+            self._postprocessor = PostProcessor(crop=crop, deskew=deskew, blank=blank)
+            self._postprocess_config = config
+        return self._postprocessor if self._postprocessor.enabled else None
+
+    def add_scanned(self, page):
+        """Add a scanned page to the viewer, cleaned up in the background first if that is enabled"""
+        processor = self.postprocessor
+        if processor is None:
+            self.image_widget.add_image(page)
+            return
+
+        future = processor.submit(page)
+        self._processing.append((future, page))
+        # called from a pool thread, the slot is queued onto the GUI thread
+        future.add_done_callback(self.page_processed.emit)
+
+    def postprocess_complete(self, _future=None):
+        # pages go into the viewer in scan order, whichever finishes first
+        while self._processing and self._processing[0][0].done():
+            future, original = self._processing.popleft()
+            error = future.exception()
+            if error is not None:
+                print(f"could not clean up page: {error}")
+                self.image_widget.add_image(original)
+                continue
+
+            page, blank = future.result()
+            if page is not None:
+                self.image_widget.add_image(page)
+            if blank:
+                count = len(self.image_widget.model.store)
+                self.statuslabel.setText(
+                    f"Blank page {'dropped' if page is None else f'at page {count}'}, {count} pages"
+                )
+        self.show_timings()
+
+    def show_timings(self):
+        """Show the running per phase scan timings"""
+        self.timinglabel.setText(recorder().summary_text())
+
+    @property
+    def memory_use(self) -> str:
+        """Returns the memory and disk taken by the pages, for display"""
+        stats = self.image_widget.model.store.stats
+        text = f"{stats['memory'] / 1024 ** 2:.0f} MB in memory"
+        if stats["on_disk"]:
+            text += f", {stats['disk'] / 1024 ** 2:.0f} MB on disk"
+        return text
+
+    def farm_scan_complete(self, future):
+        if future.cancelled():
+            return
+
+        error = future.exception()
+        if error is not None:
+            self.statuslabel.setText(f"Scan failed: {error}")
+            return
+
+        self.add_scanned(future.result())
+
+        stats = self._farm.stats
+        self.statuslabel.setText(
+            f"{stats['pending']} scans queued, {stats['pages_per_hour']:.0f} pages/hour"
+        )
+        self.show_timings()
 
     def save_images(self):
 
-        if len(self.image_widget.images) == 0:
+        if self.image_widget.model.rowCount() == 0:
             print("no images, exiting")
             return
 
@@ -259,34 +687,39 @@ class MainWindow(QMainWindow):
 
         filenames = load.getOpenFileNames()[0]
 
+        if not filenames:
+            return
+        if self.loadworker is not None and self.loadworker.isRunning():
+            self.statuslabel.setText("Still loading, try again once done")
+            return
+
         print(f"loading files:\n{filenames}")
-        try:
-            for file in filenames:
-                # handle pdf files, since they need a renderer
-                # thanks to this answer: https://stackoverflow.com/a/69416971
-                if os.path.splitext(file)[1] == ".pdf":
-                    doc = fitz.open(file)
-
-                    for page in doc:
-                        pix = page.get_pixmap(dpi=int(self.settings.get("resolution")))
-                        self.scan_complete(
-                            image=Image.frombytes(
-                                "RGB",
-                                [pix.width, pix.height],
-                                pix.samples
-                            )
-                        )
-                else:
-                    with Image.open(file) as imgfile:
-                        image = imgfile.copy().convert("RGB")
-                    self.scan_complete(image=image)
-        except Exception as ex:
-            print(ex)
-            raise
+        # pdf pages are only rendered when shown or changed, and export copies them as they are
+        self.loadworker = LoadWorker(filenames, int(self.settings.get("resolution")))
+
+        self.loadprogress = QProgressDialog("Loading files", "Cancel", 0, len(filenames), self)
+        self.loadprogress.setMinimumDuration(500)
+        self.loadprogress.canceled.connect(self.loadworker.cancel)
+        self.loadworker.progress.connect(lambda done, _: self.loadprogress.setValue(done))
+
+        self.loadworker.loaded.connect(self.image_widget.add_pages)
+        self.loadworker.finished.connect(self.load_complete)
+        self.loadbutton.setEnabled(False)
+        self.loadworker.start()
+
+    def load_complete(self):
+        self.loadprogress.reset()
+        self.loadbutton.setEnabled(True)
+
+        errors = self.loadworker.errors
+        status = f"Ready, {len(self.image_widget.model.store)} pages ({self.memory_use})"
+        if errors:
+            status += f", could not load {', '.join(os.path.basename(path) for path, _ in errors)}"
+        self.statuslabel.setText(status)
 
     def save_to_file(self, filename, dpi_target: int = 100):
         """
-        Save the images out to filename
+        Save the images out to filename, in the background
 
         Args:
             filename: target file, forced .pdf format
@@ -296,22 +729,38 @@ class MainWindow(QMainWindow):
                 300 dpi ~1.3MB per page
                 400 dpi ~2.0MB per page
         """
-        print(f"Saving image out to {filename}...", end=" ")
-
-        scale = dpi_target / self.settings.get("resolution")
-        print(f"Scaling image by {scale}")
-
-        try:
-            cache = []
-            for image in self.image_widget.images:
-                width = int(image.size[0] * scale)
-                height = int(image.size[1] * scale)
-
-                cache.append(image.resize((width, height)))
+        if self.exportworker is not None and self.exportworker.isRunning():
+            self.statuslabel.setText("Still saving, try again once done")
+            return
 
-            cache[0].save(fp=filename, format="PDF", save_all=True,
-                          append_images=cache[1:])
+        print(f"Saving image out to {filename}...")
+
+        # only the keys, the pages are fetched one at a time by the worker
+        keys = self.image_widget.keys
+        exporter = PDFExporter(filename, dpi_target)
+        # pages that do not know their resolution are taken as scanned at the current setting
+        self.exportworker = ExportWorker(
+            exporter, self.image_widget.model.store, keys, self.settings.get("resolution")
+        )
+
+        self.exportprogress = QProgressDialog(
+            f"Saving {os.path.basename(filename)}", "Cancel", 0, len(keys), self
+        )
+        self.exportprogress.setMinimumDuration(500)
+        self.exportprogress.canceled.connect(self.exportworker.cancel)
+        self.exportworker.progress.connect(lambda done, _: self.exportprogress.setValue(done))
+
+        self.exportworker.finished.connect(self.export_complete)
+        self.savebutton.setEnabled(False)
+        self.exportworker.start()
+
+    def export_complete(self):
+        self.exportprogress.reset()
+        self.savebutton.setEnabled(not self.waiting_for_scan)
+
+        error = self.exportworker.error
+        if error is not None:
+            self.statuslabel.setText(f"Save failed: {error}")
+        else:
             print("Done.")
-        except Exception as ex:
-            print(f"Unhandled exception:\n{ex}")
-            raise
+            self.statuslabel.setText(f"Saved {self.exportworker.exporter.filename}")
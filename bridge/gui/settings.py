@@ -3,8 +3,83 @@ Module for a self healing settings file
 """
 
 import os
+import tempfile
+import threading
+from contextlib import contextmanager
 from typing import Any
 
+from bridge.scan.transfer import FORMATS
+
+# type of each known setting, and a check its value must pass (or None)
+SCHEMA = {
+    "userhost": (str, None),
+    # the minimum SANE scans at
+    "resolution": (int, lambda v: v >= 75),
+    "skip_scan": (bool, None),
+    "stream_scan": (bool, None),
+    "scan_timeout": (int, lambda v: v >= 0),
+    "use_agent": (bool, None),
+    "transfer_format": (str, lambda v: v == "auto" or v in FORMATS),
+    "memory_budget": (int, lambda v: v > 0),
+    "render_cache": (int, lambda v: v >= 0),
+    "auto_crop": (bool, None),
+    "deskew": (bool, None),
+    # see bridge.document.postprocess.BLANK_ACTIONS, not imported as it needs NumPy
+    "blank_pages": (str, lambda v: v in ("keep", "flag", "drop")),
+}
+
+
+def parse_value(val: str) -> Any:
+    """Returns the value of a line of the file, as a bool, number or string"""
+    val = val.lower().strip()
+
+    try:
+        if val.lower() == "true":
+            val = True
+        elif val.lower() == "false":
+            val = False
+        elif "." in val:
+            val = float(val)
+        else:
+            val = int(val)
+    except (ValueError, TypeError):
+        pass
+
+    return val
+
+
+def validate(key: str, value: Any) -> Any:
+    """
+    Returns value as the type the schema gives key, raising ValueError if it does not fit
+
+    Settings not in the schema are taken as they are
+
+    Args:
+        key: setting name
+        value: value to check, e.g. as typed in by the user
+    """
+    if key not in SCHEMA:
+        return value
+    kind, check = SCHEMA[key]
+
+    if isinstance(value, str) and kind is not str:
+        value = parse_value(value)
+
+    if kind is bool:
+        if not isinstance(value, bool):
+            raise ValueError(f"{key} must be True or False, not {value!r}")
+    elif kind is int:
+        # bool is an int, but never a valid number here
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value != int(value):
+            raise ValueError(f"{key} must be a whole number, not {value!r}")
+        value = int(value)
+    else:
+        value = str(value).strip()
+
+    if check is not None and not check(value):
+        raise ValueError(f"{value!r} is not a valid {key}")
+    return value
+
 
 class Settings:
     """
@@ -15,9 +90,17 @@ class Settings:
     key: value
 
     and are updated with __setattr__ and __getattr__
+
+    The file is parsed once and kept in memory, and only read again once it
+    changes on disk. Writes go to a temporary file that then replaces it, so
+    other threads and processes never see it half written. Known settings are
+    checked against SCHEMA: set() refuses invalid values, and invalid values
+    in the file are replaced by the defaults
+
+    Several changes can be written at once with transaction()
     """
 
-    __slots__ = ["_path", "_defaults"]
+    __slots__ = ["_path", "_defaults", "_data", "_stamp", "_pending", "_lock"]
 
     def __init__(self, path: str = "settings.ini"):
 
@@ -26,9 +109,25 @@ class Settings:
         self._defaults = {
             "userhost": "localhost",
             "resolution": 300,
-            "skip_scan": False
+            "skip_scan": False,
+            "stream_scan": True,
+            "scan_timeout": 120,
+            "use_agent": False,
+            "transfer_format": "auto",
+            "memory_budget": 1024,
+            "render_cache": 512,
+            "auto_crop": False,
+            "deskew": False,
+            "blank_pages": "keep",
         }
 
+        self._data = {}
+        # (inode, mtime, size) of the file when it was parsed
+        self._stamp = None
+        # changes of the current transaction, if any
+        self._pending = None
+        self._lock = threading.RLock()
+
         print(f"using settings file at {self.file}")
         current_data = self.file_data
         for k, v in self.defaults.items():
@@ -50,56 +149,92 @@ class Settings:
     @property
     def file_data(self) -> dict:
         """Return the file content as a dictionary"""
-        data = {}
-        try:
-            with open(self.file, encoding="UTF-8") as o:
-                lines = o.readlines()
-        except FileNotFoundError:
-            lines = []
-
-        for line in lines:
-            key, val = line.split(":")
-
-            val = val.lower().strip()
-
-            try:
-                if val.lower() == "true":
-                    val = True
-                elif val.lower() == "false":
-                    val = False
-                elif "." in val:
-                    val = float(val)
-                else:
-                    val = int(val)
-            except (ValueError, TypeError):
-                pass
-
-            data[key.lower().strip()] = val
-
-        return data
+        with self._lock:
+            return dict(self._current())
 
     def key_in_data(self, key: str) -> bool:
         """Returns True if the key exists in the file data"""
         return key in self.file_data
 
     def dump_data(self, data: dict):
-        """Dump data to file"""
-        with open(self.file, "w+", encoding="UTF-8") as o:
-            for k, v in data.items():
-                o.write(f"{k}: {v}\n")
+        """Dump data to file, replacing it in one step"""
+        directory = os.path.dirname(self.file)
+        with self._lock:
+            fd, temp = tempfile.mkstemp(prefix=".settings-", dir=directory)
+            try:
+                with os.fdopen(fd, "w", encoding="UTF-8") as o:
+                    for k, v in data.items():
+                        o.write(f"{k}: {v}\n")
+                if os.path.exists(self.file):
+                    # temporary files are private, keep the permissions the file had
+                    os.chmod(temp, os.stat(self.file).st_mode)
+                os.replace(temp, self.file)
+            except BaseException:
+                if os.path.exists(temp):
+                    os.remove(temp)
+                raise
+
+            # stamped before reading: a change in between only causes another read
+            self._stamp = self._file_stamp()
+            self._data = self._read()
 
     def set(self, key: str, value: Any):
         """
         Set a value
 
+        Raises ValueError if the value is invalid for a known setting
+
         Args:
             key: key to set
             value: value to set
         """
-        data = self.file_data
-        data[key] = value
+        self.update({key: value})
+
+    def update(self, values: dict):
+        """
+        Set several values, written out together
 
-        self.dump_data(data)
+        Raises ValueError if any value is invalid, setting none of them
+
+        Args:
+            values: {key: value} to set
+        """
+        values = {key: validate(key, value) for key, value in values.items()}
+
+        with self._lock:
+            if self._pending is not None:
+                self._pending.update(values)
+                return
+
+            # read first, to keep changes other processes made since
+            data = self.file_data
+            data.update(values)
+            self.dump_data(data)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Context in which set() and update() are held back, and written out
+        together at the end. Nothing is written if the block raises
+
+        Other threads wait for the transaction to finish before they can read
+        or write settings
+        """
+        with self._lock:
+            if self._pending is not None:
+                # nested: part of the outer transaction
+                yield self
+                return
+
+            self._pending = {}
+            try:
+                yield self
+                pending = self._pending
+            finally:
+                self._pending = None
+
+            if pending:
+                self.update(pending)
 
     def get(self, item: str) -> Any:
         """
@@ -108,4 +243,50 @@ class Settings:
         Arg:
             item: item to fetch
         """
-        return self.file_data.get(item, None)
+        with self._lock:
+            if self._pending is not None and item in self._pending:
+                return self._pending[item]
+            return self._current().get(item, None)
+
+    def _current(self) -> dict:
+        """Returns the parsed file, parsing it again only if it changed since"""
+        stamp = self._file_stamp()
+        if stamp != self._stamp:
+            self._data = self._read()
+            self._stamp = stamp
+        return self._data
+
+    def _file_stamp(self) -> None | tuple:
+        """Returns what identifies the file version on disk, None if it does not exist"""
+        try:
+            stat = os.stat(self.file)
+        except FileNotFoundError:
+            return None
+        # the inode changes with every replace, even within the mtime resolution
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _read(self) -> dict:
+        """Parse the file, replacing invalid values of known settings by their defaults"""
+        data = {}
+        try:
+            with open(self.file, encoding="UTF-8") as o:
+                lines = o.readlines()
+        except FileNotFoundError:
+            lines = []
+
+        for line in lines:
+            if not line.strip():
+                continue
+            key, val = line.split(":", 1)
+            key = key.lower().strip()
+            val = parse_value(val)
+
+            try:
+                val = validate(key, val)
+            except ValueError as ex:
+                print(f"{ex} in {self.file}, using {self.defaults[key]!r}")
+                val = self.defaults[key]
+
+            data[key] = val
+
+        return data
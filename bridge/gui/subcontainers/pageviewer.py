@@ -1,23 +1,329 @@
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 import PIL.Image
-from PIL.ImageQt import ImageQt
-from PyQt6.QtCore import Qt
-from PyQt6.QtGui import QPixmap
-from PyQt6.QtWidgets import QWidget, QVBoxLayout, QScrollArea, QLabel, QMainWindow, QPushButton, QFileDialog, \
-    QApplication, QHBoxLayout
+from PyQt6.QtCore import QAbstractListModel, QEvent, QModelIndex, QObject, QRect, QSize, Qt, pyqtSignal
+from PyQt6.QtGui import QColor, QImage, QKeySequence, QPixmap, QShortcut
+from PyQt6.QtWidgets import (
+    QAbstractItemView,
+    QApplication,
+    QListView,
+    QMainWindow,
+    QPushButton,
+    QStyle,
+    QStyledItemDelegate,
+    QStyleOptionButton,
+    QVBoxLayout,
+    QWidget,
+)
+
+from bridge.cache import LRUCache
+from bridge.document.rendercache import RenderCache
+from bridge.document.store import PageStore
+from bridge.document.thumbnails import THUMBNAIL_WIDTH, make_thumbnail, thumbnail_size
+from bridge.metrics import recorder
+
+MARGIN = 6
+BUTTON_SIZE = QSize(80, 28)
+# memory kept for page previews, least recently drawn ones are dropped first
+THUMBNAIL_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class ThumbnailLoader(QObject):
+    """
+    Makes page previews on a thread pool, off the GUI thread
+
+    ready is emitted from a worker thread, so slots in the GUI thread are
+    queued onto it. A failed preview is reported as a null QImage. Previews of
+    loaded files are kept in the render cache, and read back from it next time
+
+    Args:
+        workers: number of previews made at once (optional, default: 2)
+        cache: RenderCache for previews of loaded files (optional, default: none)
+    """
+
+    ready = pyqtSignal(int, QImage)
+
+    def __init__(self, workers: int = 2, parent=None, cache: None | RenderCache = None):
+        super().__init__(parent)
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._pending = set()
+        self._cache = cache
+
+    def request(self, key: int, source, origin: None | tuple = None) -> None:
+        """
+        Queue the preview of a page, unless it is already queued
+
+        Args:
+            key: page key, passed back with the preview
+            source: function returning what make_thumbnail() takes, called on
+                a worker thread, and only if the preview is not in the cache
+            origin: (content digest, page index) of a loaded file, see Page.origin (optional)
+        """
+        if key in self._pending:
+            return
+        self._pending.add(key)
+        self._pool.submit(self._make, key, source, origin)
+
+    def done(self, key: int) -> None:
+        """Forget a delivered preview, so it can be requested again once evicted"""
+        self._pending.discard(key)
+
+    def shutdown(self) -> None:
+        """Drop queued previews and stop the workers"""
+        # previews already being made are waited for, as they emit ready from
+        # this object, which must not be deleted under them
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def _make(self, key: int, source, origin: None | tuple) -> None:
+        try:
+            image = self._load(source, origin)
+            # copied, as the QImage would otherwise point into the bytes object
+            qimage = QImage(
+                image.tobytes(), image.width, image.height, 3 * image.width, QImage.Format.Format_RGB888
+            ).copy()
+        except Exception as ex:  # pylint: disable=broad-except
+            print(f"could not make a preview: {ex}")
+            qimage = QImage()
+        self.ready.emit(key, qimage)
+
+    def _load(self, source, origin: None | tuple) -> PIL.Image.Image:
+        """Returns the preview of source, from the cache if it was made before"""
+        cache = self._cache if origin is not None else None
+        if cache is not None:
+            image = cache.get_thumbnail(origin, THUMBNAIL_WIDTH)
+            if image is not None:
+                return image.convert("RGB")
+
+        image = make_thumbnail(source())
+        if cache is not None:
+            cache.put_thumbnail(origin, THUMBNAIL_WIDTH, image)
+        return image
+
+
+class PageListModel(QAbstractListModel):
+    """
+    List model of the pages, one row per page
+
+    Each page gets a key on insertion, which stays with it when other pages
+    are added, removed or moved, so per page work (e.g. the preview) is only
+    ever done for the rows that change.
+
+    Previews are made in the background, a placeholder is drawn until then.
+    The pages themselves live in a PageStore, which moves them to disk past
+    its memory budget
+
+    Args:
+        store: PageStore holding the pages (optional, default: a new one)
+        render_cache: RenderCache for previews of loaded files (optional, default: none)
+    """
+
+    def __init__(
+        self, store: None | PageStore = None, parent=None, render_cache: None | RenderCache = None
+    ):
+        super().__init__(parent)
+
+        self._keys = []
+        self._store = store if store is not None else PageStore()
+
+        self._pixmaps = LRUCache(
+            THUMBNAIL_CACHE_BYTES, sizeof=lambda pixmap: pixmap.width() * pixmap.height() * 4
+        )
+        self._placeholders = {}
+        self.loader = ThumbnailLoader(parent=self, cache=render_cache)
+        self.loader.ready.connect(self.thumbnail_ready)
+
+    @property
+    def store(self) -> PageStore:
+        """Returns the page store"""
+        return self._store
+
+    @property
+    def keys(self) -> list:
+        """Returns the store keys of the pages, in order"""
+        return list(self._keys)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._keys)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self._keys):
+            return None
+
+        key = self._keys[index.row()]
+        if role == Qt.ItemDataRole.DecorationRole:
+            # only called for rows in view, so off-screen pages are never resized
+            return self.thumbnail(key)
+        if role == Qt.ItemDataRole.SizeHintRole:
+            _, height = thumbnail_size(self._store.size(key))
+            return QSize(THUMBNAIL_WIDTH + BUTTON_SIZE.width() + 3 * MARGIN, height + 2 * MARGIN)
+        if role == Qt.ItemDataRole.DisplayRole:
+            return f"Page {index.row() + 1}"
+        return None
+
+    def thumbnail(self, key: int) -> QPixmap:
+        """Returns the preview of the page with key, or a placeholder while it is being made"""
+        pixmap = self._pixmaps.get(key)
+        if pixmap is not None:
+            return pixmap
+
+        self.loader.request(key, lambda: self.preview_source(key), self._store.origin(key))
+        return self.placeholder(thumbnail_size(self._store.size(key)))
+
+    def preview_source(self, key: int):
+        """Returns what the preview of a page is made from, read on a loader thread"""
+        # encoded data (e.g. a JPEG) is decoded, and PDF pages rendered, straight at preview size
+        source = self._store.source(key)
+        if source is not None:
+            return source
+        # a spilled page is read for the preview only, without taking memory from the other pages
+        return self._store.get(key, keep=False)
+
+    def placeholder(self, size: tuple) -> QPixmap:
+        """Returns a blank page of size (width, height)"""
+        if size not in self._placeholders:
+            pixmap = QPixmap(*size)
+            pixmap.fill(QColor("lightgray"))
+            self._placeholders[size] = pixmap
+        return self._placeholders[size]
+
+    def thumbnail_ready(self, key: int, image: QImage) -> None:
+        """Store a finished preview and redraw its row"""
+        self.loader.done(key)
+        if key not in self._store:
+            # removed while the preview was being made
+            return
+
+        if image.isNull():
+            # keep the placeholder rather than retrying on every repaint
+            pixmap = self.placeholder(thumbnail_size(self._store.size(key)))
+        else:
+            pixmap = QPixmap.fromImage(image)
+        self._pixmaps.put(key, pixmap)
+
+        index = self.index(self._keys.index(key))
+        self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+
+    def append(self, page) -> None:
+        """Add a Page (or plain image) at the end"""
+        self.insert(len(self._keys), page)
+
+    def insert(self, row: int, page) -> None:
+        """Add a Page (or plain image) before row"""
+        self.insert_many(row, [page])
+
+    def extend(self, pages: list) -> None:
+        """Add Pages (or plain images) at the end, in order"""
+        self.insert_many(len(self._keys), pages)
+
+    def insert_many(self, row: int, pages: list) -> None:
+        """Add Pages (or plain images) before row, in order, as a single change to the view"""
+        if not pages:
+            return
+        with recorder().span("insert", pages=len(pages)):
+            keys = [self._store.add(page) for page in pages]
+            self.beginInsertRows(QModelIndex(), row, row + len(keys) - 1)
+            self._keys[row:row] = keys
+            self.endInsertRows()
+
+    def remove(self, row: int) -> None:
+        """Remove the page at row"""
+        if not 0 <= row < len(self._keys):
+            return
+
+        self.beginRemoveRows(QModelIndex(), row, row)
+        key = self._keys.pop(row)
+        self._store.remove(key)
+        self._pixmaps.pop(key, None)
+        self.endRemoveRows()
+
+    def move(self, row: int, destination: int) -> None:
+        """Move the page at row so that it ends up at destination"""
+        if row == destination or not 0 <= row < len(self._keys) or not 0 <= destination < len(self._keys):
+            return
+
+        # Qt counts the destination before the row is taken out
+        target = destination + 1 if destination > row else destination
+        self.beginMoveRows(QModelIndex(), row, row, QModelIndex(), target)
+        self._keys.insert(destination, self._keys.pop(row))
+        self.endMoveRows()
+
+    def clear(self) -> None:
+        """Remove every page"""
+        self.beginResetModel()
+        self._keys = []
+        self._store.clear()
+        self._pixmaps.clear()
+        self.endResetModel()
+
+
+class PageDelegate(QStyledItemDelegate):
+    """
+    Draws a page preview with a Remove button beside it
+
+    The button is painted rather than being a widget, so rows cost nothing
+    until they are scrolled into view
+    """
+
+    remove_requested = pyqtSignal(int)
+
+    def paint(self, painter, option, index):
+        style = option.widget.style() if option.widget is not None else QApplication.style()
+        style.drawPrimitive(QStyle.PrimitiveElement.PE_PanelItemViewItem, option, painter, option.widget)
+
+        pixmap = index.data(Qt.ItemDataRole.DecorationRole)
+        if pixmap is not None:
+            painter.drawPixmap(option.rect.left() + MARGIN, option.rect.top() + MARGIN, pixmap)
+
+        button = QStyleOptionButton()
+        button.rect = self.button_rect(option.rect)
+        button.text = "Remove"
+        button.state = QStyle.StateFlag.State_Enabled
+        style.drawControl(QStyle.ControlElement.CE_PushButton, button, painter, option.widget)
+
+    def sizeHint(self, option, index):
+        size = index.data(Qt.ItemDataRole.SizeHintRole)
+        return size if size is not None else super().sizeHint(option, index)
+
+    def editorEvent(self, event, model, option, index):
+        if (
+            event.type() == QEvent.Type.MouseButtonRelease
+            and self.button_rect(option.rect).contains(event.position().toPoint())
+        ):
+            self.remove_requested.emit(index.row())
+            return True
+        return super().editorEvent(event, model, option, index)
+
+    @staticmethod
+    def button_rect(rect: QRect) -> QRect:
+        """Returns the area of the Remove button within a row"""
+        left = rect.left() + THUMBNAIL_WIDTH + 2 * MARGIN
+        top = rect.top() + (rect.height() - BUTTON_SIZE.height()) // 2
+        return QRect(left, top, BUTTON_SIZE.width(), BUTTON_SIZE.height())
 
 
 class PageViewerWidget(QWidget):
     """
     Display widget for pages
 
-    Modified from ChatGPT 4o output
+    A list view over a PageListModel: pages are only drawn when scrolled into
+    view, and changes only touch the affected rows. The selected page can be
+    moved with Ctrl+Up and Ctrl+Down
+
+    Args:
+        memory_budget: bytes of decoded pages kept in memory, the rest go to
+            disk (optional, default: see PageStore)
+        render_cache: RenderCache for renders and previews of loaded files
+            (optional, default: none)
     """
-    def __init__(self):
+    def __init__(self, memory_budget: None | int = None, render_cache: None | RenderCache = None):
         super().__init__()
-        self.images = []
+        budget = {} if memory_budget is None else {"budget": memory_budget}
+        store = PageStore(render_cache=render_cache, **budget)
+        self.model = PageListModel(store, self, render_cache=render_cache)
+        self.delegate = PageDelegate(self)
+        self.delegate.remove_requested.connect(self.remove_image)
 
         self.init_ui()
 
@@ -25,62 +331,66 @@ class PageViewerWidget(QWidget):
         self.layout = QVBoxLayout()
         self.setLayout(self.layout)
 
-        self.scroll_area = QScrollArea()
-        self.scroll_area.setWidgetResizable(True)
+        self.list_view = QListView()
+        self.list_view.setModel(self.model)
+        self.list_view.setItemDelegate(self.delegate)
+        self.list_view.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.list_view.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        # lay out long documents in steps, keeping the window responsive
+        self.list_view.setLayoutMode(QListView.LayoutMode.Batched)
 
-        self.scroll_content = QWidget()
-        self.scroll_layout = QVBoxLayout(self.scroll_content)
+        QShortcut(QKeySequence("Ctrl+Up"), self.list_view, lambda: self.move_selected(-1))
+        QShortcut(QKeySequence("Ctrl+Down"), self.list_view, lambda: self.move_selected(1))
 
-        self.scroll_area.setWidget(self.scroll_content)
-        self.layout.addWidget(self.scroll_area)
-
-        self.update_display()
+        self.layout.addWidget(self.list_view)
 
     def update_display(self):
-        print("updating display", end="... ")
-        try:
-            for i in reversed(range(self.scroll_layout.count())):
-                self.scroll_layout.itemAt(i).widget().setParent(None)
+        """Repaint the visible pages"""
+        self.list_view.viewport().update()
 
-            for idx, image in enumerate(self.images):
-                image_widget = QWidget()
-                image_layout = QHBoxLayout()
+    @property
+    def keys(self) -> list:
+        """Returns the store keys of the pages, in order"""
+        return self.model.keys
 
-                width = 400
-                height = int(image.size[1] * (width / image.size[0]))
+    def add_image(self, image):
+        """Add a page, either a Page or a plain image"""
+        print(f"adding image {image}")
+        self.model.append(image)
 
-                label = QLabel()
-                pixmap = QPixmap().fromImage(ImageQt(image.resize((width, height)).convert("P")))
-                label.setPixmap(pixmap)
-                label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+    def add_pages(self, pages: list):
+        """Add several pages at once, e.g. a loaded document, updating the view once"""
+        print(f"adding {len(pages)} pages")
+        self.model.extend(pages)
 
-                image_layout.addWidget(label)
+    def remove_image(self, index):
+        self.model.remove(index)
 
-                remove_button = QPushButton("Remove")
-                remove_button.clicked.connect(lambda _, i=idx: self.remove_image(i))
-                image_layout.addWidget(remove_button)
+    def move_image(self, index, destination):
+        self.model.move(index, destination)
 
-                image_widget.setLayout(image_layout)
-                self.scroll_layout.addWidget(image_widget)
+    def move_selected(self, offset: int):
+        """Move the selected page up (-1) or down (1)"""
+        current = self.list_view.currentIndex()
+        if not current.isValid():
+            return
 
-            print("done")
-        except Exception as ex:
-            print(f"unhandled exception:\n{ex}")
-            raise ex
+        destination = current.row() + offset
+        self.move_image(current.row(), destination)
+        self.list_view.setCurrentIndex(self.model.index(min(max(destination, 0), self.model.rowCount() - 1)))
 
-    def add_image(self, image):
-        print(f"adding image {image}")
-        self.images.append(image)
-        self.update_display()
+    def remove_all_images(self):
+        self.model.clear()
 
-    def remove_image(self, index):
-        if 0 <= index < len(self.images):
-            del self.images[index]
-            self.update_display()
+    @property
+    def memory(self) -> int:
+        """Returns the bytes of decoded pages held in memory"""
+        return self.model.store.memory
 
-    def remove_all_images(self):
-        self.images = []
-        self.update_display()
+    def close_workers(self):
+        """Stop making previews and remove pages moved to disk, e.g. as the window closes"""
+        self.model.loader.shutdown()
+        self.model.store.close()
 
 
 class MainWindow(QMainWindow):
@@ -0,0 +1,282 @@
+"""
+Timing of the phases of a scan, for finding where slow pages lose their time
+
+Code marks phases with span() (or record() for a time measured otherwise).
+Every span is added to a running per phase summary, which costs a lock and
+a few additions. Setting PYSANEBRIDGE_METRICS to a file path also exports
+them: a path ending in .prom gets a Prometheus textfile (for the node
+exporter's textfile collector) rewritten as spans come in, at most every
+PROM_INTERVAL seconds, any other path gets one JSON line per span appended
+
+Phases used: connect, scan, transfer, decode, cleanup, postprocess and insert
+"""
+
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+ENV_METRICS = "PYSANEBRIDGE_METRICS"
+# seconds between rewrites of a Prometheus textfile
+PROM_INTERVAL = 1.0
+
+
+class PhaseStats:
+    """
+    Running totals of one phase
+
+    Args:
+        name: phase name
+    """
+
+    __slots__ = ["name", "count", "seconds", "max_seconds", "bytes"]
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.bytes = 0
+
+    @property
+    def mean(self) -> float:
+        """Returns the mean seconds per span"""
+        return self.seconds / self.count if self.count else 0.0
+
+    @property
+    def throughput(self) -> None | float:
+        """Returns the bytes per second over the phase, None if it moves no data"""
+        if not self.bytes or not self.seconds:
+            return None
+        return self.bytes / self.seconds
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "seconds": self.seconds,
+            "mean": self.mean,
+            "max": self.max_seconds,
+            "bytes": self.bytes,
+        }
+
+
+class Span:
+    """
+    A phase being timed, see Recorder.span()
+
+    Args:
+        phase: phase name
+        fields: details recorded with it, e.g. the resolution
+    """
+
+    __slots__ = ["phase", "fields", "bytes", "start"]
+
+    def __init__(self, phase: str, fields: dict):
+        self.phase = phase
+        self.fields = fields
+        # set by the code in the span if the phase moves data
+        self.bytes = None
+        self.start = time.perf_counter()
+
+
+class Recorder:
+    """
+    Collects phase timings, and writes them out if given a path
+
+    Safe to use from several threads
+
+    Args:
+        path: JSON lines file, or Prometheus textfile if it ends in .prom
+            (optional, default: summary only)
+    """
+
+    __slots__ = ["_path", "_phases", "_lock", "_written", "_timer"]
+
+    def __init__(self, path: None | str = None):
+        self._path = path
+        self._phases = {}
+        self._lock = threading.Lock()
+        self._written = 0.0
+        # pending rewrite of a Prometheus textfile
+        self._timer = None
+
+    @classmethod
+    def from_env(cls) -> "Recorder":
+        """Returns a recorder exporting to the path in PYSANEBRIDGE_METRICS, if set"""
+        return cls(os.environ.get(ENV_METRICS) or None)
+
+    @property
+    def path(self) -> None | str:
+        """Returns the export path, None if spans are only summarised"""
+        return self._path
+
+    @contextmanager
+    def span(self, phase: str, **fields):
+        """
+        Time the block as phase, e.g.
+
+            with recorder.span("transfer") as span:
+                ...
+                span.bytes = received
+
+        A block that raises is recorded too, with error set
+
+        Args:
+            phase: phase name
+            fields: details recorded with the span
+        """
+        span = Span(phase, fields)
+        try:
+            yield span
+        except BaseException as ex:
+            span.fields["error"] = type(ex).__name__
+            raise
+        finally:
+            self.record(phase, time.perf_counter() - span.start, span.bytes, **span.fields)
+
+    def record(self, phase: str, seconds: float, nbytes: None | int = None, **fields) -> None:
+        """
+        Add a timed phase
+
+        Args:
+            phase: phase name
+            seconds: time it took
+            nbytes: data it moved (optional)
+            fields: details recorded with it
+        """
+        with self._lock:
+            stats = self._phases.get(phase)
+            if stats is None:
+                stats = self._phases[phase] = PhaseStats(phase)
+            stats.count += 1
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.bytes += nbytes or 0
+
+        if self._path is None:
+            return
+        try:
+            if self._path.endswith(".prom"):
+                self._schedule()
+            else:
+                self._append(phase, seconds, nbytes, fields)
+        except OSError as ex:
+            # metrics must never stop a scan
+            print(f"could not write metrics to {self._path}: {ex}")
+
+    def summary(self) -> dict:
+        """Returns the totals of every phase, by name"""
+        with self._lock:
+            return {name: stats.to_dict() for name, stats in self._phases.items()}
+
+    def summary_text(self) -> str:
+        """Returns a one line summary of the mean time of each phase, for display"""
+        with self._lock:
+            phases = list(self._phases.values())
+        parts = []
+        for stats in phases:
+            text = f"{stats.name} {stats.mean:.2f}s"
+            if stats.throughput is not None:
+                text += f" ({stats.throughput / 1e6:.1f} MB/s)"
+            parts.append(text)
+        return ", ".join(parts)
+
+    def reset(self) -> None:
+        """Forget every phase"""
+        with self._lock:
+            self._phases.clear()
+
+    def flush(self) -> None:
+        """Write out a pending Prometheus textfile"""
+        if self._path is not None and self._path.endswith(".prom"):
+            with self._lock:
+                timer, self._timer = self._timer, None
+            if timer is not None:
+                timer.cancel()
+            self.write_prometheus()
+
+    def write_prometheus(self) -> None:
+        """Rewrite the Prometheus textfile, atomically, so a scrape never sees half of it"""
+        lines = [
+            "# HELP pysanebridge_phase_seconds_total Time spent in each scan phase",
+            "# TYPE pysanebridge_phase_seconds_total counter",
+        ]
+        summary = self.summary()
+        for name, stats in summary.items():
+            lines.append(f'pysanebridge_phase_seconds_total{{phase="{name}"}} {stats["seconds"]:.6f}')
+        lines += [
+            "# HELP pysanebridge_phase_count_total Spans of each scan phase",
+            "# TYPE pysanebridge_phase_count_total counter",
+        ]
+        for name, stats in summary.items():
+            lines.append(f'pysanebridge_phase_count_total{{phase="{name}"}} {stats["count"]}')
+        lines += [
+            "# HELP pysanebridge_phase_bytes_total Data moved in each scan phase",
+            "# TYPE pysanebridge_phase_bytes_total counter",
+        ]
+        for name, stats in summary.items():
+            if stats["bytes"]:
+                lines.append(f'pysanebridge_phase_bytes_total{{phase="{name}"}} {stats["bytes"]}')
+
+        directory = os.path.dirname(os.path.abspath(self._path))
+        fd, temp = tempfile.mkstemp(prefix=".metrics-", dir=directory)
+        with os.fdopen(fd, "w", encoding="UTF-8") as o:
+            o.write("\n".join(lines) + "\n")
+        os.replace(temp, self._path)
+        self._written = time.monotonic()
+
+    def _schedule(self) -> None:
+        """Rewrite the Prometheus textfile now, or once PROM_INTERVAL has passed since the last rewrite"""
+        with self._lock:
+            if self._timer is not None:
+                # the rewrite already pending takes in the new span
+                return
+            wait = PROM_INTERVAL - (time.monotonic() - self._written)
+            if wait > 0:
+                self._timer = threading.Timer(wait, self._write_pending)
+                self._timer.daemon = True
+                self._timer.start()
+                return
+        self.write_prometheus()
+
+    def _write_pending(self) -> None:
+        with self._lock:
+            self._timer = None
+        try:
+            self.write_prometheus()
+        except OSError as ex:
+            print(f"could not write metrics to {self._path}: {ex}")
+
+    def _append(self, phase: str, seconds: float, nbytes: None | int, fields: dict) -> None:
+        entry = {"time": time.time(), "phase": phase, "seconds": round(seconds, 6)}
+        if nbytes is not None:
+            entry["bytes"] = nbytes
+            if seconds > 0:
+                entry["bytes_per_second"] = round(nbytes / seconds)
+        entry.update(fields)
+        line = json.dumps(entry, default=str) + "\n"
+        # one write per line, so lines from several threads or processes do not interleave
+        with self._lock, open(self._path, "a", encoding="UTF-8") as o:
+            o.write(line)
+
+
+_RECORDER = None
+_RECORDER_LOCK = threading.Lock()
+
+
+def recorder() -> Recorder:
+    """Returns the shared recorder, set up from the environment on first use"""
+    global _RECORDER  # pylint: disable=global-statement
+    with _RECORDER_LOCK:
+        if _RECORDER is None:
+            _RECORDER = Recorder.from_env()
+            atexit.register(_RECORDER.flush)
+        return _RECORDER
+
+
+def span(phase: str, **fields):
+    """Time a block as phase with the shared recorder, see Recorder.span()"""
+    return recorder().span(phase, **fields)
@@ -0,0 +1,409 @@
+"""
+Cached scanner discovery and option introspection
+
+scanimage -L probes every SANE backend and can take many seconds, so the
+device list and each device's options (from scanimage -A) are kept on disk
+and only refreshed once stale, in the background
+"""
+
+import asyncio
+import json
+import os
+import re
+import shlex
+import tempfile
+import threading
+import time
+
+from bridge.cache import cache_dir
+from bridge.connection.connection import Connection
+
+DEVICE_LINE = re.compile(r"device `(?P<name>[^']+)' is an? (?P<description>.*)")
+OPTION_LINE = re.compile(
+    r"^\s+(?P<flag>--?[\w-]+)(?:\[=\((?P<bool>[^)]*)\)\])?\s*(?P<constraint>.*?)\s*(?:\[(?P<default>[^\]]*)\])?\s*$"
+)
+VALUE_WITH_UNIT = re.compile(r"^(?P<value>-?[\d.]+)(?P<unit>[a-z%]+)$")
+RANGE = re.compile(r"^(?P<min>-?[\d.]+)\.\.(?P<max>-?[\d.]+)(?P<unit>[a-z%]*)(?: \(in steps of (?P<step>[\d.]+)\))?$")
+
+
+def to_number(value: str):
+    """Convert value to an int or float if it is numeric, otherwise return it unchanged"""
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+class DeviceOption:
+    """
+    The constraint on one scanner option, as reported by scanimage -A
+
+    Either a list of allowed values, or a numeric range
+
+    Args:
+        name: option name, e.g. resolution
+        values: allowed values (optional)
+        minimum: lower bound of a range (optional)
+        maximum: upper bound of a range (optional)
+        step: range quantisation (optional)
+        unit: unit of the values, e.g. dpi (optional)
+        default: current value (optional)
+    """
+
+    __slots__ = ["_name", "_values", "_minimum", "_maximum", "_step", "_unit", "_default"]
+
+    def __init__(
+        self,
+        name: str,
+        values: None | list = None,
+        minimum: None | float = None,
+        maximum: None | float = None,
+        step: None | float = None,
+        unit: str = "",
+        default=None,
+    ):
+        self._name = name
+        self._values = values
+        self._minimum = minimum
+        self._maximum = maximum
+        self._step = step
+        self._unit = unit
+        self._default = default
+
+    @property
+    def name(self) -> str:
+        """Returns the option name"""
+        return self._name
+
+    @property
+    def values(self) -> None | list:
+        """Returns the allowed values, None for a range"""
+        return self._values
+
+    @property
+    def default(self):
+        """Returns the value the device currently has"""
+        return self._default
+
+    def allows(self, value) -> bool:
+        """Returns True if the device accepts value"""
+        if self._values is not None:
+            return value in self._values or str(value) in [str(v) for v in self._values]
+
+        if not isinstance(value, (int, float)):
+            return False
+        if self._minimum is not None and value < self._minimum:
+            return False
+        if self._maximum is not None and value > self._maximum:
+            return False
+        if self._step and self._minimum is not None:
+            steps = (value - self._minimum) / self._step
+            return abs(steps - round(steps)) < 1e-6
+        return True
+
+    def describe(self) -> str:
+        """Returns the constraint in scanimage notation"""
+        if self._values is not None:
+            return "|".join(str(v) for v in self._values) + self._unit
+        step = f" (in steps of {self._step})" if self._step else ""
+        return f"{self._minimum}..{self._maximum}{self._unit}{step}"
+
+    def to_dict(self) -> dict:
+        """Returns the option as a json-able dict"""
+        return {
+            "name": self._name,
+            "values": self._values,
+            "minimum": self._minimum,
+            "maximum": self._maximum,
+            "step": self._step,
+            "unit": self._unit,
+            "default": self._default,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DeviceOption":
+        """Create an option from the output of to_dict()"""
+        return cls(**data)
+
+
+class Device:
+    """
+    A scanner and the options it supports
+
+    Args:
+        name: SANE device name
+        description: vendor and model, as reported by scanimage -L
+        options: DeviceOption objects keyed by name (optional)
+    """
+
+    __slots__ = ["_name", "_description", "_options"]
+
+    def __init__(self, name: str, description: str, options: None | dict = None):
+        self._name = name
+        self._description = description
+        self._options = options if options is not None else {}
+
+    def __str__(self):
+        return f"device `{self.name}' is a {self.description}"
+
+    @property
+    def name(self) -> str:
+        """Returns the SANE device name"""
+        return self._name
+
+    @property
+    def description(self) -> str:
+        """Returns the vendor and model"""
+        return self._description
+
+    @property
+    def options(self) -> dict:
+        """Returns the known options, keyed by name"""
+        return self._options
+
+    def validate(self, **options) -> None:
+        """
+        Check option values against the device constraints, raising ValueError
+        for any the device would refuse. Unknown options are not checked
+
+        Args:
+            options: option values by name, e.g. resolution=300
+        """
+        for name, value in options.items():
+            option = self._options.get(name)
+            if option is not None and not option.allows(value):
+                raise ValueError(
+                    f"{self.name} does not support {name} {value}, expected {option.describe()}"
+                )
+
+    def to_dict(self) -> dict:
+        """Returns the device as a json-able dict"""
+        return {
+            "name": self._name,
+            "description": self._description,
+            "options": [option.to_dict() for option in self._options.values()],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Device":
+        """Create a device from the output of to_dict()"""
+        options = [DeviceOption.from_dict(option) for option in data["options"]]
+        return cls(data["name"], data["description"], {option.name: option for option in options})
+
+
+def parse_device_list(text: str) -> list:
+    """
+    Parse the output of scanimage -L
+
+    Returns a list of (name, description) tuples
+    """
+    devices = []
+    for line in text.splitlines():
+        match = DEVICE_LINE.search(line)
+        if match:
+            devices.append((match.group("name"), match.group("description")))
+    return devices
+
+
+def parse_options(text: str) -> dict:
+    """
+    Parse the output of scanimage -A
+
+    Returns DeviceOption objects keyed by option name
+    """
+    options = {}
+    for line in text.splitlines():
+        match = OPTION_LINE.match(line)
+        if not match:
+            continue
+
+        name = match.group("flag").lstrip("-").replace("-", "_")
+        default = match.group("default")
+        if default is not None:
+            default = to_number(default)
+
+        if match.group("bool") is not None:
+            options[name] = DeviceOption(name, values=match.group("bool").split("|"), default=default)
+            continue
+
+        constraint = match.group("constraint")
+        limits = RANGE.match(constraint)
+        if limits:
+            options[name] = DeviceOption(
+                name,
+                minimum=to_number(limits.group("min")),
+                maximum=to_number(limits.group("max")),
+                step=to_number(limits.group("step")) if limits.group("step") else None,
+                unit=limits.group("unit"),
+                default=default,
+            )
+        elif "|" in constraint:
+            values = constraint.split("|")
+            # a unit is only given once, after the last of a list of numbers
+            unit = ""
+            suffixed = VALUE_WITH_UNIT.match(values[-1])
+            if suffixed:
+                values[-1], unit = suffixed.group("value"), suffixed.group("unit")
+            options[name] = DeviceOption(name, values=[to_number(v) for v in values], unit=unit, default=default)
+
+    return options
+
+
+class DeviceRegistry:
+    """
+    Scanners available on a host, cached on disk
+
+    The cache is used as long as it is younger than ttl, and refreshed in the
+    background once stale
+
+    Args:
+        conn: Connection to the scanner host
+        path: cache file (optional, default: per host, in the user cache directory)
+        ttl: seconds a cached listing stays valid (optional, default: one day)
+    """
+
+    __slots__ = ["_conn", "_path", "_ttl", "_devices", "_updated", "_lock", "_refresh_thread"]
+
+    def __init__(self, conn: Connection, path: None | str = None, ttl: float = 86400):
+        self._conn = conn
+        if path is None:
+            safe_name = re.sub(r"[^\w.@-]", "_", conn.userhost)
+            path = os.path.join(cache_dir(), f"devices-{safe_name}.json")
+        self._path = path
+        self._ttl = ttl
+
+        self._devices = None
+        self._updated = 0.0
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+
+        self.load()
+
+    @property
+    def path(self) -> str:
+        """Returns the cache file path"""
+        return self._path
+
+    @property
+    def stale(self) -> bool:
+        """Returns True if the listing is missing or older than the ttl"""
+        return self._devices is None or time.time() - self._updated > self._ttl
+
+    @property
+    def cached(self) -> None | list:
+        """Returns the cached devices without ever probing the host, None if unknown"""
+        return self._devices
+
+    @property
+    def devices(self) -> list:
+        """Returns the available devices, probing the host only if nothing is cached"""
+        if self._devices is None:
+            self.refresh()
+        elif self.stale:
+            self.refresh_async()
+        return self._devices
+
+    def get(self, name: None | str = None) -> None | Device:
+        """
+        Returns a cached device, without probing the host
+
+        Args:
+            name: SANE device name (optional, default: the first device, which scanimage uses)
+        """
+        if not self._devices:
+            return None
+        if name is None:
+            return self._devices[0]
+        for device in self._devices:
+            if device.name == name:
+                return device
+        return None
+
+    def validate(self, name: None | str = None, **options) -> None:
+        """
+        Check options against a cached device, see Device.validate()
+
+        Nothing is checked if the device is not cached yet
+
+        Args:
+            name: SANE device name (optional, default: the first device)
+            options: option values by name, e.g. resolution=300
+        """
+        device = self.get(name)
+        if device is not None:
+            device.validate(**options)
+
+    def load(self) -> None:
+        """Read the cache file, if there is a readable one"""
+        try:
+            with open(self._path, encoding="UTF-8") as o:
+                data = json.load(o)
+            devices = [Device.from_dict(device) for device in data["devices"]]
+            updated = float(data["updated"])
+        except (OSError, ValueError, KeyError, TypeError) as ex:
+            # missing, unreadable, or written in another layout (e.g. by an older version)
+            if not isinstance(ex, FileNotFoundError):
+                print(f"ignoring device cache {self._path}: {ex!r}")
+            return
+
+        self._devices = devices
+        self._updated = updated
+
+    def save(self) -> None:
+        """Write the cache file, atomically"""
+        data = {
+            "userhost": self._conn.userhost,
+            "updated": self._updated,
+            "devices": [device.to_dict() for device in self._devices],
+        }
+        # a name of its own, as another process may be saving the same host
+        fd, temp = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(os.path.abspath(self._path)))
+        try:
+            with os.fdopen(fd, "w", encoding="UTF-8") as o:
+                json.dump(data, o, indent=1)
+            os.replace(temp, self._path)
+        except BaseException:
+            os.remove(temp)
+            raise
+
+    def refresh(self) -> list:
+        """Probe the host for devices and their options, then update the cache"""
+        return asyncio.run(self.arefresh())
+
+    async def arefresh(self) -> list:
+        """Probe the host from an asyncio event loop, see refresh()"""
+        devices = await self._probe()
+
+        with self._lock:
+            self._devices = devices
+            self._updated = time.time()
+            self.save()
+
+        return devices
+
+    def refresh_async(self) -> None:
+        """Refresh in a background thread, unless a refresh is already running"""
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+
+        self._refresh_thread = threading.Thread(target=self.refresh, daemon=True)
+        self._refresh_thread.start()
+
+    async def _probe(self) -> list:
+        """List the devices, then query the options of all of them at once"""
+        listing = await self._conn.run("scanimage -L")
+        if listing.returncode != 0:
+            raise RuntimeError(f"could not list devices: {listing.stderr.strip()}")
+
+        found = parse_device_list(listing.stdout)
+        results = await asyncio.gather(
+            *[self._conn.run(f"scanimage -A -d {shlex.quote(name)}") for name, _ in found]
+        )
+        return [
+            Device(name, description, parse_options(result.stdout))
+            for (name, description), result in zip(found, results)
+        ]
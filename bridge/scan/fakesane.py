@@ -0,0 +1,227 @@
+"""
+The processes of a simulated scanner host, see bridge.scan.simulator
+
+scanimage answers -L, -A, single scans (to stdout or --output-file) and
+--batch like the real one, taking a set time per page. link runs a command
+as the host would and passes its output on at the speed of the simulated
+link. Only the standard library is used (and PIL for encoded formats), so
+they start about as quickly as the real commands
+
+usage (as run by FakeSANE, not by hand):
+    python fakesane.py link --home DIR --bin DIR [--latency S] [--bandwidth B] -- CMD
+    python fakesane.py scanimage [scanimage arguments]
+"""
+
+import argparse
+import io
+import os
+import random
+import subprocess
+import sys
+import time
+
+DEVICE = "sim:flatbed0"
+DESCRIPTION = "PySANEBridge simulated flatbed scanner"
+RESOLUTIONS = (75, 100, 150, 200, 300, 600, 1200)
+# a real scanimage exits with this once the feeder runs out of sheets
+EXIT_NO_DOCS = 7
+CHUNK_SIZE = 64 * 1024
+# low bits of every byte flipped at random, and the distinct noisy rows made of each
+NOISE = b"\x07"
+NOISE_VARIANTS = 16
+
+# settings of the fake scanimage, passed on in the environment
+ENV_SCAN_SECONDS = "PYSANEBRIDGE_SIM_SCAN_SECONDS"
+ENV_WIDTH = "PYSANEBRIDGE_SIM_WIDTH"
+ENV_HEIGHT = "PYSANEBRIDGE_SIM_HEIGHT"
+ENV_FEEDER = "PYSANEBRIDGE_SIM_FEEDER"
+
+OPTIONS = f"""
+All options specific to device `{DEVICE}':
+  Scan mode:
+    --mode Gray|Color [Color]
+        Selects the scan mode.
+    --resolution {'|'.join(str(r) for r in RESOLUTIONS)}dpi [75]
+        Sets the resolution of the scanned image.
+    --source Flatbed|ADF [Flatbed]
+        Selects the scan source.
+  Geometry:
+    -x 0..215.9mm [215.9]
+    -y 0..297.1mm [297.1]
+"""
+
+
+def link(args) -> int:
+    """Run a command as the simulated host would, passing its output on at the link speed"""
+    time.sleep(args.latency)
+
+    env = dict(os.environ)
+    env["PATH"] = f"{args.bin}{os.pathsep}{env.get('PATH', '')}"
+    env.update(value.split("=", 1) for value in args.env)
+
+    # stderr goes straight through, as scanimage's progress would over ssh
+    with subprocess.Popen(["sh", "-c", args.cmd], cwd=args.home, env=env, stdout=subprocess.PIPE) as proc:
+        out = sys.stdout.buffer
+        start = time.perf_counter()
+        sent = 0
+        while True:
+            chunk = proc.stdout.read1(CHUNK_SIZE)
+            if not chunk:
+                break
+            out.write(chunk)
+            out.flush()
+            sent += len(chunk)
+            if args.bandwidth:
+                # hold back until the link would have carried what was sent
+                ahead = sent / args.bandwidth - (time.perf_counter() - start)
+                if ahead > 0:
+                    time.sleep(ahead)
+    return proc.returncode
+
+
+def page_data(resolution: int, fmt: str, color: bool = True) -> bytes:
+    """
+    Returns a synthetic page: black lines of "text" on white, as a scanner would send it
+
+    Args:
+        resolution: DPI
+        fmt: pnm, tiff, png or jpeg
+        color: colour rather than grey (optional, default: True)
+    """
+    width = int(float(os.environ.get(ENV_WIDTH, 8.5)) * resolution)
+    height = int(float(os.environ.get(ENV_HEIGHT, 11.0)) * resolution)
+    channels = 3 if color else 1
+
+    # rows of words, in a few variations, with white between lines and at the margins
+    margin = resolution // 2
+    line = max(1, resolution // 12)
+    rows = []
+    for variant in range(4):
+        row = bytearray(b"\xff" * width)
+        x = margin + variant * line
+        while x < width - margin:
+            end = min(x + line * (2 + (x * 7 + variant) % 5), width - margin)
+            row[x:end] = b"\x20" * (end - x)
+            x = end + line
+        rows.append(bytes(b for b in row for _ in range(channels)))
+    blank = b"\xff" * (width * channels)
+
+    # sensor noise in the low bits, in enough variants that gzip cannot just
+    # refer back to an earlier row, so the page compresses like a real scan
+    noisy = {}
+    rng = random.Random(resolution)
+    mask = int.from_bytes(NOISE * len(blank), "big")
+    for key, row in [*enumerate(rows), ("blank", blank)]:
+        noisy[key] = [
+            (int.from_bytes(row, "big") ^ (int.from_bytes(rng.randbytes(len(row)), "big") & mask)).to_bytes(
+                len(row), "big"
+            )
+            for _ in range(NOISE_VARIANTS)
+        ]
+
+    body = bytearray()
+    for y in range(height):
+        text_line = margin <= y < height - margin and (y // line) % 3 == 0
+        body += noisy[(y // (3 * line)) % 4 if text_line else "blank"][y % NOISE_VARIANTS]
+
+    if fmt == "pnm":
+        header = f"{'P6' if color else 'P5'}\n{width} {height}\n255\n".encode()
+        return header + bytes(body)
+
+    # only needed for encoded formats
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    buffer = io.BytesIO()
+    image = Image.frombytes("RGB" if color else "L", (width, height), bytes(body))
+    image.save(buffer, format={"tiff": "TIFF", "png": "PNG", "jpeg": "JPEG"}[fmt], dpi=(resolution, resolution))
+    return buffer.getvalue()
+
+
+def scan(out, resolution: int, fmt: str, color: bool) -> None:
+    """Take the time a scan takes, then write the page to out"""
+    data = page_data(resolution, fmt, color)
+    seconds = float(os.environ.get(ENV_SCAN_SECONDS, 0.5))
+    if fmt != "pnm":
+        # encoded formats are only complete at the end
+        time.sleep(seconds)
+        out.write(data)
+        return
+
+    # raw data arrives as the head moves down the page
+    chunks = range(0, len(data), CHUNK_SIZE)
+    for offset in chunks:
+        out.write(data[offset:offset + CHUNK_SIZE])
+        out.flush()
+        time.sleep(seconds / len(chunks))
+
+
+def scanimage(argv: list) -> int:
+    """The fake scanimage, returning its exit status"""
+    parser = argparse.ArgumentParser(prog="scanimage")
+    parser.add_argument("-L", "--list-devices", action="store_true")
+    parser.add_argument("-A", "--all-options", action="store_true")
+    parser.add_argument("-d", "--device-name", default=DEVICE)
+    parser.add_argument("--resolution", type=int, default=75)
+    parser.add_argument("--format", default="pnm", choices=["pnm", "tiff", "png", "jpeg"])
+    parser.add_argument("--mode", default="Color", choices=["Gray", "Color"])
+    parser.add_argument("--source", default="Flatbed")
+    parser.add_argument("-o", "--output-file")
+    parser.add_argument("--batch", nargs="?", const="out%d.pnm")
+    parser.add_argument("--batch-count", type=int)
+    parser.add_argument("--batch-print", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.list_devices:
+        print(f"device `{DEVICE}' is a {DESCRIPTION}")
+        return 0
+    if args.device_name != DEVICE:
+        print(f"scanimage: open of device {args.device_name} failed: Invalid argument", file=sys.stderr)
+        return 1
+    if args.all_options:
+        print(OPTIONS)
+        return 0
+    if args.resolution not in RESOLUTIONS:
+        print("scanimage: setting of option --resolution failed: Invalid argument", file=sys.stderr)
+        return 1
+
+    color = args.mode == "Color"
+    if args.batch is not None:
+        count = args.batch_count or int(os.environ.get(ENV_FEEDER, 5))
+        for page in range(1, count + 1):
+            path = args.batch % page
+            with open(path, "wb") as o:
+                scan(o, args.resolution, args.format, color)
+            if args.batch_print:
+                print(path, flush=True)
+        if args.batch_count is None:
+            print("scanimage: sane_start: Document feeder out of documents", file=sys.stderr)
+            return EXIT_NO_DOCS
+        return 0
+
+    if args.output_file:
+        with open(args.output_file, "wb") as o:
+            scan(o, args.resolution, args.format, color)
+    else:
+        scan(sys.stdout.buffer, args.resolution, args.format, color)
+    return 0
+
+
+def main(argv=None) -> int:
+    """Run scanimage or link, returning the exit status"""
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "scanimage":
+        return scanimage(argv[1:])
+
+    parser = argparse.ArgumentParser(description="simulated scanner host link")
+    parser.add_argument("command", choices=["link"])
+    parser.add_argument("--home", required=True)
+    parser.add_argument("--bin", required=True)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--bandwidth", type=float)
+    parser.add_argument("--env", action="append", default=[])
+    parser.add_argument("cmd")
+    return link(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,394 @@
+"""
+Scheduler spreading scan jobs over several scanner stations
+"""
+
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class ScanJob:
+    """
+    A queued scan request
+
+    Args:
+        resolution: scan resolution in DPI
+        batch: scan every page in the feeder, the result being a list of pages
+            (optional, default: False)
+    """
+
+    __slots__ = ["_resolution", "_batch", "_future", "_attempts", "_tried"]
+
+    def __init__(self, resolution: int = 300, batch: bool = False):
+        self._resolution = resolution
+        self._batch = batch
+
+        self._future = Future()
+        self._attempts = 0
+        self._tried = set()
+
+    @property
+    def resolution(self) -> int:
+        """Returns the scan resolution"""
+        return self._resolution
+
+    @property
+    def batch(self) -> bool:
+        """Returns True for a document feeder batch"""
+        return self._batch
+
+    @property
+    def future(self) -> Future:
+        """Returns the Future resolving to the scanned Page (or list of them)"""
+        return self._future
+
+    @property
+    def attempts(self) -> int:
+        """Returns the number of failed attempts so far"""
+        return self._attempts
+
+    @property
+    def tried(self) -> set:
+        """Returns the names of the stations that failed this job"""
+        return self._tried
+
+    def failed(self, station: str) -> None:
+        """Record a failed attempt on station"""
+        self._attempts += 1
+        self._tried.add(station)
+
+
+class Station:
+    """
+    One scanner host of the farm, working through its own queue on its own thread
+
+    Args:
+        scanner: Scanner for the host
+        farm: the owning ScanFarm
+    """
+
+    __slots__ = [
+        "_scanner", "_farm", "_queue", "_pending", "_busy", "_healthy_after",
+        "_pages", "_failures", "_busy_seconds", "_lock", "_thread",
+    ]
+
+    def __init__(self, scanner, farm: "ScanFarm"):
+        self._scanner = scanner
+        self._farm = farm
+
+        self._queue = queue.Queue()
+        self._pending = 0
+        self._busy = False
+        self._healthy_after = 0.0
+
+        self._pages = 0
+        self._failures = 0
+        self._busy_seconds = 0.0
+
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    @property
+    def name(self) -> str:
+        """Returns the station's user@host"""
+        return self._scanner.conn.userhost
+
+    @property
+    def scanner(self):
+        """Returns the station's Scanner"""
+        return self._scanner
+
+    @property
+    def load(self) -> int:
+        """Returns the number of jobs queued or running on this station"""
+        return self._pending
+
+    @property
+    def busy(self) -> bool:
+        """Returns True while a job is running"""
+        return self._busy
+
+    @property
+    def healthy(self) -> bool:
+        """Returns False while the station is cooling down after a failure"""
+        return time.monotonic() >= self._healthy_after
+
+    @property
+    def healthy_after(self) -> float:
+        """Returns the monotonic time at which the station is healthy again"""
+        return self._healthy_after
+
+    @property
+    def seconds_per_page(self) -> None | float:
+        """Returns the average scan time, None before the first page"""
+        if self._pages == 0:
+            return None
+        return self._busy_seconds / self._pages
+
+    @property
+    def stats(self) -> dict:
+        """Returns the station's counters"""
+        per_page = self.seconds_per_page
+        return {
+            "pages": self._pages,
+            "failures": self._failures,
+            "busy_seconds": self._busy_seconds,
+            "pages_per_hour": 3600 / per_page if per_page else 0.0,
+            "load": self._pending,
+            "healthy": self.healthy,
+        }
+
+    def mark_unhealthy(self, cooldown: float) -> None:
+        """Keep new jobs away from this station for cooldown seconds"""
+        self._healthy_after = time.monotonic() + cooldown
+
+    def put(self, job: ScanJob) -> None:
+        """Queue a job on this station"""
+        with self._lock:
+            self._pending += 1
+        self._queue.put(job)
+
+    def stop(self) -> None:
+        """Finish the queued jobs, then stop the worker thread"""
+        self._queue.put(None)
+
+    def join(self) -> None:
+        """Wait for the worker thread to stop"""
+        self._thread.join()
+
+    def _work(self) -> None:
+        for job in iter(self._queue.get, None):
+            try:
+                # a retried job is already running, only fresh ones can still be cancelled
+                if job.future.running() or job.future.set_running_or_notify_cancel():
+                    if self._rest():
+                        self._run(job)
+                    else:
+                        job.future.set_exception(
+                            InterruptedError(f"scan farm shut down while {self.name} was cooling down")
+                        )
+            finally:
+                with self._lock:
+                    self._pending -= 1
+
+    def _rest(self) -> bool:
+        """Wait out the station's cooldown, returns False if the farm shut down meanwhile"""
+        wait = self._healthy_after - time.monotonic()
+        return wait <= 0 or not self._farm.stopping.wait(wait)
+
+    def _run(self, job: ScanJob) -> None:
+        self._busy = True
+        start = time.monotonic()
+        try:
+            if job.batch:
+                result = list(
+                    self._scanner.scan_batch(job.resolution, timeout=self._farm.timeout, as_pages=True)
+                )
+                pages = len(result)
+            else:
+                result = self._scanner.scan_page(job.resolution, timeout=self._farm.timeout)
+                pages = 1
+        except (RuntimeError, TimeoutError, OSError) as ex:
+            self._failures += 1
+            print(f"station {self.name} failed: {ex}")
+            self._farm.retry(job, self, ex)
+            return
+        except Exception as ex:  # pylint: disable=broad-except
+            # not worth retrying elsewhere (e.g. unsupported options), but the caller must hear of it
+            job.future.set_exception(ex)
+            return
+        finally:
+            self._busy = False
+
+        self._busy_seconds += time.monotonic() - start
+        self._pages += pages
+        job.future.set_result(result)
+
+
+class ScanFarm:
+    """
+    Sends scan jobs to the least loaded healthy station of a pool
+
+    A station that fails a job is kept out of rotation for a cooldown, and the
+    job is retried on another station. With no other station healthy, the
+    job waits on the first to recover until its cooldown is over
+
+    Args:
+        scanners: Scanner instances, one per station
+        retries: times a failed job is retried before giving up (optional, default: 2)
+        cooldown: seconds a failed station is avoided for (optional, default: 60)
+        timeout: per scan timeout in seconds, passed on to the scanners (optional)
+    """
+
+    __slots__ = ["_stations", "_retries", "_cooldown", "_timeout", "_lock", "_started", "_stopping"]
+
+    def __init__(
+        self,
+        scanners: list,
+        retries: int = 2,
+        cooldown: float = 60.0,
+        timeout: None | float = None,
+    ):
+        if len(scanners) == 0:
+            raise ValueError("a scan farm needs at least one scanner")
+
+        self._retries = retries
+        self._cooldown = cooldown
+        self._timeout = timeout
+
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._stopping = threading.Event()
+        self._stations = [Station(scanner, self) for scanner in scanners]
+
+    @classmethod
+    def from_hosts(cls, hosts: list, **kwargs) -> "ScanFarm":
+        """
+        Create a farm with a Scanner for each user@host string
+
+        Args:
+            hosts: user@host strings
+            kwargs: passed on to ScanFarm
+        """
+        from bridge.scan.scan import Scanner  # pylint: disable=import-outside-toplevel
+
+        return cls([Scanner(host) for host in hosts], **kwargs)
+
+    @property
+    def stations(self) -> list:
+        """Returns the stations"""
+        return self._stations
+
+    @property
+    def hosts(self) -> list:
+        """Returns the user@host of every station"""
+        return [station.name for station in self._stations]
+
+    @property
+    def timeout(self) -> None | float:
+        """Returns the per scan timeout"""
+        return self._timeout
+
+    @property
+    def stopping(self) -> threading.Event:
+        """Returns the Event set once the farm is shut down"""
+        return self._stopping
+
+    @property
+    def pending(self) -> int:
+        """Returns the number of jobs queued or running over all stations"""
+        return sum(station.load for station in self._stations)
+
+    def submit(self, resolution: int = 300, batch: bool = False) -> Future:
+        """
+        Queue a scan on the least loaded station
+
+        Returns a Future resolving to the Page (a list of them for a batch)
+
+        Args:
+            resolution: scan resolution in DPI
+            batch: scan every page in the feeder (optional, default: False)
+        """
+        job = ScanJob(resolution, batch=batch)
+        self._dispatch(job)
+        return job.future
+
+    def retry(self, job: ScanJob, station: Station, error: Exception) -> None:
+        """
+        Handle a job that failed on station, re-dispatching it if retries remain
+
+        Args:
+            job: the failed job
+            station: the station it failed on
+            error: the exception raised
+        """
+        station.mark_unhealthy(self._cooldown)
+        job.failed(station.name)
+
+        if job.attempts > self._retries:
+            job.future.set_exception(error)
+            return
+
+        print(f"retrying scan (attempt {job.attempts + 1})")
+        self._dispatch(job)
+
+    def choose(self, exclude: set | None = None) -> Station:
+        """
+        Pick the station for the next job
+
+        Healthy stations come first, then the fewest queued jobs, then the
+        fastest. If every station is unhealthy, the first to recover is used,
+        the job waiting there until it does
+
+        Args:
+            exclude: names of stations to avoid if any other is healthy (optional)
+        """
+        exclude = exclude or set()
+        healthy = [station for station in self._stations if station.healthy]
+        preferred = [station for station in healthy if station.name not in exclude]
+
+        candidates = preferred or healthy
+        if not candidates:
+            return min(self._stations, key=lambda station: station.healthy_after)
+
+        return min(
+            candidates,
+            key=lambda station: (station.load, station.seconds_per_page or 0.0),
+        )
+
+    def check_health(self) -> dict:
+        """
+        Ping every station at once, taking unreachable ones out of rotation
+
+        Returns the latency (None if unreachable) of each station by name
+        """
+        async def ping_all():
+            return await asyncio.gather(
+                *[station.scanner.conn.aping() for station in self._stations]
+            )
+
+        latencies = asyncio.run(ping_all())
+        for station, latency in zip(self._stations, latencies):
+            if latency is None:
+                station.mark_unhealthy(self._cooldown)
+
+        return {station.name: latency for station, latency in zip(self._stations, latencies)}
+
+    @property
+    def stats(self) -> dict:
+        """Returns the per station counters, and the overall throughput"""
+        stations = {station.name: station.stats for station in self._stations}
+        pages = sum(stats["pages"] for stats in stations.values())
+        elapsed = time.monotonic() - self._started
+
+        return {
+            "stations": stations,
+            "pages": pages,
+            "pending": self.pending,
+            "pages_per_hour": pages / elapsed * 3600 if elapsed > 0 else 0.0,
+        }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stop the stations once their queues are empty
+
+        Jobs waiting on a station's cooldown are not waited for, they fail
+        with InterruptedError
+
+        Args:
+            wait: block until every station has stopped (optional, default: True)
+        """
+        self._stopping.set()
+        for station in self._stations:
+            station.stop()
+        if wait:
+            for station in self._stations:
+                station.join()
+
+    def _dispatch(self, job: ScanJob) -> None:
+        with self._lock:
+            station = self.choose(exclude=job.tried)
+            station.put(job)
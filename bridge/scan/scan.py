@@ -1,61 +1,508 @@
 """
 The scan class holds the actual scanner instance
 """
+import io
 import os
+import queue
 import random
+import re
+import shlex
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from PIL import Image
 
+from bridge.agent.client import AgentClient
+from bridge.connection.cmd import CancelHandle
 from bridge.connection.connection import Connection
+from bridge.connection.sinks import DecompressSink, LineSink, MeterSink, RingBufferSink
+from bridge.document.page import Page
+from bridge.metrics import recorder
+from bridge.scan.devices import DeviceRegistry
+from bridge.scan.transfer import FORMATS, LinkProfile, page_bytes
+
+# how much of the scanimage log to keep for error reports
+STDERR_TAIL = 4096
+# written to stderr after a compressed scan, as the pipeline's status is gzip's
+SCAN_STATUS = "pysanebridge-scan-status:"
 
 
 class Scanner:
     """
     Class for interacting with the scanner proper
+
+    Args:
+        userhost: user@host string
+        stream: stream scans back over stdout instead of going through a
+            remote temporary file (optional, default: True)
+        agent: scan through a scan agent that keeps the device open, either
+            True to start one over ssh or an AgentClient. Falls back to
+            scanimage if the agent is unavailable (optional, default: False)
+        transfer: format streamed scans are sent in (pnm, tiff, png, jpeg), or
+            auto to pick the fastest lossless option for the measured link
+            (optional, default: auto)
+        connection: Connection to use instead of ssh to userhost, e.g. a
+            simulated host, see bridge.scan.simulator (optional)
     """
 
-    __slots__ = ["_conn", "_imagecache"]
+    __slots__ = ["_conn", "_imagecache", "_stream", "_agent", "_registry", "_transfer", "_link"]
+
+    def __init__(
+        self,
+        userhost: str,
+        stream: bool = True,
+        agent: bool | AgentClient = False,
+        transfer: str = "auto",
+        connection: None | Connection = None,
+    ):
+
+        self._conn = connection if connection is not None else Connection(userhost=userhost)
+        self._stream = stream
 
-    def __init__(self, userhost: str):
+        self._link = None
+        self.transfer = transfer
 
-        self._conn = Connection(userhost=userhost)
+        self._registry = None
+
+        self._agent = None
+        if isinstance(agent, AgentClient):
+            self._agent = agent
+        elif agent:
+            self._agent = AgentClient.over_ssh(self._conn)
+
+    def connect(self) -> bool:
+        """
+        Open the ssh master session ahead of the first scan, refreshing the
+        device cache in the background if it is stale
+        """
+        with recorder().span("connect"):
+            connected = self.conn.connect()
+        if connected and self.registry.stale:
+            self.registry.refresh_async()
+        return connected
+
+    @property
+    def registry(self) -> DeviceRegistry:
+        """Returns the cached device listing for this host"""
+        if self._registry is None:
+            self._registry = DeviceRegistry(self.conn)
+        return self._registry
 
     @property
     def conn(self):
         """Returns the private connection property"""
         return self._conn
 
+    @property
+    def stream(self) -> bool:
+        """Returns True if scans are streamed rather than copied"""
+        return self._stream
+
+    @stream.setter
+    def stream(self, stream: bool) -> None:
+        self._stream = stream
+
+    @property
+    def transfer(self) -> str:
+        """Returns the wire format setting, a format name or auto"""
+        return self._transfer
+
+    @transfer.setter
+    def transfer(self, transfer: str) -> None:
+        if transfer != "auto" and transfer not in FORMATS:
+            raise ValueError(f"unknown transfer format {transfer}, expected auto or one of {list(FORMATS)}")
+        self._transfer = transfer
+
+    @property
+    def link(self) -> None | LinkProfile:
+        """Returns the measured link profile, None until auto transfer has needed it"""
+        return self._link
+
+    def transfer_format(self, resolution: int) -> tuple:
+        """
+        Returns the (format, compress) to stream a scan at resolution in
+
+        With auto transfer the link is measured on first use, falling back to
+        png if that fails
+
+        Args:
+            resolution: scan resolution in DPI
+        """
+        if self._transfer != "auto":
+            return self._transfer, False
+
+        if self._link is None:
+            try:
+                self._link = LinkProfile.measure(self.conn)
+                print(f"\tMeasured {self._link}")
+            except RuntimeError as ex:
+                print(f"\tCould not measure the link, using png: {ex}")
+                return "png", False
+
+        return self._link.choose(page_bytes(resolution))
+
+    @property
+    def agent(self) -> None | AgentClient:
+        """Returns the scan agent client, if one is in use"""
+        return self._agent
+
+    @property
+    def use_agent(self) -> bool:
+        """Returns True if scans go through a scan agent"""
+        return self._agent is not None
+
+    @use_agent.setter
+    def use_agent(self, use: bool) -> None:
+        if use and self._agent is None:
+            self._agent = AgentClient.over_ssh(self.conn)
+        elif not use and self._agent is not None:
+            self._agent.close()
+            self._agent = None
+
+    def close(self) -> None:
+        """Stop the scan agent and close the ssh master session"""
+        self.use_agent = False
+        self.conn.close()
+
     def get_devices(self) -> list:
-        """Retrieve a list of available scanners"""
-        devices = [line for line in self.conn.cmd("scanimage -L").stdout.split("\n") if line != ""]
+        """
+        Retrieve a list of available scanners
+
+        Served from the device cache, the host is only probed if nothing is cached
+        """
+        return self.registry.devices
 
-        return devices
+    def check_options(self, resolution: int) -> None:
+        """
+        Raise ValueError for scan options the device does not support
 
-    def scan_image(self, resolution: int = 300) -> Image:
-        """Request a scan and return it as a PIL Image"""
+        Checked locally against the device cache, nothing is checked until the
+        device has been probed once
 
+        Args:
+            resolution: scan resolution in DPI
+        """
         if resolution < 75:
             raise ValueError(f"resolution {resolution} <= 75")
 
-        filename = "".join([str(random.randint(0, 9)) for i in range(16)]) + ".png"
+        self.registry.validate(resolution=resolution)
+
+    async def aget_devices(self) -> list:
+        """Retrieve a list of available scanners from an asyncio event loop, see get_devices()"""
+        if self.registry.cached is not None and not self.registry.stale:
+            return self.registry.cached
+        return await self.registry.arefresh()
+
+    async def ascan_to(
+        self,
+        sink,
+        resolution: int = 300,
+        fmt: str = "png",
+        timeout: None | float = None,
+        compress: bool = False,
+    ) -> None:
+        """
+        Request a scan from an asyncio event loop, see scan_to()
+
+        Cancelling the awaiting task aborts the scan, local and remote
+        """
+        self.check_options(resolution)
+
+        cmd, target = scan_command(resolution, fmt, sink, compress)
+        print(f"\tIssuing scan command {cmd}")
+
+        log = RingBufferSink(STDERR_TAIL)
+        meter = MeterSink(target)
+        start = time.perf_counter()
+        result = await self.conn.run(cmd, binary=True, sink=meter, timeout=timeout, stderr_sink=log)
+        check_scan(result, target, log)
+        record_stream(start, meter, resolution=resolution, fmt=fmt, compress=compress)
+
+    def scan_to(
+        self,
+        sink,
+        resolution: int = 300,
+        fmt: str = "png",
+        timeout: None | float = None,
+        cancel: None | CancelHandle = None,
+        compress: bool = False,
+    ) -> None:
+        """
+        Request a scan, writing the encoded image into sink as it arrives
+
+        Nothing is written to disk on either end, scanimage writes to stdout
+        and the bytes come back over the ssh channel
+
+        Args:
+            sink: writable file-like object or sink, see bridge.connection.sinks
+            resolution: scan resolution in DPI
+            fmt: scanimage output format (pnm, tiff, png, jpeg)
+            timeout: seconds before the scan is abandoned with a TimeoutError (optional)
+            cancel: CancelHandle that aborts the scan, local and remote (optional)
+            compress: gzip the stream on the remote host, sink still receives
+                the plain image (optional, default: False)
+        """
+        self.check_options(resolution)
+
+        meter = MeterSink(sink)
+        start = time.perf_counter()
+        if self._agent_scan(meter, resolution, fmt, timeout=timeout, cancel=cancel):
+            record_stream(start, meter, resolution=resolution, fmt=fmt, agent=True)
+            return
+
+        cmd, target = scan_command(resolution, fmt, sink, compress)
+        print(f"\tIssuing scan command {cmd}")
+
+        log = RingBufferSink(STDERR_TAIL)
+        # metered on the wire, before any inflating
+        meter = MeterSink(target)
+        start = time.perf_counter()
+        result = self.conn.cmd(
+            cmd, binary=True, sink=meter, timeout=timeout, cancel=cancel, stderr_sink=log
+        )
+        if result.cancelled:
+            raise InterruptedError("scan cancelled")
+        check_scan(result, target, log)
+        record_stream(start, meter, resolution=resolution, fmt=fmt, compress=compress)
+
+    def _agent_scan(
+        self,
+        sink,
+        resolution: int,
+        fmt: str,
+        timeout: None | float = None,
+        cancel: None | CancelHandle = None,
+    ) -> bool:
+        """
+        Try to scan through the agent
+
+        Returns False, having written nothing to sink, if scanimage should be used instead
+        """
+        if self._agent is None:
+            return False
+
+        try:
+            self._agent.start()
+        except ConnectionError as ex:
+            print(f"\tScan agent unavailable, using scanimage: {ex}")
+            self._agent = None
+            return False
+
+        print(f"\tRequesting scan from agent at {resolution} dpi")
+        if cancel is not None:
+            cancel.add_callback(self._agent.kill)
+        try:
+            self._agent.scan_to(sink, resolution, fmt, timeout=timeout)
+        except RuntimeError as ex:
+            # the agent reports failures before sending any image data
+            print(f"\t{ex}, retrying with scanimage")
+            return False
+        except ConnectionError as ex:
+            if cancel is not None and cancel.cancelled:
+                raise InterruptedError("scan cancelled") from ex
+            raise
+        finally:
+            if cancel is not None:
+                cancel.remove_callback(self._agent.kill)
+
+        return True
+
+    def scan_image(
+        self,
+        resolution: int = 300,
+        timeout: None | float = None,
+        cancel: None | CancelHandle = None,
+    ) -> Image:
+        """
+        Request a scan and return it as a PIL Image
+
+        Args:
+            resolution: scan resolution in DPI
+            timeout: seconds before the scan is abandoned with a TimeoutError (optional)
+            cancel: CancelHandle that aborts the scan with an InterruptedError (optional)
+        """
+        return self.scan_page(resolution, timeout=timeout, cancel=cancel).image
+
+    def scan_page(
+        self,
+        resolution: int = 300,
+        timeout: None | float = None,
+        cancel: None | CancelHandle = None,
+    ) -> Page:
+        """
+        Request a scan and return it as a Page, which records the resolution
+        and keeps the data as received if it can go into a PDF unchanged (jpeg)
+
+        Args:
+            resolution: scan resolution in DPI
+            timeout: seconds before the scan is abandoned with a TimeoutError (optional)
+            cancel: CancelHandle that aborts the scan with an InterruptedError (optional)
+        """
+
+        self.check_options(resolution)
+
         print("Requesting a scan...")
-        self.conn.cmd("pwd")
+        if not self.stream:
+            return Page(self._scan_via_file(resolution, timeout=timeout, cancel=cancel), dpi=resolution)
+
+        fmt, compress = self.transfer_format(resolution)
+
+        buffer = io.BytesIO()
+        self.scan_to(buffer, resolution, fmt=fmt, timeout=timeout, cancel=cancel, compress=compress)
+        print(f"\tReading in image ({buffer.tell()} bytes)")
+
+        with recorder().span("decode", resolution=resolution, fmt=fmt):
+            return Page.from_bytes(buffer.getvalue(), dpi=resolution)
+
+    def scan_batch(
+        self,
+        resolution: int = 300,
+        count: None | int = None,
+        source: None | str = None,
+        fmt: str = "png",
+        timeout: None | float = None,
+        cancel: None | CancelHandle = None,
+        workers: int = 2,
+        as_pages: bool = False,
+    ):
+        """
+        Scan several pages (e.g. from a document feeder), yielding each one as
+        a PIL Image (or Page) as soon as it is ready
+
+        Runs scanimage --batch on the remote host, which announces every
+        finished page. Each page is fetched and decoded on a thread pool while
+        the scanner is already feeding the next sheet
+
+        Args:
+            resolution: scan resolution in DPI
+            count: number of pages to scan (optional, default: until the feeder is empty)
+            source: scanimage --source, e.g. ADF (optional, default: the device default)
+            fmt: scanimage output format (pnm, tiff, png, jpeg)
+            timeout: seconds to wait for each page before the batch is abandoned
+                with a TimeoutError (optional)
+            cancel: CancelHandle that aborts the batch with an InterruptedError,
+                pages already yielded are kept (optional)
+            workers: number of pages fetched and decoded at once (optional, default: 2)
+            as_pages: yield Page objects rather than images (optional, default: False)
+        """
+        self.check_options(resolution)
+
+        # prefer tmpfs, so pages never reach the SD card of a Pi
+        remote_dir = self.conn.cmd(
+            "mktemp -d /dev/shm/pysanebridge.XXXXXX 2>/dev/null || mktemp -d"
+        ).stdout.strip()
+
+        cmd = (
+            f"scanimage --resolution {resolution} --format={fmt} "
+            f"--batch={remote_dir}/page%04d.{fmt} --batch-print"
+        )
+        if count is not None:
+            cmd += f" --batch-count={count}"
+        if source is not None:
+            cmd += f" --source {shlex.quote(source)}"
+        print(f"\tIssuing batch scan command {cmd}")
+
+        stop = CancelHandle()
+        if cancel is not None:
+            cancel.add_callback(stop.cancel)
+
+        pool = ThreadPoolExecutor(max_workers=workers)
+        pages = queue.Queue()
+        log = RingBufferSink(STDERR_TAIL)
+        results = []
+
+        def announce(line: str):
+            # --batch-print gives the path of each page once it is complete
+            if line.strip() != "":
+                pages.put(pool.submit(self._fetch_page, line.strip(), resolution))
+
+        def produce():
+            try:
+                with LineSink(announce) as lines:
+                    results.append(
+                        self.conn.cmd(cmd, binary=True, sink=lines, cancel=stop, stderr_sink=log)
+                    )
+            finally:
+                pages.put(None)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+
+        scanned = 0
+        try:
+            while True:
+                try:
+                    page = pages.get(timeout=timeout)
+                except queue.Empty as ex:
+                    raise TimeoutError(f"no page from the scanner within {timeout}s") from ex
+                if page is None:
+                    break
+
+                scanned += 1
+                print(f"\tPage {scanned} ready")
+                yield page.result() if as_pages else page.result().image
+        finally:
+            if producer.is_alive():
+                stop.cancel()
+            producer.join()
+            pool.shutdown(wait=True)
+            if cancel is not None:
+                cancel.remove_callback(stop.cancel)
+            with recorder().span("cleanup"):
+                self.conn.cmd(f"rm -rf {remote_dir}")
+
+        if stop.cancelled:
+            raise InterruptedError(f"batch cancelled after {scanned} pages")
+        # an emptied feeder ends the batch with a non-zero status, which only matters with no pages
+        if scanned == 0 and results and results[0].returncode != 0:
+            text = log.getvalue().decode(errors="replace").strip()
+            raise RuntimeError(f"batch scan failed ({results[0].returncode}): {text}")
+
+    def _fetch_page(self, path: str, resolution: int) -> Page:
+        """Read in (and remove) a finished batch page from the remote host"""
+        with recorder().span("transfer", resolution=resolution, batch=True) as span:
+            result = self.conn.cmd(f"cat {path} && rm -f {path}", binary=True)
+            span.bytes = len(result.stdout)
+        if result.returncode != 0:
+            raise RuntimeError(f"could not fetch {path}: {result.stderr.strip()}")
+
+        with recorder().span("decode", resolution=resolution, batch=True):
+            return Page.from_bytes(result.stdout, dpi=resolution)
+
+    def _scan_via_file(
+        self,
+        resolution: int,
+        timeout: None | float = None,
+        cancel: None | CancelHandle = None,
+    ) -> Image:
+        """Scan to a remote file, then copy it back and read it in"""
+        filename = "".join([str(random.randint(0, 9)) for i in range(16)]) + ".png"
 
         cmd = f"scanimage --resolution {resolution} --output-file {filename}"
-        print(f"\tCan connect to host, issuing scan command {cmd}")
+        print(f"\tIssuing scan command {cmd}")
 
-        self.conn.cmd(cmd)
+        with recorder().span("scan", resolution=resolution, stream=False):
+            result = self.conn.cmd(cmd, timeout=timeout, cancel=cancel)
+        if result.cancelled:
+            self.conn.cmd(f"rm -f {filename}")
+            raise InterruptedError("scan cancelled")
         print("\tDone, copying file")
-        self.conn.cmd(f"scp {self.conn.userhost}:{filename} .", local=True)
+        with recorder().span("transfer", resolution=resolution, stream=False) as span:
+            self.conn.copy(filename, ".")
+            span.bytes = os.path.getsize(filename)
         print("\tRemoving remote output")
-        self.conn.cmd(f"rm {filename}")
+        with recorder().span("cleanup", stream=False):
+            self.conn.cmd(f"rm {filename}")
         print("\tReading in image")
-        with Image.open(filename) as imgfile:
-            img = imgfile.copy()
-            
+        with recorder().span("decode", resolution=resolution, stream=False):
+            with Image.open(filename) as imgfile:
+                img = imgfile.copy()
+
         print("\tDeleting temporary file...", end = " ")
         try:
-            os.remove(filename)
+            with recorder().span("cleanup", stream=False):
+                os.remove(filename)
             print("Done.")
         except FileNotFoundError:
             print(f"Error, file not found at: {filename}")
@@ -71,3 +518,70 @@ class Scanner:
         """Scan an image, saving it locally to output_name"""
         img = self.scan_image(resolution)
         img.save(fp=output_name, format="PDF")
+
+
+def scan_command(resolution: int, fmt: str, sink, compress: bool = False) -> tuple:
+    """
+    Returns the remote scanimage command, and the sink its output should go to
+
+    Args:
+        resolution: scan resolution in DPI
+        fmt: scanimage output format
+        sink: destination of the plain image
+        compress: gzip the stream, inflating it again into sink
+    """
+    cmd = f"scanimage --resolution {resolution} --format={fmt}"
+    if not compress:
+        return cmd, sink
+    return f'{{ {cmd}; echo "{SCAN_STATUS}$?" >&2; }} | gzip -1', DecompressSink(sink)
+
+
+def record_stream(start: float, meter: MeterSink, **fields) -> None:
+    """
+    Record a streamed scan as its scan (until the first byte) and transfer phases
+
+    Args:
+        start: time.perf_counter() when the scan was requested
+        meter: sink the stream went through
+        fields: details recorded with both phases
+    """
+    end = time.perf_counter()
+    first = meter.first if meter.first is not None else end
+    recorder().record("scan", first - start, **fields)
+    recorder().record("transfer", end - first, meter.size, **fields)
+
+
+def check_scan(result, target, log: RingBufferSink) -> None:
+    """
+    Raise RuntimeError if a scanimage command failed
+
+    Args:
+        result: the finished command
+        target: sink returned by scan_command()
+        log: the command's stderr
+    """
+    # the tail may start part way through a character
+    text = log.getvalue().decode(errors="replace")
+    if isinstance(target, DecompressSink):
+        target.close()
+        # gzip ends the pipeline, so scanimage's own status comes back on stderr
+        statuses = re.findall(rf"^{re.escape(SCAN_STATUS)}(\d+)$", text, re.MULTILINE)
+        text = re.sub(rf"^{re.escape(SCAN_STATUS)}.*\n?", "", text, flags=re.MULTILINE)
+        if result.returncode == 0 and not statuses:
+            raise RuntimeError(f"scan failed, scanimage did not finish: {text.strip()}")
+        if result.returncode == 0 and statuses[-1] != "0":
+            raise RuntimeError(f"scan failed ({statuses[-1]}): {text.strip()}")
+
+    if result.returncode != 0:
+        raise RuntimeError(f"scan failed ({result.returncode}): {text.strip()}")
+
+
+def decode(data: bytes) -> Image:
+    """
+    Decode an encoded image held in memory
+
+    Args:
+        data: encoded image, in any format PIL can read
+    """
+    with Image.open(io.BytesIO(data)) as imgfile:
+        return imgfile.copy()
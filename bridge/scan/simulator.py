@@ -0,0 +1,141 @@
+"""
+A stand-in for a scanner host, running on this machine
+
+FakeSANE runs remote commands locally, in a directory of their own, with a
+fake scanimage (see bridge.scan.fakesane) first on the PATH. Command output
+is passed through a relay that adds the latency and bandwidth of the
+simulated link, so the real Scanner, Connection and CMD code paths can be
+run and timed without any hardware
+
+POSIX only, as it relies on sh and pkill like a real scanner host
+"""
+
+import os
+import shlex
+import shutil
+import sys
+import tempfile
+
+from bridge.connection.connection import Connection
+from bridge.scan import fakesane
+from bridge.scan.fakesane import ENV_FEEDER, ENV_HEIGHT, ENV_SCAN_SECONDS, ENV_WIDTH
+
+# run as a script, so it needs no installed package and imports nothing of it
+FAKESANE = os.path.abspath(fakesane.__file__)
+
+
+class FakeSANE:
+    """
+    A simulated scanner host
+
+    Args:
+        scan_seconds: time the scanner takes per page (optional, default: 0.5)
+        width: page width in inches (optional, default: letter)
+        height: page height in inches (optional, default: letter)
+        bandwidth: bytes per second of the simulated link (optional, default: unlimited)
+        latency: seconds added to every command, as a round trip would (optional, default: 0)
+        feeder: sheets in the document feeder for a batch without a count (optional, default: 5)
+    """
+
+    __slots__ = [
+        "_scan_seconds", "_width", "_height", "_bandwidth", "_latency", "_feeder", "_root",
+    ]
+
+    def __init__(
+        self,
+        scan_seconds: float = 0.5,
+        width: float = 8.5,
+        height: float = 11.0,
+        bandwidth: None | float = None,
+        latency: float = 0.0,
+        feeder: int = 5,
+    ):
+        self._scan_seconds = scan_seconds
+        self._width = width
+        self._height = height
+        self._bandwidth = bandwidth
+        self._latency = latency
+        self._feeder = feeder
+
+        # home directory of the "remote" commands, and the fake scanimage
+        self._root = tempfile.mkdtemp(prefix="pysanebridge-sim-")
+        os.makedirs(self.home)
+        os.makedirs(self.bin)
+        script = os.path.join(self.bin, "scanimage")
+        with open(script, "w", encoding="UTF-8") as o:
+            o.write(f'#!/bin/sh\nexec {shlex.quote(sys.executable)} {shlex.quote(FAKESANE)} scanimage "$@"\n')
+        os.chmod(script, 0o755)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    @property
+    def home(self) -> str:
+        """Returns the directory remote commands run in"""
+        return os.path.join(self._root, "home")
+
+    @property
+    def bin(self) -> str:
+        """Returns the directory holding the fake scanimage"""
+        return os.path.join(self._root, "bin")
+
+    @property
+    def environment(self) -> dict:
+        """Returns the variables the fake scanimage reads its settings from"""
+        return {
+            ENV_SCAN_SECONDS: str(self._scan_seconds),
+            ENV_WIDTH: str(self._width),
+            ENV_HEIGHT: str(self._height),
+            ENV_FEEDER: str(self._feeder),
+        }
+
+    def link_command(self, cmd: str) -> str:
+        """Returns the local command line that runs cmd as the simulated host would"""
+        args = ["link", "--home", self.home, "--bin", self.bin, "--latency", str(self._latency)]
+        if self._bandwidth:
+            args += ["--bandwidth", str(self._bandwidth)]
+        args += [f"--env={key}={value}" for key, value in self.environment.items()]
+        args += ["--", cmd]
+        return " ".join(shlex.quote(arg) for arg in [sys.executable, FAKESANE, *args])
+
+    def connection(self) -> "LocalConnection":
+        """Returns a Connection to the simulated host"""
+        return LocalConnection(self)
+
+    def scanner(self, **kwargs):
+        """Returns a Scanner of the simulated host, taking the arguments of Scanner"""
+        # deferred, as the scanner brings in PIL
+        from bridge.scan.scan import Scanner  # pylint: disable=import-outside-toplevel
+
+        return Scanner("sim@localhost", connection=self.connection(), **kwargs)
+
+    def close(self) -> None:
+        """Remove the simulated host's files"""
+        shutil.rmtree(self._root, ignore_errors=True)
+
+
+class LocalConnection(Connection):
+    """
+    Connection that runs the remote commands of a FakeSANE on this machine
+
+    Args:
+        host: the simulated host
+    """
+
+    __slots__ = ["_sim"]
+
+    def __init__(self, host: FakeSANE):
+        super().__init__("sim@localhost", multiplex=False)
+        self._sim = host
+
+    def ssh_command(self, cmd: str) -> str:
+        """Wrap cmd in the call that runs it on the simulated host"""
+        return self._sim.link_command(cmd)
+
+    def copy(self, remote: str, local: str = ".", verbose: bool = False):
+        """Copy a file from the simulated host's home directory"""
+        remote = os.path.join(self._sim.home, remote)
+        return self.cmd(f"cp {shlex.quote(remote)} {shlex.quote(local)}", local=True, verbose=verbose)
@@ -0,0 +1,160 @@
+"""
+Choice of the wire format for scans, from the measured link and remote CPU
+
+A Pi is slow at encoding PNG, while raw PNM is large over WiFi. Each format
+(optionally gzipped) is scored by how long the page takes to encode on the
+scanner host plus how long it takes to send, and the fastest is used
+"""
+
+import time
+
+from bridge.connection.connection import Connection
+from bridge.connection.sinks import Sink
+
+# per format: bytes on the wire per raw pixel byte, and remote encoding work per
+# raw byte relative to gzip -1. Rough figures for scanned documents, the
+# measured bandwidth and CPU rate scale them to the actual setup
+FORMATS = {
+    "pnm": (1.0, 0.0),
+    # scanimage writes uncompressed tiff
+    "tiff": (1.0, 0.0),
+    "png": (0.55, 2.5),
+    "jpeg": (0.08, 0.6),
+}
+# gzip -1 over an uncompressed format
+GZIP = (0.6, 1.0)
+LOSSY = {"jpeg"}
+
+# the remote timing probes run through the same ssh channel as a scan
+PROBE_BYTES = 4 * 1024 * 1024
+
+
+def page_bytes(resolution: int, channels: int = 3, width: float = 8.5, height: float = 11.0) -> int:
+    """
+    Returns the size of an uncompressed page scan
+
+    Args:
+        resolution: scan resolution in DPI
+        channels: 3 for colour, 1 for grey (optional, default: 3)
+        width: page width in inches (optional, default: letter)
+        height: page height in inches (optional, default: letter)
+    """
+    return int(width * resolution) * int(height * resolution) * channels
+
+
+class LinkProfile:
+    """
+    Measured speed of the link to a scanner host, and of its CPU
+
+    Args:
+        bandwidth: bytes per second the link carries
+        cpu_rate: bytes per second the host compresses with gzip -1
+        latency: round trip of an empty command, in seconds (optional)
+    """
+
+    __slots__ = ["_bandwidth", "_cpu_rate", "_latency"]
+
+    def __init__(self, bandwidth: float, cpu_rate: float, latency: float = 0.0):
+        self._bandwidth = bandwidth
+        self._cpu_rate = cpu_rate
+        self._latency = latency
+
+    def __repr__(self):
+        return (
+            f"LinkProfile({self._bandwidth / 1e6:.1f} MB/s link, "
+            f"{self._cpu_rate / 1e6:.1f} MB/s gzip, {self._latency * 1000:.0f} ms)"
+        )
+
+    @property
+    def bandwidth(self) -> float:
+        """Returns the link bandwidth in bytes per second"""
+        return self._bandwidth
+
+    @property
+    def cpu_rate(self) -> float:
+        """Returns the remote gzip -1 throughput in bytes per second"""
+        return self._cpu_rate
+
+    @property
+    def latency(self) -> float:
+        """Returns the command round trip in seconds"""
+        return self._latency
+
+    @classmethod
+    def measure(cls, conn: Connection, probe_bytes: int = PROBE_BYTES) -> "LinkProfile":
+        """
+        Time a few transfers over conn to build its profile
+
+        Raises RuntimeError if the host does not answer
+
+        Args:
+            conn: Connection to the scanner host
+            probe_bytes: size of the test transfers (optional, default: 4 MiB)
+        """
+        def timed(cmd: str, binary: bool = False) -> float:
+            start = time.perf_counter()
+            result = conn.cmd(cmd, binary=binary, sink=Sink() if binary else None)
+            if result.returncode != 0:
+                raise RuntimeError(f"link probe failed ({result.returncode}): {cmd}")
+            return time.perf_counter() - start
+
+        latency = timed("true")
+        # urandom is read in both, so its cost cancels out of the gzip timing
+        send = timed(f"head -c {probe_bytes} /dev/zero", binary=True) - latency
+        read = timed(f"head -c {probe_bytes} /dev/urandom > /dev/null")
+        compress = timed(f"head -c {probe_bytes} /dev/urandom | gzip -1 > /dev/null") - read
+
+        # floor the timings, a fast LAN can finish within the timer noise
+        return cls(
+            bandwidth=probe_bytes / max(send, 1e-3),
+            cpu_rate=probe_bytes / max(compress, 1e-3),
+            latency=latency,
+        )
+
+    def estimate(self, fmt: str, compress: bool, raw_bytes: int) -> float:
+        """
+        Returns the expected seconds to encode and send a page
+
+        Args:
+            fmt: scanimage format
+            compress: gzip the stream
+            raw_bytes: uncompressed page size, see page_bytes()
+        """
+        ratio, work = FORMATS[fmt]
+        if compress:
+            ratio *= GZIP[0]
+            work += GZIP[1]
+
+        encode = raw_bytes * work / self._cpu_rate
+        send = raw_bytes * ratio / self._bandwidth
+        return self._latency + encode + send
+
+    def rank(self, raw_bytes: int, lossy: bool = False) -> list:
+        """
+        Returns (seconds, format, compress) for every option, fastest first
+
+        Args:
+            raw_bytes: uncompressed page size, see page_bytes()
+            lossy: include lossy formats (optional, default: False)
+        """
+        options = []
+        for fmt, (ratio, _) in FORMATS.items():
+            if fmt in LOSSY and not lossy:
+                continue
+            options.append((self.estimate(fmt, False, raw_bytes), fmt, False))
+            # only an uncompressed format gains from gzip
+            if ratio == 1.0:
+                options.append((self.estimate(fmt, True, raw_bytes), fmt, True))
+
+        return sorted(options)
+
+    def choose(self, raw_bytes: int, lossy: bool = False) -> tuple:
+        """
+        Returns the fastest (format, compress) for a page
+
+        Args:
+            raw_bytes: uncompressed page size, see page_bytes()
+            lossy: allow lossy formats (optional, default: False)
+        """
+        _, fmt, compress = self.rank(raw_bytes, lossy=lossy)[0]
+        return fmt, compress
@@ -0,0 +1,278 @@
+"""
+Diagnostics for a GUI that stops responding
+
+StallWatchdog notices when a thread (the Qt main thread) stops beating for
+longer than a threshold, and reports what it was doing at the time: the
+action it was running and its stack. profiled() records a cProfile run of a
+block, for a closer look at a slow action afterwards
+
+Both are opt-in, from the environment:
+    PYSANEBRIDGE_WATCHDOG: stall threshold in milliseconds
+    PYSANEBRIDGE_PROFILE: directory to write profiles (and stall reports) to
+"""
+
+import cProfile
+import itertools
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager, nullcontext
+
+ENV_WATCHDOG = "PYSANEBRIDGE_WATCHDOG"
+ENV_PROFILE = "PYSANEBRIDGE_PROFILE"
+# functions listed in the text summary of a profile
+PROFILE_LINES = 40
+# shortest time between beats (and checks), in seconds, so a tiny threshold does not spin
+MIN_INTERVAL = 0.001
+
+# tells apart reports written within the same second
+_REPORT_COUNTER = itertools.count(1)
+
+
+class Stall:
+    """
+    A period the watched thread did not beat
+
+    Args:
+        action: what the thread was running, None if not in an action
+        seconds: how long it has been stalled (updated once it recovers)
+        stack: the thread's stack when the stall was noticed
+    """
+
+    __slots__ = ["action", "seconds", "stack", "time", "path"]
+
+    def __init__(self, action: None | str, seconds: float, stack: str):
+        self.action = action
+        self.seconds = seconds
+        self.stack = stack
+        self.time = time.time()
+        # report file, if written
+        self.path = None
+
+    def __str__(self) -> str:
+        return (
+            f"stall of {self.seconds:.2f}s in {self.action or 'the event loop'}"
+            f" at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.time))}\n{self.stack}"
+        )
+
+
+class StallWatchdog:
+    """
+    Reports a thread that stops beating for longer than threshold
+
+    The watched thread calls beat() regularly (e.g. from a QTimer, so it only
+    beats while its event loop runs). A monitor thread checks the time since
+    the last beat, and once it passes threshold captures the watched thread's
+    stack. Stalls are printed, and written to directory if given
+
+    Args:
+        threshold: seconds without a beat that count as a stall (optional, default: 0.5)
+        directory: where to write stall reports (optional, default: print only)
+        thread: thread to watch (optional, default: the main thread)
+    """
+
+    __slots__ = [
+        "_threshold", "_interval", "_directory", "_thread_id", "_beat",
+        "_actions", "_stall", "_stalls", "_lock", "_stop", "_monitor",
+    ]
+
+    def __init__(
+        self,
+        threshold: float = 0.5,
+        directory: None | str = None,
+        thread: None | threading.Thread = None,
+    ):
+        self._threshold = threshold
+        # checked a few times per threshold, so a stall is caught close to it
+        self._interval = max(MIN_INTERVAL, threshold / 4)
+        self._directory = directory
+        self._thread_id = (thread or threading.main_thread()).ident
+
+        self._beat = time.monotonic()
+        self._actions = []
+        self._stall = None
+        self._stalls = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._monitor = None
+
+    @classmethod
+    def from_env(cls) -> "None | StallWatchdog":
+        """Returns a watchdog set up from PYSANEBRIDGE_WATCHDOG, None if it is not set (or not valid)"""
+        threshold = os.environ.get(ENV_WATCHDOG)
+        if not threshold:
+            return None
+        try:
+            milliseconds = float(threshold)
+        except ValueError:
+            milliseconds = 0.0
+        # also rules out nan and inf
+        if not 0 < milliseconds < float("inf"):
+            print(f"ignoring {ENV_WATCHDOG}={threshold!r}, expected a threshold in milliseconds")
+            return None
+        return cls(milliseconds / 1000, directory=os.environ.get(ENV_PROFILE) or None)
+
+    @property
+    def threshold(self) -> float:
+        """Returns the seconds without a beat that count as a stall"""
+        return self._threshold
+
+    @property
+    def interval(self) -> float:
+        """Returns how often the watched thread should beat, in seconds"""
+        return self._interval
+
+    @property
+    def stalls(self) -> list:
+        """Returns the Stalls seen so far"""
+        with self._lock:
+            return list(self._stalls)
+
+    @property
+    def running(self) -> bool:
+        """Returns True if the monitor thread is watching"""
+        return self._monitor is not None and self._monitor.is_alive()
+
+    def start(self) -> None:
+        """Start watching, from now"""
+        if self.running:
+            return
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._monitor = threading.Thread(target=self._run, name="stall-watchdog", daemon=True)
+        self._monitor.start()
+
+    def stop(self) -> None:
+        """Stop watching"""
+        self._stop.set()
+        if self._monitor is not None:
+            self._monitor.join()
+            self._monitor = None
+
+    def beat(self) -> None:
+        """Called by the watched thread to show it is responsive"""
+        now = time.monotonic()
+        with self._lock:
+            stall, self._stall = self._stall, None
+            if stall is not None:
+                stall.seconds = now - self._beat
+            self._beat = now
+        if stall is not None:
+            print(f"GUI stalled for {stall.seconds:.2f}s in {stall.action or 'the event loop'}")
+            self._write(stall)
+
+    @contextmanager
+    def action(self, name: str):
+        """
+        Name what the watched thread is doing, for stall reports, e.g.
+
+            with watchdog.action("Save"):
+                save_to_file()
+
+        Args:
+            name: action name
+        """
+        self._actions.append(name)
+        try:
+            yield
+        finally:
+            self._actions.pop()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            with self._lock:
+                gap = time.monotonic() - self._beat
+                if gap < self._threshold or self._stall is not None:
+                    continue
+                stall = self._stall = Stall(
+                    self._actions[-1] if self._actions else None, gap, self._stack()
+                )
+                self._stalls.append(stall)
+            print(f"GUI not responding:\n{stall}")
+            self._write(stall)
+
+    def _stack(self) -> str:
+        """Returns the watched thread's stack"""
+        frame = sys._current_frames().get(self._thread_id)  # pylint: disable=protected-access
+        if frame is None:
+            return "(thread not running)\n"
+        return "".join(traceback.format_stack(frame))
+
+    def _write(self, stall: Stall) -> None:
+        """Write (or rewrite, once it has ended) the report of a stall"""
+        if self._directory is None:
+            return
+        try:
+            if stall.path is None:
+                os.makedirs(self._directory, exist_ok=True)
+                stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(stall.time))
+                stall.path = os.path.join(self._directory, f"stall-{stamp}-{next(_REPORT_COUNTER)}.txt")
+            with open(stall.path, "w", encoding="UTF-8") as o:
+                o.write(str(stall))
+        except OSError as ex:
+            print(f"could not write stall report: {ex}")
+
+
+@contextmanager
+def profiled(name: str, directory: str):
+    """
+    Profile the block with cProfile, writing name-<time>-<n>.prof (for
+    pstats or snakeviz) and a .txt summary by cumulative time to directory
+
+    Runs the block unprofiled if another profiler is already active
+
+    Args:
+        name: what is profiled, used in the file names
+        directory: where to write the profile
+    """
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError as ex:
+        # e.g. nested in another profiled block
+        print(f"not profiling {name}: {ex}")
+        profile = None
+    if profile is None:
+        yield None
+        return
+
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        base = os.path.join(directory, f"{name}-{stamp}-{next(_REPORT_COUNTER)}")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            profile.dump_stats(f"{base}.prof")
+            with open(f"{base}.txt", "w", encoding="UTF-8") as o:
+                pstats.Stats(profile, stream=o).sort_stats("cumulative").print_stats(PROFILE_LINES)
+            print(f"profile of {name} written to {base}.prof")
+        except OSError as ex:
+            print(f"could not write profile of {name}: {ex}")
+
+
+def instrumented(name: str, function, watchdog: None | StallWatchdog = None, directory: None | str = None):
+    """
+    Returns function wrapped to run as a named watchdog action and, if
+    directory is given, profiled into it. Arguments are not passed on, as
+    with the slot of a QAction
+
+    Args:
+        name: action name
+        function: called with no arguments
+        watchdog: StallWatchdog to name the action for (optional)
+        directory: profile each call into this directory (optional, default: no profiling)
+    """
+    if watchdog is None and directory is None:
+        return lambda *_: function()
+
+    def run(*_):
+        with watchdog.action(name) if watchdog is not None else nullcontext():
+            with profiled(name, directory) if directory is not None else nullcontext():
+                return function()
+
+    return run
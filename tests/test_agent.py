@@ -0,0 +1,82 @@
+"""
+Test the scan agent and its client, using the fake backend
+"""
+
+import io
+import subprocess
+import sys
+import time
+
+import pytest
+
+from bridge.agent.client import AGENT_PATH, AgentClient, agent_command
+
+
+@pytest.fixture
+def client():
+    """An agent running locally on the fake backend"""
+    agent = AgentClient.local("fake")
+    yield agent
+    agent.close()
+
+
+def test_greeting(client):
+    """Test that the agent starts and identifies itself"""
+    info = client.start()
+
+    assert info["backend"] == "fake"
+    assert client.running
+
+
+def test_scan(client):
+    """Test that a scan arrives whole, and the agent stays up between scans"""
+    for _ in range(2):
+        sink = io.BytesIO()
+        fmt = client.scan_to(sink, resolution=75, fmt="pnm")
+
+        assert fmt == "pnm"
+        assert sink.getvalue().startswith(b"P6\n637 825\n255\n")
+        assert len(sink.getvalue()) == 15 + 637 * 825 * 3
+
+    assert client.running
+
+
+def test_options(client):
+    """Test option introspection"""
+    assert 300 in client.options()["resolution"]
+
+
+def test_error(client):
+    """Test that failures are reported without killing the agent"""
+    assert not client.request("bogus")["ok"]
+    assert client.request("ping")["ok"]
+
+
+def test_unavailable():
+    """Test that a missing agent raises ConnectionError"""
+    with pytest.raises(ConnectionError):
+        AgentClient("exit 1").start()
+
+
+def test_daemon(tmp_path):
+    """Test relaying several sessions to one daemon over a unix socket"""
+    path = str(tmp_path / "agent.sock")
+    daemon = subprocess.Popen([sys.executable, AGENT_PATH, "--backend", "fake", "--socket", path])
+    try:
+        for _ in range(50):
+            if (tmp_path / "agent.sock").exists():
+                break
+            time.sleep(0.1)
+
+        for _ in range(2):
+            client = AgentClient(agent_command(sys.executable, "--connect", path))
+            sink = io.BytesIO()
+            client.scan_to(sink, resolution=75, fmt="pnm")
+            client.close()
+
+            assert sink.getvalue().startswith(b"P6")
+
+        AgentClient(agent_command(sys.executable, "--connect", path)).request("shutdown")
+        assert daemon.wait(timeout=10) == 0
+    finally:
+        daemon.kill()
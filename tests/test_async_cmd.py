@@ -0,0 +1,58 @@
+"""
+Test the asyncio command API
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from bridge.connection.connection import Connection
+from bridge.connection.loop import BackgroundLoop
+
+
+def test_concurrent_run():
+    """Test that many commands run at once on one loop"""
+    conn = Connection("host", multiplex=False)
+
+    async def main():
+        return await asyncio.gather(*[conn.run(f"sleep 0.2; echo {i}", local=True) for i in range(10)])
+
+    start = time.perf_counter()
+    results = asyncio.run(main())
+
+    assert time.perf_counter() - start < 1.5
+    assert [result.stdout for result in results] == [f"{i}\n" for i in range(10)]
+    assert all(result.returncode == 0 for result in results)
+
+
+def test_iter_stdout():
+    """Test iterating over output as it arrives"""
+    conn = Connection("host", multiplex=False)
+
+    async def main():
+        proc = await conn.open("echo a; echo b >&2; echo c", local=True)
+        lines = [line async for line in proc.iter_stdout()]
+        errors = [line async for line in proc.iter_stderr()]
+        return lines, errors, await proc.wait()
+
+    assert asyncio.run(main()) == (["a\n", "c\n"], ["b\n"], 0)
+
+
+def test_async_timeout():
+    """Test that a hung command is killed"""
+    conn = Connection("host", multiplex=False)
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(conn.run("sleep 10", local=True, timeout=0.2))
+
+
+def test_background_loop():
+    """Test running coroutines from synchronous code"""
+    loop = BackgroundLoop()
+    try:
+        result = loop.run(Connection("host").run("printf abc", local=True, binary=True))
+    finally:
+        loop.stop()
+
+    assert result.stdout == b"abc"
@@ -0,0 +1,68 @@
+"""
+Test the benchmark result handling
+"""
+
+import tracemalloc
+
+import pytest
+
+from benchmarks import hot_paths
+from benchmarks.baseline import compare, load, metric, save
+from benchmarks.hot_paths import BENCHMARKS, available, measure
+
+
+def test_compare():
+    """Test that only changes for the worse past the tolerance are reported"""
+    baseline = {
+        "latency": metric(1.0, "s"),
+        "throughput": metric(10.0, "pages/min", higher_is_better=True),
+    }
+
+    assert not compare({"latency": metric(1.1, "s"), "throughput": metric(20.0, "pages/min", True)}, baseline)
+
+    regressions = compare({"latency": metric(0.5, "s"), "throughput": metric(5.0, "pages/min", True)}, baseline)
+    assert len(regressions) == 1 and regressions[0].startswith("throughput")
+
+
+def test_save_load(tmp_path):
+    """Test that results survive a round trip through the JSON file"""
+    path = str(tmp_path / "results" / "run.json")
+    save(path, {"latency": metric(1.5, "s")})
+
+    assert load(path) == {"latency": metric(1.5, "s")}
+
+
+def test_measure():
+    """Test that the peak allocation of a run is traced, and the resident memory followed"""
+    calls = []
+
+    def run():
+        calls.append(tracemalloc.is_tracing())
+        return bytearray(4 * 1024 * 1024)
+
+    seconds, peak, rss = measure(run, repeat=2)
+
+    assert seconds >= 0
+    assert peak >= 4 * 1024 * 1024
+    # timed untraced, then traced once more
+    assert calls == [False, False, True]
+    assert rss is None or rss >= 0
+
+
+@pytest.mark.parametrize("name", list(BENCHMARKS))
+def test_benchmark_runs(name, monkeypatch):
+    """Test that each benchmark still runs, at tiny sizes"""
+    function, modules = BENCHMARKS[name]
+    if not available(modules):
+        pytest.skip(f"{name} needs {', '.join(modules)}")
+    monkeypatch.setattr(hot_paths, "CMD_BYTES", 64 * 1024)
+    monkeypatch.setattr(hot_paths, "VIEWER_PAGES", (3,))
+    monkeypatch.setattr(hot_paths, "EXPORT_DPIS", (75,))
+    monkeypatch.setattr(hot_paths, "EXPORT_PAGES", 1)
+    monkeypatch.setattr(hot_paths, "PDF_PAGES", 2)
+    monkeypatch.setattr(hot_paths, "POSTPROCESS_DPI", 50)
+
+    metrics = function(1)
+
+    assert metrics
+    assert all(value["value"] >= 0 for value in metrics.values())
@@ -0,0 +1,111 @@
+"""
+Test the cache helpers
+"""
+
+import os
+
+import pytest
+
+from bridge.cache import DiskCache, LRUCache, cache_dir
+
+
+def test_cache_dir(tmp_path, monkeypatch):
+    """Test that the cache directory honours XDG_CACHE_HOME"""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+
+    path = cache_dir("thumbs")
+    assert path == str(tmp_path / "pysanebridge" / "thumbs")
+
+
+def test_lru_evicts_least_recent():
+    """Test that the oldest untouched entries go first"""
+    cache = LRUCache(10, sizeof=len)
+    cache.put("a", b"xxxx")
+    cache.put("b", b"xxxx")
+    assert cache.get("a") == b"xxxx"
+
+    cache.put("c", b"xxxx")
+    assert "b" not in cache
+    assert "a" in cache and "c" in cache
+    assert cache.size == 8
+
+
+def test_lru_replace_and_pop():
+    """Test that replacing or removing an entry keeps the size right"""
+    cache = LRUCache(100, sizeof=len)
+    cache.put("a", b"x" * 10)
+    cache.put("a", b"x" * 20)
+    assert cache.size == 20 and len(cache) == 1
+
+    assert cache.pop("a") == b"x" * 20
+    assert cache.pop("a") is None
+    assert cache.size == 0
+
+
+def test_lru_keeps_oversized_newest():
+    """Test that a single entry over budget is still cached"""
+    cache = LRUCache(5, sizeof=len)
+    cache.put("a", b"xx")
+    cache.put("b", b"x" * 10)
+    assert list(k for k in "ab" if k in cache) == ["b"]
+
+
+def test_lru_on_evict():
+    """Test that dropped entries are handed to on_evict"""
+    dropped = []
+    cache = LRUCache(2, on_evict=lambda key, value: dropped.append((key, value)))
+    for key in "abc":
+        cache.put(key, key.upper())
+
+    assert dropped == [("a", "A")]
+    # removing an entry is not an eviction
+    cache.pop("b")
+    assert dropped == [("a", "A")]
+
+
+def test_lru_on_evicting():
+    """Test that on_evicting sees the entry already out of the cache, before on_evict"""
+    calls = []
+    cache = LRUCache(
+        1,
+        on_evicting=lambda key, _: calls.append(("evicting", key, key in cache)),
+        on_evict=lambda key, _: calls.append(("evict", key, key in cache)),
+    )
+    cache.put("a", 1)
+    cache.put("b", 2)
+
+    assert calls == [("evicting", "a", False), ("evict", "a", False)]
+
+
+def test_disk_cache_survives_restart(tmp_path):
+    """Test that entries are read back by a new cache over the same directory"""
+    DiskCache(str(tmp_path), 100).put("page-0", b"data")
+
+    cache = DiskCache(str(tmp_path), 100)
+    assert cache.get("page-0") == b"data"
+    assert cache.get("page-1") is None
+    assert cache.size == 4
+
+
+def test_disk_cache_evicts_least_recent(tmp_path):
+    """Test that the least recently read entries are removed past the budget"""
+    cache = DiskCache(str(tmp_path), 10)
+    cache.put("a", b"xxxx")
+    cache.put("b", b"xxxx")
+    # file times may not resolve writes this close together
+    os.utime(tmp_path / "a", (1, 1))
+    os.utime(tmp_path / "b", (2, 2))
+    assert cache.get("a") == b"xxxx"
+
+    cache.put("c", b"xxxx")
+    assert "b" not in cache
+    assert "a" in cache and "c" in cache
+    assert cache.size == 8
+
+
+def test_disk_cache_names(tmp_path):
+    """Test that entry names cannot leave the directory"""
+    cache = DiskCache(str(tmp_path / "cache"), 10)
+    for name in ("../x", "", "x.part"):
+        with pytest.raises(ValueError):
+            cache.put(name, b"x")
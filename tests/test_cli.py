@@ -0,0 +1,78 @@
+"""
+Test the command line
+"""
+
+import datetime
+import subprocess
+import sys
+
+import pytest
+
+from bridge.cli import is_multipage, main, output_name
+
+
+def test_output_name():
+    """Test the fields of the output pattern"""
+    now = datetime.datetime(2024, 5, 6, 7, 8, 9)
+
+    assert output_name("scan-{n:03}.png", 7, 300, now) == "scan-007.png"
+    assert output_name("{date}/{time}-{resolution}.pdf", 1, 150, now) == "2024-05-06/070809-150.pdf"
+
+    with pytest.raises(ValueError):
+        output_name("scan-{page}.png", 1, 300, now)
+
+
+def test_multipage():
+    """Test that only PDF and TIFF names without a page number get every page"""
+    assert is_multipage("out.pdf")
+    assert is_multipage("out-{date}.TIF")
+    assert not is_multipage("out-{n}.pdf")
+    assert not is_multipage("out.png")
+
+
+def test_pattern_needs_page_number(capsys):
+    """Test that several pages are not written over one file"""
+    assert main(["scan", "pi@host", "--count", "3", "-o", "scan.png"]) == 1
+    assert "{n}" in capsys.readouterr().err
+
+
+def test_no_gui_imports():
+    """Test that the command starts without Qt, PIL or pymupdf"""
+    code = (
+        "import sys, bridge.cli\n"
+        "assert not {'PyQt6', 'PIL', 'pymupdf'} & set(sys.modules), sys.modules.keys()\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+class FailingScanner:
+    """Scanner whose feeder jams after two pages"""
+
+    def __init__(self, *_, **__):
+        pass
+
+    def connect(self):
+        return True
+
+    def scan_batch(self, resolution, **_):
+        from bridge.document.page import Page  # pylint: disable=import-outside-toplevel
+        from PIL import Image  # pylint: disable=import-outside-toplevel
+
+        for _ in range(2):
+            yield Page(Image.new("L", (20, 30), 255), dpi=resolution)
+        raise RuntimeError("scan failed (9): jammed")
+
+    def close(self):
+        pass
+
+
+def test_partial_document(tmp_path, monkeypatch, capsys):
+    """Test that the pages of a document scanned before a failure are saved"""
+    Image = pytest.importorskip("PIL.Image")
+    monkeypatch.setattr("bridge.scan.scan.Scanner", FailingScanner)
+    path = tmp_path / "out.tif"
+
+    assert main(["scan", "pi@host", "--batch", "-r", "100", "-o", str(path)]) == 1
+    assert "partial document of 2 pages" in capsys.readouterr().err
+    with Image.open(path) as image:
+        assert image.n_frames == 2
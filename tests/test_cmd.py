@@ -0,0 +1,71 @@
+"""
+Test the CMD module
+"""
+
+import io
+import threading
+import time
+
+import pytest
+
+from bridge.connection.cmd import CMD, CancelHandle
+
+
+def test_text_capture():
+    """Test that text output is captured as a string"""
+    cmd = CMD("echo hello")
+    cmd.exec()
+
+    assert cmd.stdout == "hello\n"
+    assert cmd.returncode == 0
+
+
+def test_binary_capture():
+    """Test that binary output survives the round trip"""
+    cmd = CMD(r'printf "\000\001\377"; echo warning >&2', binary=True)
+    cmd.exec()
+
+    assert cmd.stdout == b"\x00\x01\xff"
+    assert cmd.stderr == "warning\n"
+
+
+def test_binary_sink():
+    """Test that binary output can be written to a sink instead of cached"""
+    sink = io.BytesIO()
+    cmd = CMD("head -c 200000 /dev/zero", binary=True)
+    cmd.exec(sink=sink)
+
+    assert len(sink.getvalue()) == 200000
+    assert cmd.stdout == b""
+
+
+def test_timeout():
+    """Test that a hung command is killed and reported"""
+    cmd = CMD("sleep 10")
+
+    start = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        cmd.exec(timeout=0.2)
+
+    assert time.perf_counter() - start < 5
+    assert cmd.returncode is not None
+
+
+def test_cancel():
+    """Test that a CancelHandle kills the running command"""
+    cancel = CancelHandle()
+    threading.Timer(0.2, cancel.cancel).start()
+
+    cmd = CMD("sleep 10")
+    cmd.exec(cancel=cancel)
+
+    assert cmd.cancelled
+    assert cmd.returncode != 0
+
+
+def test_returncode():
+    """Test that the exit status is recorded"""
+    cmd = CMD("exit 3")
+    cmd.exec()
+
+    assert cmd.returncode == 3
@@ -0,0 +1,100 @@
+"""
+Test device discovery parsing and caching
+"""
+
+import os
+import time
+
+import pytest
+
+from bridge.connection.connection import Connection
+from bridge.scan.devices import Device, DeviceRegistry, parse_device_list, parse_options
+
+LISTING = """device `hpaio:/usb/Deskjet_3050?serial=CN1' is a Hewlett-Packard Deskjet_3050 all-in-one
+device `v4l:/dev/video0' is a Noname USB camera virtual device
+"""
+
+OPTIONS = """
+All options specific to device `hpaio:/usb/Deskjet_3050?serial=CN1':
+  Scan mode:
+    --mode Lineart|Gray|Color [Color]
+        Selects the scan mode (e.g., lineart, monochrome, or color).
+    --resolution 75|100|150|200|300|600|1200dpi [75]
+        Sets the resolution of the scanned image.
+  Enhancement:
+    --brightness -1000..1000 (in steps of 1) [0]
+    --preview[=(yes|no)] [no]
+  Geometry:
+    -x 0..215.9mm [215.9]
+"""
+
+
+def test_parse_device_list():
+    """Test parsing scanimage -L"""
+    assert parse_device_list(LISTING) == [
+        ("hpaio:/usb/Deskjet_3050?serial=CN1", "Hewlett-Packard Deskjet_3050 all-in-one"),
+        ("v4l:/dev/video0", "Noname USB camera virtual device"),
+    ]
+
+
+def test_parse_options():
+    """Test parsing scanimage -A"""
+    options = parse_options(OPTIONS)
+
+    assert options["resolution"].values == [75, 100, 150, 200, 300, 600, 1200]
+    assert options["resolution"].default == 75
+    assert options["mode"].values == ["Lineart", "Gray", "Color"]
+    assert options["preview"].values == ["yes", "no"]
+    assert options["brightness"].allows(-20)
+    assert not options["brightness"].allows(1001)
+    assert options["x"].allows(100.5)
+
+
+def test_validate():
+    """Test rejecting unsupported options"""
+    device = Device("hpaio", "HP", parse_options(OPTIONS))
+
+    device.validate(resolution=300, mode="Gray", unknown=1)
+    with pytest.raises(ValueError):
+        device.validate(resolution=301)
+    with pytest.raises(ValueError):
+        device.validate(mode="Sepia")
+
+
+def test_registry_cache(tmp_path):
+    """Test that the listing persists and expires"""
+    path = str(tmp_path / "devices.json")
+    conn = Connection("test@host")
+
+    registry = DeviceRegistry(conn, path=path, ttl=60)
+    assert registry.stale
+    assert registry.get() is None
+    registry.validate(resolution=123)  # nothing cached, nothing checked
+
+    registry._devices = [Device("hpaio", "HP", parse_options(OPTIONS))]  # pylint: disable=protected-access
+    registry._updated = time.time()  # pylint: disable=protected-access
+    registry.save()
+
+    reloaded = DeviceRegistry(conn, path=path, ttl=60)
+    assert not reloaded.stale
+    assert reloaded.get().options["resolution"].values[-1] == 1200
+    with pytest.raises(ValueError):
+        reloaded.validate(resolution=123)
+
+    assert DeviceRegistry(conn, path=path, ttl=0).stale
+
+    # saved under a name of its own, then moved into place
+    assert sorted(os.listdir(tmp_path)) == ["devices.json"]
+
+
+@pytest.mark.parametrize(
+    "content", ['{"devices": []}', '{"updated": 1}', "[]", '{"devices": [{}], "updated": 1}', "{"]
+)
+def test_registry_cache_other_layout(tmp_path, content):
+    """Test that a cache file from another version (or edited by hand) counts as no cache"""
+    path = tmp_path / "devices.json"
+    path.write_text(content)
+
+    registry = DeviceRegistry(Connection("test@host"), path=str(path), ttl=60)
+    assert registry.stale
+    assert registry.get() is None
@@ -0,0 +1,133 @@
+"""
+Test the PDF export
+"""
+
+import io
+import os
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+pymupdf = pytest.importorskip("pymupdf")
+
+from bridge.connection.cmd import CancelHandle  # noqa: E402
+from bridge.document.export import PDFExporter  # noqa: E402
+from bridge.document.page import Page  # noqa: E402
+
+
+def pages(count: int) -> list:
+    return [Image.new("RGB", (850, 1100), (i * 20, 100, 200)) for i in range(count)]
+
+
+def test_export(tmp_path):
+    """Test that every page is written, at its physical size"""
+    filename = str(tmp_path / "out.pdf")
+    reports = []
+
+    PDFExporter(filename, dpi_target=50, workers=2).export(
+        pages(5), default_dpi=100, progress=lambda done, total: reports.append((done, total))
+    )
+
+    with pymupdf.open(filename) as doc:
+        assert doc.page_count == 5
+        # 8.5 x 11 inches
+        assert round(doc[0].rect.width) == 612
+        assert round(doc[0].rect.height) == 792
+
+    assert reports[-1] == (5, 5)
+
+
+def test_passthrough(tmp_path):
+    """Test that a JPEG page at the target resolution is embedded unchanged, at its own dpi"""
+    buffer = io.BytesIO()
+    Image.new("RGB", (300, 600), (10, 20, 30)).save(buffer, format="JPEG", dpi=(150, 150))
+    jpeg = Page.from_bytes(buffer.getvalue())
+    assert jpeg.dpi == 150 and jpeg.encoded is not None
+
+    filename = str(tmp_path / "out.pdf")
+    PDFExporter(filename, dpi_target=150, workers=1).export([jpeg, pages(1)[0]], default_dpi=100)
+
+    with pymupdf.open(filename) as doc:
+        xref = doc[0].get_images()[0][0]
+        assert doc.xref_get_key(xref, "Filter") == ("name", "/DCTDecode")
+        # 2 x 4 inches, and the plain page at the default dpi
+        assert round(doc[0].rect.width) == 144
+        assert round(doc[1].rect.width) == 612
+
+
+def test_pdf_pages_copied(tmp_path):
+    """Test that loaded PDF pages are copied with their text, without rendering"""
+    source = str(tmp_path / "in.pdf")
+    with pymupdf.open() as doc:
+        for i in range(2):
+            doc.new_page(width=300, height=400).insert_text((50, 50), f"page {i}")
+        doc.save(source)
+
+    loaded = Page.from_pdf(source, dpi=144)
+    assert [page.size for page in loaded] == [(600, 800), (600, 800)]
+    assert not any(page.decoded for page in loaded)
+
+    filename = str(tmp_path / "out.pdf")
+    PDFExporter(filename, dpi_target=50, workers=1).export(loaded[::-1], default_dpi=100)
+
+    with pymupdf.open(filename) as doc:
+        assert doc.page_count == 2
+        assert "page 1" in doc[0].get_text()
+        assert not doc[0].get_images()
+        assert round(doc[1].rect.width) == 300
+
+
+def test_cancel(tmp_path):
+    """Test that a cancelled export leaves nothing behind"""
+    filename = str(tmp_path / "out.pdf")
+    cancel = CancelHandle()
+
+    def progress(done, total):
+        cancel.cancel()
+
+    with pytest.raises(InterruptedError):
+        PDFExporter(filename, workers=1).export(pages(4), 100, progress=progress, cancel=cancel)
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_pages_fetched_as_needed(tmp_path):
+    """Test that pages can come from a generator, taken only a few ahead of the output"""
+    fetched = []
+
+    def generate():
+        for i, image in enumerate(pages(6)):
+            fetched.append(i)
+            yield image
+
+    filename = str(tmp_path / "out.pdf")
+    reports = []
+
+    def progress(done, total):
+        reports.append((done, total))
+        # with one worker, at most two pages are queued ahead
+        assert len(fetched) <= done + 2
+
+    PDFExporter(filename, workers=1).export(generate(), default_dpi=100, progress=progress, total=6)
+
+    assert reports[-1] == (6, 6)
+    with pymupdf.open(filename) as doc:
+        assert doc.page_count == 6
+
+
+def test_fewer_pages_than_total(tmp_path):
+    """Test that pages dropped from the source (e.g. deleted during the export) end it early"""
+    filename = str(tmp_path / "out.pdf")
+    reports = []
+
+    PDFExporter(filename, workers=1).export(
+        iter(pages(2)), default_dpi=100, progress=lambda *report: reports.append(report), total=3
+    )
+
+    assert reports[-1] == (2, 2)
+    with pymupdf.open(filename) as doc:
+        assert doc.page_count == 2
+
+    with pytest.raises(RuntimeError):
+        PDFExporter(str(tmp_path / "empty.pdf")).export(iter([]), default_dpi=100, total=1)
+    assert os.listdir(tmp_path) == ["out.pdf"]
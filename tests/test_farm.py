@@ -0,0 +1,118 @@
+"""
+Test the scan farm scheduler, with stand-in scanners
+"""
+
+import threading
+import time
+
+import pytest
+
+from bridge.scan.farm import ScanFarm
+
+
+class FakeConn:
+    def __init__(self, userhost):
+        self.userhost = userhost
+
+
+class FakeScanner:
+    """Returns its name for a scan, after delay, failing the first `fail` scans"""
+
+    def __init__(self, name, delay=0.0, fail=0):
+        self.conn = FakeConn(name)
+        self.delay = delay
+        self.fail = fail
+        self.scans = 0
+
+    def scan_page(self, resolution, timeout=None):
+        time.sleep(self.delay)
+        self.scans += 1
+        if self.scans <= self.fail:
+            raise RuntimeError(f"{self.conn.userhost} jammed")
+        return self.conn.userhost
+
+    def scan_batch(self, resolution, timeout=None, as_pages=False):
+        yield from [self.scan_page(resolution), self.scan_page(resolution)]
+
+
+def test_spreads_load():
+    scanners = [FakeScanner("a", delay=0.05), FakeScanner("b", delay=0.05)]
+    farm = ScanFarm(scanners)
+
+    futures = [farm.submit(300) for _ in range(6)]
+    results = [future.result(timeout=5) for future in futures]
+    farm.shutdown()
+
+    assert sorted(results) == ["a"] * 3 + ["b"] * 3
+    assert farm.stats["pages"] == 6
+
+
+def test_retries_elsewhere():
+    scanners = [FakeScanner("a", fail=10), FakeScanner("b")]
+    farm = ScanFarm(scanners, retries=1, cooldown=60)
+
+    assert farm.submit(300).result(timeout=5) == "b"
+    # a is resting, so the next job goes straight to b
+    assert farm.choose().name == "b"
+    assert farm.submit(300).result(timeout=5) == "b"
+    farm.shutdown()
+
+    assert scanners[0].scans == 1
+    assert farm.stats["stations"]["a"]["failures"] == 1
+
+
+def test_gives_up():
+    farm = ScanFarm([FakeScanner("a", fail=10)], retries=2, cooldown=0)
+
+    with pytest.raises(RuntimeError, match="jammed"):
+        farm.submit(300).result(timeout=5)
+    farm.shutdown()
+
+    assert farm.stats["stations"]["a"]["failures"] == 3
+
+
+def test_batch_and_cancel():
+    gate = threading.Event()
+
+    class Blocking(FakeScanner):
+        def scan_page(self, resolution, timeout=None):
+            gate.wait(5)
+            return super().scan_page(resolution, timeout)
+
+    farm = ScanFarm([Blocking("a")])
+    batch = farm.submit(300, batch=True)
+    queued = farm.submit(300)
+
+    assert queued.cancel()
+    gate.set()
+    assert batch.result(timeout=5) == ["a", "a"]
+    farm.shutdown()
+
+    assert farm.pending == 0
+    assert farm.stats["pages"] == 2
+
+
+def test_single_station_rests():
+    """Test that a retry on the only station waits for its cooldown"""
+    farm = ScanFarm([FakeScanner("a", fail=1)], retries=1, cooldown=0.3)
+
+    start = time.monotonic()
+    assert farm.submit(300).result(timeout=5) == "a"
+    assert time.monotonic() - start >= 0.3
+    farm.shutdown()
+
+
+def test_shutdown_during_cooldown():
+    """Test that a job waiting on a cooldown fails at shutdown rather than holding it up"""
+    scanner = FakeScanner("a", fail=10)
+    farm = ScanFarm([scanner], retries=2, cooldown=60)
+    future = farm.submit(300)
+    while scanner.scans == 0:
+        time.sleep(0.01)
+
+    start = time.monotonic()
+    farm.shutdown()
+    assert time.monotonic() - start < 5
+    with pytest.raises(InterruptedError):
+        future.result(timeout=5)
+    assert scanner.scans == 1
@@ -0,0 +1,73 @@
+"""
+Test loading files in parallel
+"""
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from bridge.connection.cmd import CancelHandle  # noqa: E402
+from bridge.document.loader import load_files  # noqa: E402
+
+
+def write_images(tmp_path, count: int) -> list:
+    paths = []
+    for i in range(count):
+        path = str(tmp_path / f"{i}.png")
+        # distinct widths, to check the order
+        Image.new("RGB", (10 + i, 10)).save(path)
+        paths.append(path)
+    return paths
+
+
+def test_order_kept(tmp_path):
+    """Test that pages come back in file order, with failures reported in place"""
+    paths = write_images(tmp_path, 6)
+    bad = str(tmp_path / "bad.png")
+    with open(bad, "wb") as o:
+        o.write(b"not an image")
+    paths.insert(3, bad)
+
+    results = list(load_files(paths, dpi=300, workers=3))
+
+    assert [path for path, _, _ in results] == paths
+    assert results[3][1] == [] and results[3][2] is not None
+    widths = [pages[0].size[0] for _, pages, error in results if error is None]
+    assert widths == [10, 11, 12, 13, 14, 15]
+
+
+def test_cancel(tmp_path):
+    """Test that a cancelled load stops queueing files"""
+    paths = write_images(tmp_path, 20)
+    cancel = CancelHandle()
+
+    loaded = []
+    for path, _, _ in load_files(paths, dpi=300, workers=1, cancel=cancel):
+        loaded.append(path)
+        cancel.cancel()
+
+    # only those already queued finish
+    assert len(loaded) <= 2
+
+
+def test_pdf_pages(tmp_path):
+    """Test that a loaded PDF gives a page per PDF page, each with a preview"""
+    pymupdf = pytest.importorskip("pymupdf")
+    from bridge.document.thumbnails import THUMBNAIL_WIDTH, make_thumbnail  # pylint: disable=import-outside-toplevel
+
+    path = str(tmp_path / "doc.pdf")
+    with pymupdf.open() as doc:
+        for _ in range(2):
+            # A4, which needs a fractional dpi for a 400 px preview
+            doc.new_page()
+        doc.save(path)
+
+    [(_, pages, error)] = list(load_files([path], dpi=150))
+
+    assert error is None
+    assert len(pages) == 2
+    assert pages[0].pdf is not None
+    assert pages[0].size == pages[0].pdf.pixel_size(150)
+    thumbnail = make_thumbnail(pages[0].source)
+    assert thumbnail.size[0] == THUMBNAIL_WIDTH
+    assert pages[1].image.size == pages[1].size
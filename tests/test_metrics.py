@@ -0,0 +1,105 @@
+"""
+Test the scan phase timings
+"""
+
+import json
+import os
+import time
+
+import pytest
+
+from bridge import metrics
+from bridge.metrics import ENV_METRICS, Recorder
+
+
+def test_summary():
+    """Test that spans add up per phase"""
+    recorder = Recorder()
+    recorder.record("scan", 1.0)
+    recorder.record("scan", 3.0)
+    with recorder.span("transfer") as span:
+        span.bytes = 1000
+
+    summary = recorder.summary()
+    assert summary["scan"]["count"] == 2
+    assert summary["scan"]["mean"] == 2.0
+    assert summary["scan"]["max"] == 3.0
+    assert summary["transfer"]["bytes"] == 1000
+    assert recorder.summary_text().startswith("scan 2.00s, transfer ")
+
+    recorder.reset()
+    assert recorder.summary() == {}
+
+
+def test_failed_span():
+    """Test that a span which raises is still recorded, with the error"""
+    recorder = Recorder()
+    with pytest.raises(ValueError):
+        with recorder.span("decode"):
+            raise ValueError("bad image")
+    assert recorder.summary()["decode"]["count"] == 1
+
+
+def test_jsonl(tmp_path):
+    """Test that every span is appended as a JSON line"""
+    path = str(tmp_path / "metrics.jsonl")
+    recorder = Recorder(path)
+    recorder.record("transfer", 0.5, 1000, resolution=300)
+    recorder.record("decode", 0.1)
+
+    with open(path, encoding="UTF-8") as o:
+        lines = [json.loads(line) for line in o]
+    assert [line["phase"] for line in lines] == ["transfer", "decode"]
+    assert lines[0]["bytes"] == 1000
+    assert lines[0]["bytes_per_second"] == 2000
+    assert lines[0]["resolution"] == 300
+
+
+def test_prometheus(tmp_path):
+    """Test that a .prom path gets a textfile of the totals"""
+    path = str(tmp_path / "metrics.prom")
+    recorder = Recorder(path)
+    recorder.record("transfer", 0.5, 1000)
+    recorder.record("transfer", 0.5, 1000)
+    recorder.flush()
+
+    with open(path, encoding="UTF-8") as o:
+        text = o.read()
+    assert 'pysanebridge_phase_seconds_total{phase="transfer"} 1.000000' in text
+    assert 'pysanebridge_phase_count_total{phase="transfer"} 2' in text
+    assert 'pysanebridge_phase_bytes_total{phase="transfer"} 2000' in text
+    # written atomically, nothing left over
+    assert os.listdir(tmp_path) == ["metrics.prom"]
+
+
+def test_prometheus_latest(tmp_path, monkeypatch):
+    """Test that spans recorded soon after a rewrite still reach the textfile"""
+    monkeypatch.setattr(metrics, "PROM_INTERVAL", 0.2)
+    path = str(tmp_path / "metrics.prom")
+    recorder = Recorder(path)
+    recorder.record("scan", 1.0)
+    recorder.record("scan", 1.0)
+
+    def written() -> bool:
+        with open(path, encoding="UTF-8") as o:
+            return 'pysanebridge_phase_count_total{phase="scan"} 2' in o.read()
+
+    # only the first span is written straight away, the second once the interval has passed
+    assert not written()
+    time.sleep(0.5)
+    assert written()
+
+
+def test_from_env(tmp_path, monkeypatch):
+    """Test that the export path comes from the environment"""
+    monkeypatch.setenv(ENV_METRICS, str(tmp_path / "metrics.jsonl"))
+    assert Recorder.from_env().path == str(tmp_path / "metrics.jsonl")
+    monkeypatch.delenv(ENV_METRICS)
+    assert Recorder.from_env().path is None
+
+
+def test_unwritable(tmp_path):
+    """Test that a failed export does not stop the caller"""
+    recorder = Recorder(str(tmp_path / "missing" / "metrics.jsonl"))
+    recorder.record("scan", 1.0)
+    assert recorder.summary()["scan"]["count"] == 1
@@ -0,0 +1,44 @@
+"""
+Test pages and their resolution
+"""
+
+import io
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from bridge.document.page import Page  # noqa: E402
+
+
+def encode(fmt: str, **kwargs) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 20), (200, 0, 0)).save(buffer, format=fmt, **kwargs)
+    return buffer.getvalue()
+
+
+def test_keeps_jpeg():
+    """Test that JPEG data is kept, and decoded on demand"""
+    data = encode("JPEG", dpi=(300, 300))
+    page = Page.from_bytes(data)
+
+    assert page.encoded == data
+    assert page.dpi == 300
+    assert page.size == (40, 20)
+
+    lazy = Page(dpi=300, encoded=data, size=(40, 20))
+    assert not lazy.decoded
+    assert lazy.image.size == (40, 20)
+
+
+def test_drops_png():
+    """Test that data a PDF cannot hold as is is not kept"""
+    page = Page.from_bytes(encode("PNG"), dpi=150)
+
+    assert page.encoded is None
+    assert page.dpi == 150
+
+
+def test_default_dpi_ignored():
+    """Test that a software default of 72 dpi is not taken as the resolution"""
+    assert Page.from_bytes(encode("JPEG", dpi=(72, 72))).dpi is None
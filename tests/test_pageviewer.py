@@ -0,0 +1,118 @@
+"""
+Test the page list model of the viewer, on the offscreen Qt platform
+"""
+
+import os
+import time
+
+import pytest
+
+pytest.importorskip("PyQt6")
+Image = pytest.importorskip("PIL.Image")
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt6.QtGui import QImage  # noqa: E402
+from PyQt6.QtWidgets import QApplication  # noqa: E402
+
+from bridge.document.store import PageStore  # noqa: E402
+from bridge.gui.subcontainers.pageviewer import PageListModel  # noqa: E402
+
+
+@pytest.fixture
+def model():
+    app = QApplication.instance() or QApplication([])
+    pages = PageListModel()
+    yield pages
+    pages.loader.shutdown()
+    pages.store.close()
+    app.processEvents()
+
+
+def page(shade: int):
+    """Returns a small page filled with shade, to tell pages apart"""
+    return Image.new("L", (20, 30), shade)
+
+
+def shades(model) -> list:
+    """Returns the shade of each page, in order"""
+    return [model.store.get(key).getpixel((0, 0)) for key in model.keys]
+
+
+def test_insert_and_move(model):
+    """Test that pages keep their order through inserts and moves"""
+    model.extend([page(1), page(2), page(3)])
+    model.insert(1, page(4))
+    assert model.rowCount() == 4
+    assert shades(model) == [1, 4, 2, 3]
+
+    model.move(0, 3)
+    assert shades(model) == [4, 2, 3, 1]
+    model.move(2, 0)
+    assert shades(model) == [3, 4, 2, 1]
+
+    # out of range moves are ignored
+    model.move(0, 4)
+    assert shades(model) == [3, 4, 2, 1]
+
+
+def test_remove(model):
+    """Test that removing a row drops its page from the store, and only it"""
+    model.extend([page(1), page(2), page(3)])
+    removed = model.keys[1]
+
+    model.remove(1)
+    assert shades(model) == [1, 3]
+    assert removed not in model.store
+    assert model.data(model.index(1)) == "Page 2"
+
+    model.remove(5)
+    assert model.rowCount() == 2
+
+    model.clear()
+    assert model.rowCount() == 0
+    assert len(model.store) == 0
+
+
+def test_late_thumbnail(model):
+    """Test that a preview finished after its page was removed is dropped"""
+    model.extend([page(1), page(2)])
+    key = model.keys[0]
+    changed = []
+    model.dataChanged.connect(lambda *args: changed.append(args))
+
+    model.remove(0)
+    preview = QImage(10, 15, QImage.Format.Format_RGB888)
+    preview.fill(0)
+    model.thumbnail_ready(key, preview)
+
+    assert not changed
+    assert model.rowCount() == 1
+    assert shades(model) == [2]
+
+
+def test_spilled_thumbnail(tmp_path):
+    """Test that the preview of a spilled page is made without bringing the page back into memory"""
+    app = QApplication.instance() or QApplication([])
+    store = PageStore(budget=20 * 30 * 4, directory=str(tmp_path))
+    model = PageListModel(store=store)
+    try:
+        model.extend([Image.new("RGB", (20, 30), (i, 0, 0)) for i in range(3)])
+        store.flush()
+        changed = []
+        model.dataChanged.connect(lambda *args: changed.append(args))
+
+        key = model.keys[0]
+        model.thumbnail(key)
+        for _ in range(200):
+            app.processEvents()
+            if changed:
+                break
+            time.sleep(0.01)
+
+        assert changed
+        assert not model.thumbnail(key).isNull()
+        store.flush()
+        assert store.stats["on_disk"] == 2
+    finally:
+        model.loader.shutdown()
+        store.close()
@@ -0,0 +1,107 @@
+"""
+Test the clean-up of scanned pages
+"""
+
+import time
+
+import pytest
+
+pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+ImageDraw = pytest.importorskip("PIL.ImageDraw")
+
+from bridge.document.page import Page  # noqa: E402
+from bridge.document.postprocess import (  # noqa: E402
+    PostProcessor,
+    analysis_image,
+    content_box,
+    estimate_skew,
+    ink_fraction,
+)
+
+DPI = 300
+
+
+def text_page(dpi: int = DPI, margin: float = 1.5) -> Image:
+    """Returns a letter page with lines of "words", margin inches from the edges"""
+    width, height = int(8.5 * dpi), int(11 * dpi)
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    for y in range(int(margin * dpi), height - int(margin * dpi), dpi // 4):
+        for x in range(int(margin * dpi), width - int(margin * dpi) - dpi // 3, dpi // 2):
+            draw.rectangle([x, y, x + dpi // 3, y + dpi // 12], fill="black")
+    return image
+
+
+@pytest.mark.parametrize("angle", [-2.0, 0.0, 1.5])
+def test_estimate_skew(angle):
+    """Test that the skew found straightens the page"""
+    grey, _ = analysis_image(text_page().rotate(angle, fillcolor="white"), DPI)
+    assert estimate_skew(grey) == pytest.approx(-angle, abs=0.15)
+
+
+def test_content_box():
+    """Test that the box found holds the ink, ignoring specks and edge shadows"""
+    image = text_page(margin=2)
+    draw = ImageDraw.Draw(image)
+    # a dark strip down the edge, as a scanner lid leaves
+    draw.rectangle([0, 0, 20, image.height], fill="black")
+    # a speck of dust
+    draw.point((image.width - 50, 50), fill="black")
+
+    grey, factor = analysis_image(image, DPI)
+    left, top, right, bottom = content_box(grey)
+    assert left * factor == pytest.approx(2 * DPI, abs=factor)
+    assert top * factor == pytest.approx(2 * DPI, abs=factor)
+    assert right * factor < image.width - 2 * DPI + DPI // 2
+    assert bottom * factor < image.height - 2 * DPI + DPI // 2
+
+    assert content_box(analysis_image(Image.new("L", (300, 300), 255), DPI)[0]) is None
+
+
+def test_blank_page():
+    """Test that a near empty page is blank and a page of text is not"""
+    blank = Image.new("L", (850, 1100), 250)
+    ImageDraw.Draw(blank).point((400, 400), fill=0)
+    assert ink_fraction(analysis_image(blank, 100)[0]) < 0.001
+    assert ink_fraction(analysis_image(text_page(100), 100)[0]) > 0.01
+
+
+def test_process_crops_and_straightens():
+    """Test that a skewed page comes back straight, cropped, and in time"""
+    processor = PostProcessor()
+    start = time.perf_counter()
+    page, blank = processor.process(Page(text_page().rotate(1.5, fillcolor="white"), dpi=DPI))
+    elapsed = time.perf_counter() - start
+    processor.close()
+
+    assert not blank
+    assert page.dpi == DPI
+    assert page.size[0] < 8.5 * DPI - 2 * DPI
+    assert abs(estimate_skew(analysis_image(page.image, DPI)[0])) <= 0.15
+    # far quicker than a scanner takes over a 300 dpi page
+    assert elapsed < 2
+
+
+def test_process_blank_pages():
+    """Test that blank pages are flagged or dropped as asked"""
+    blank = Page(Image.new("RGB", (850, 1100), "white"), dpi=100)
+
+    processor = PostProcessor(blank="flag")
+    assert processor.submit(blank).result() == (blank, True)
+    processor.close()
+
+    processor = PostProcessor(blank="drop")
+    assert processor.process(blank) == (None, True)
+    processor.close()
+
+    with pytest.raises(ValueError):
+        PostProcessor(blank="hide")
+
+
+def test_process_unchanged():
+    """Test that a page with nothing to do is returned as it was"""
+    page = Page(text_page(100, margin=0.05), dpi=100)
+    processor = PostProcessor(crop=False, blank="keep")
+    assert processor.process(page) == (page, False)
+    assert not PostProcessor(crop=False, deskew=False, blank="keep").enabled
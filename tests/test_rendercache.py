@@ -0,0 +1,37 @@
+"""
+Test the cache of renders of loaded files
+"""
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from bridge.document.page import Page  # noqa: E402
+from bridge.document.rendercache import RenderCache  # noqa: E402
+
+
+def test_render_roundtrip(tmp_path):
+    """Test that renders and previews are kept apart, by page and resolution"""
+    cache = RenderCache(directory=str(tmp_path))
+    render = Image.new("RGB", (30, 40), (1, 2, 3))
+    preview = Image.new("RGB", (10, 13), (4, 5, 6))
+
+    cache.put(("abc", 0), 150, render)
+    cache.put_thumbnail(("abc", 0), 10, preview)
+
+    assert cache.get(("abc", 0), 150).getpixel((0, 0)) == (1, 2, 3)
+    assert cache.get_thumbnail(("abc", 0), 10).size == (10, 13)
+    assert cache.get(("abc", 1), 150) is None
+    assert cache.get(("abc", 0), 300) is None
+
+
+def test_origin_by_content(tmp_path):
+    """Test that the same content has the same origin wherever it is loaded from"""
+    for name in ("a.png", "b.png"):
+        Image.new("RGB", (20, 20)).save(tmp_path / name)
+
+    first = Page.from_file(str(tmp_path / "a.png"))
+    second = Page.from_file(str(tmp_path / "b.png"))
+    assert first.origin == second.origin
+    assert first.origin[1] == 0
+    assert Page(Image.new("RGB", (20, 20))).origin is None
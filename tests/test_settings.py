@@ -4,6 +4,7 @@ Test the settings module
 
 import os.path
 import unittest
+from unittest.mock import patch
 
 from bridge.gui.settings import Settings
 
@@ -43,6 +44,64 @@ class TestSettings(unittest.TestCase):
         assert not self.settings.get("bool"), print(self.settings.get("bool"))
         assert self.settings.file_data["bool"] == False
 
+    def test_cached_until_changed(self):
+        """Check that the file is only read again once it changes"""
+        self.settings.get("resolution")
+        with patch.object(Settings, "_read", autospec=True, side_effect=Settings._read) as read:
+            for _ in range(10):
+                self.settings.get("resolution")
+            assert read.call_count == 0
+
+        # another process changing the file
+        Settings(self.filepath).set("resolution", 150)
+
+        with patch.object(Settings, "_read", autospec=True, side_effect=Settings._read) as read:
+            assert self.settings.get("resolution") == 150
+            assert self.settings.get("resolution") == 150
+            assert read.call_count == 1
+
+    def test_schema(self):
+        """Check that values are converted to their type, and invalid ones refused"""
+        self.settings.set("resolution", "600")
+        assert self.settings.get("resolution") == 600
+
+        for key, value in (("resolution", 50), ("resolution", "high"), ("use_agent", "maybe")):
+            with self.assertRaises(ValueError):
+                self.settings.set(key, value)
+        assert self.settings.get("resolution") == 600
+
+    def test_invalid_file_value(self):
+        """Check that an invalid value in the file falls back to the default"""
+        with open(self.filepath, "a", encoding="UTF-8") as o:
+            o.write("scan_timeout: soon\n")
+
+        assert self.settings.get("scan_timeout") == self.settings.defaults["scan_timeout"]
+
+    def test_transaction(self):
+        """Check that a transaction is written once, and not at all if it fails"""
+        with patch.object(Settings, "dump_data", autospec=True, side_effect=Settings.dump_data) as dump:
+            with self.settings.transaction():
+                self.settings.set("resolution", 600)
+                self.settings.set("scan_timeout", 30)
+                assert self.settings.get("resolution") == 600
+                assert self.settings.file_data["resolution"] == 300
+            assert dump.call_count == 1
+
+        assert self.settings.file_data["scan_timeout"] == 30
+
+        with self.assertRaises(RuntimeError):
+            with self.settings.transaction():
+                self.settings.set("resolution", 1200)
+                raise RuntimeError("abandoned")
+        assert self.settings.get("resolution") == 600
+
+    def test_atomic_write(self):
+        """Check that no temporary files are left behind"""
+        self.settings.update({"resolution": 600, "use_agent": True})
+
+        directory = os.path.dirname(os.path.abspath(self.filepath))
+        assert not [name for name in os.listdir(directory) if name.startswith(".settings-")]
+
     def tearDown(self):
         """Tear down test structures"""
         os.remove(self.filepath)
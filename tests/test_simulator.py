@@ -0,0 +1,125 @@
+"""
+Test the simulated scanner host
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from bridge.connection.cmd import CancelHandle
+from bridge.scan.devices import DeviceRegistry
+from bridge.scan.simulator import FakeSANE
+
+pytestmark = pytest.mark.skipif(os.name == "nt", reason="the simulated host needs sh")
+
+
+@pytest.fixture
+def sim():
+    with FakeSANE(scan_seconds=0.05, width=2, height=3, feeder=3) as host:
+        yield host
+
+
+def test_devices(sim, tmp_path):
+    """Test that -L and -A are answered in the format the registry parses"""
+    registry = DeviceRegistry(sim.connection(), path=str(tmp_path / "devices.json"))
+    devices = asyncio.run(registry._probe())
+
+    assert [device.name for device in devices] == ["sim:flatbed0"]
+    assert 300 in devices[0].options["resolution"].values
+
+
+def test_scan_to_stdout(sim):
+    """Test that a scan streams a page of the set size"""
+    result = sim.connection().cmd("scanimage --resolution 100 --format=pnm", binary=True)
+
+    assert result.returncode == 0
+    header = b"P6\n200 300\n255\n"
+    assert result.stdout.startswith(header)
+    assert len(result.stdout) == len(header) + 200 * 300 * 3
+
+
+def test_batch(sim):
+    """Test that a batch prints each page and ends like an emptied feeder"""
+    result = sim.connection().cmd(
+        "scanimage --resolution 75 --format=pnm --batch=page%04d.pnm --batch-print"
+    )
+
+    assert result.returncode == 7
+    assert result.stdout.split() == ["page0001.pnm", "page0002.pnm", "page0003.pnm"]
+    assert os.path.exists(os.path.join(sim.home, "page0003.pnm"))
+
+
+def test_bandwidth():
+    """Test that output is held to the simulated link speed"""
+    with FakeSANE(scan_seconds=0, width=2, height=3, bandwidth=1e6) as host:
+        start = time.perf_counter()
+        result = host.connection().cmd("head -c 500000 /dev/zero", binary=True)
+
+    assert len(result.stdout) == 500000
+    assert time.perf_counter() - start >= 0.5
+
+
+def test_cancel():
+    """Test that cancelling stops the simulated scan"""
+    with FakeSANE(scan_seconds=30, width=2, height=3) as host:
+        cancel = CancelHandle()
+        # cancelled from another thread, as the GUI would
+        threading.Timer(0.5, cancel.cancel).start()
+        start = time.perf_counter()
+        result = host.connection().cmd("scanimage --resolution 75 --format=pnm", binary=True, cancel=cancel)
+
+    assert result.cancelled
+    assert time.perf_counter() - start < 10
+
+
+def test_scanner_end_to_end(sim):
+    """Test single and batch scans through the real Scanner"""
+    pytest.importorskip("PIL.Image")
+
+    scanner = sim.scanner(transfer="pnm")
+    page = scanner.scan_page(100)
+    assert page.size == (200, 300)
+    assert page.dpi == 100
+
+    pages = list(scanner.scan_batch(75, count=2, fmt="pnm", as_pages=True))
+    assert [p.size for p in pages] == [(150, 225), (150, 225)]
+    scanner.close()
+
+
+def test_compressed_scan_status(sim):
+    """Test that a compressed scan reports scanimage's status rather than gzip's"""
+    from bridge.connection.sinks import RingBufferSink, SpoolSink
+    from bridge.scan.scan import STDERR_TAIL, check_scan, scan_command
+
+    out = SpoolSink()
+    cmd, target = scan_command(100, "pnm", out, compress=True)
+    log = RingBufferSink(STDERR_TAIL)
+    result = sim.connection().cmd(cmd, binary=True, sink=target, stderr_sink=log)
+    check_scan(result, target, log)
+    assert out.getvalue().startswith(b"P6\n200 300\n255\n")
+
+    # a scan that fails part way through the page, e.g. a paper jam
+    out = SpoolSink()
+    cmd, target = scan_command(100, "pnm", out, compress=True)
+    cmd = cmd.replace("scanimage --resolution 100 --format=pnm", "sh -c 'printf P6; echo jammed >&2; exit 9'")
+    log = RingBufferSink(STDERR_TAIL)
+    result = sim.connection().cmd(cmd, binary=True, sink=target, stderr_sink=log)
+    assert result.returncode == 0
+    with pytest.raises(RuntimeError, match=r"\(9\): jammed$"):
+        check_scan(result, target, log)
+
+
+def test_scan_error_text(sim):
+    """Test that a failed scan is reported even when its stderr tail is not valid UTF-8"""
+    from bridge.connection.sinks import RingBufferSink, SpoolSink
+    from bridge.scan.scan import check_scan
+
+    log = RingBufferSink(7)
+    result = sim.connection().cmd(
+        "printf 'x\\351jammed' >&2; exit 4", binary=True, sink=SpoolSink(), stderr_sink=log
+    )
+    with pytest.raises(RuntimeError, match=r"\(4\): �jammed$"):
+        check_scan(result, SpoolSink(), log)
@@ -0,0 +1,101 @@
+"""
+Test the output sinks
+"""
+
+import os
+
+from bridge.connection.cmd import CMD
+from bridge.connection.sinks import (
+    CallbackSink,
+    DecompressSink,
+    FileSink,
+    LineSink,
+    MeterSink,
+    RingBufferSink,
+    SpoolSink,
+)
+
+LARGE = "head -c 1000000 /dev/zero"
+
+
+def test_callback_sink():
+    """Test that chunks reach the callback without being cached"""
+    chunks = []
+    sink = CallbackSink(chunks.append)
+
+    cmd = CMD(LARGE, binary=True)
+    cmd.exec(sink=sink)
+
+    assert sum(len(chunk) for chunk in chunks) == 1000000
+    assert sink.size == 1000000
+    assert cmd.stdout == b""
+
+
+def test_file_sink(tmp_path):
+    """Test writing output straight to a file"""
+    path = str(tmp_path / "out.bin")
+    with FileSink(path) as sink:
+        CMD(LARGE, binary=True).exec(sink=sink)
+
+    assert os.path.getsize(path) == 1000000
+
+
+def test_ring_buffer_sink():
+    """Test that only the tail of the output is kept"""
+    sink = RingBufferSink(8)
+    CMD("seq 1 1000", binary=True).exec(sink=sink)
+
+    assert sink.getvalue() == b"999\n1000\n"[-8:]
+    assert sink.dropped == sink.size - 8
+
+
+def test_spool_sink():
+    """Test that large output moves to disk past the memory limit"""
+    with SpoolSink(max_memory=1000) as sink:
+        CMD(LARGE, binary=True).exec(sink=sink)
+
+        assert sink.spilled
+        assert len(sink.getvalue()) == 1000000
+
+
+def test_stderr_sink():
+    """Test routing stderr to a sink"""
+    sink = RingBufferSink(64)
+    cmd = CMD("echo oops >&2", binary=True)
+    cmd.exec(stderr_sink=sink)
+
+    assert sink.getvalue() == b"oops\n"
+
+
+def test_line_sink():
+    """Test that output is split into lines across chunk boundaries"""
+    lines = []
+    with LineSink(lines.append) as sink:
+        sink.write(b"first\nsec")
+        sink.write(b"ond\nthird")
+
+    assert lines == ["first", "second", "third"]
+
+
+def test_decompress_sink():
+    """Test inflating a gzip stream on the fly"""
+    out = SpoolSink()
+    with DecompressSink(out) as sink:
+        CMD(f"{LARGE} | gzip -1", binary=True).exec(sink=sink)
+
+    assert sink.size == 1000000
+    assert 0 < sink.compressed < 100000
+    assert out.getvalue() == bytes(1000000)
+
+
+def test_meter_sink():
+    """Test that the meter passes output on and notes the first chunk"""
+    sink = RingBufferSink(16)
+    meter = MeterSink(sink)
+    assert meter.first is None
+
+    CMD(LARGE, binary=True).exec(sink=meter)
+
+    assert meter.size == 1000000
+    assert sink.size == 1000000
+    assert meter.first is not None
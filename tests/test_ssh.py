@@ -1,4 +1,9 @@
-from bridge.connection.connection import Connection
+import os
+
+import pytest
+
+from bridge.connection.connection import Connection, kill_pattern
+from bridge.connection.sinks import RingBufferSink, SpoolSink
 
 
 def test_userhost():
@@ -9,3 +14,50 @@ def test_userhost():
 def test_host_only():
     """Test generating a Connection with only user"""
     assert Connection("host").userhost == "host"
+
+
+def test_multiplexed_command():
+    """Test that remote commands are routed through the master session"""
+    cmd = Connection("test@host", multiplex=True).ssh_command("ls")
+
+    assert "ControlMaster=auto" in cmd
+    assert "ControlPath=" in cmd
+    assert cmd.endswith("test@host ls")
+
+
+def test_plain_command():
+    """Test that multiplexing can be disabled"""
+    cmd = Connection("test@host", multiplex=False).ssh_command("ls")
+
+    assert "ControlMaster" not in cmd
+    assert not Connection("host", multiplex=False).is_connected()
+
+
+def test_kill_pattern():
+    """Test that the remote kill pattern escapes the command and skips itself"""
+    assert kill_pattern("scanimage --resolution 300") == "[s]canimage --resolution 300"
+    assert kill_pattern("ls *.png") == r"[l]s \*\.png"
+    assert kill_pattern("scanimage --format=pnm | gzip -1") == "[s]canimage --format=pnm"
+    assert kill_pattern('{ scanimage --format=pnm; echo "$?" >&2; } | gzip -1') == "[s]canimage --format=pnm"
+
+
+@pytest.mark.skipif(os.name == "nt", reason="the stand-in ssh needs sh")
+def test_remote_command_quoting(tmp_path, monkeypatch):
+    """Test that the remote shell, not the local one, expands the scan status of a compressed scan"""
+    pytest.importorskip("PIL.Image")
+    from bridge.scan.scan import STDERR_TAIL, check_scan, scan_command  # pylint: disable=import-outside-toplevel
+
+    # runs its last argument as the remote sshd would, with sh -c
+    ssh = tmp_path / "ssh"
+    ssh.write_text('#!/bin/sh\nfor arg; do cmd=$arg; done\nexec sh -c "$cmd"\n')
+    ssh.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+    cmd, target = scan_command(100, "pnm", SpoolSink(), compress=True)
+    cmd = cmd.replace("scanimage --resolution 100 --format=pnm", "printf P6; echo jammed >&2; false")
+    log = RingBufferSink(STDERR_TAIL)
+    result = Connection("test@host", multiplex=False).cmd(cmd, binary=True, sink=target, stderr_sink=log)
+
+    assert result.returncode == 0
+    with pytest.raises(RuntimeError, match=r"\(1\): jammed$"):
+        check_scan(result, target, log)
@@ -0,0 +1,113 @@
+"""
+Test the page store
+"""
+
+import os
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from bridge.document.store import PageStore  # noqa: E402
+
+# memory PIL holds an RGB page of page() in, padded to 4 bytes a pixel
+PAGE_BYTES = 300 * 200 * 4
+
+
+def page(value: int, mode: str = "RGB"):
+    return Image.new(mode, (300, 200), value if mode != "RGB" else (value, 0, 255 - value))
+
+
+def test_within_budget(tmp_path):
+    """Test that pages stay in memory while they fit"""
+    store = PageStore(budget=10 * PAGE_BYTES, directory=str(tmp_path))
+    keys = [store.add(page(i)) for i in range(3)]
+
+    assert store.stats["on_disk"] == 0
+    assert store.memory == 3 * PAGE_BYTES
+    assert store.get(keys[1]).getpixel((0, 0)) == (1, 0, 254)
+
+
+def test_spills_and_reloads(tmp_path):
+    """Test that pages past the budget go to disk and come back unchanged"""
+    store = PageStore(budget=2 * PAGE_BYTES, directory=str(tmp_path))
+    keys = [store.add(page(i * 10)) for i in range(5)]
+    store.flush()
+
+    assert store.stats["in_memory"] == 2
+    assert store.stats["on_disk"] == 3
+    assert store.memory <= 2 * PAGE_BYTES
+    # packed, 3 bytes a pixel
+    assert store.disk == 3 * 300 * 200 * 3
+
+    reloaded = store.get(keys[0])
+    assert reloaded.mode == "RGB"
+    assert reloaded.size == (300, 200)
+    assert reloaded.getpixel((10, 10)) == (0, 0, 255)
+    assert store.size(keys[0]) == (300, 200)
+    # the unpacked copy counts against the budget, moving another page out
+    store.flush()
+    assert store.memory <= 2 * PAGE_BYTES
+    assert store.stats["on_disk"] == 4
+
+
+def test_get_while_evicting(tmp_path):
+    """Test that a page is found between leaving memory and being queued for disk"""
+    store = PageStore(budget=PAGE_BYTES, directory=str(tmp_path))
+    spill = store._resident._on_evict
+    seen = []
+
+    def evicted(key, image):
+        # another thread asking for the page at this point
+        seen.append(store.get(key).getpixel((0, 0)))
+        spill(key, image)
+
+    store._resident._on_evict = evicted
+    first = store.add(page(10))
+    store.add(page(20))
+    store.flush()
+
+    assert seen == [(10, 0, 245)]
+    assert store.get(first).getpixel((0, 0)) == (10, 0, 245)
+
+
+def test_get_without_keeping(tmp_path):
+    """Test that a page read back only for a moment moves no other page out"""
+    store = PageStore(budget=2 * PAGE_BYTES, directory=str(tmp_path))
+    keys = [store.add(page(i * 10)) for i in range(5)]
+    store.flush()
+
+    assert store.get(keys[0], keep=False).getpixel((10, 10)) == (0, 0, 255)
+    store.flush()
+    assert store.stats["on_disk"] == 3
+    assert store.stats["in_memory"] == 2
+
+
+def test_modes(tmp_path):
+    """Test that grey and palette pages survive the round trip"""
+    store = PageStore(budget=1, directory=str(tmp_path))
+    grey = store.add(page(128, "L"))
+    palette = page(0, "RGB").convert("P")
+    paletted = store.add(palette)
+    store.add(page(0))
+    store.flush()
+
+    # mapped from the file, not copied
+    assert store.get(grey).readonly
+    assert store.get(grey).getpixel((0, 0)) == 128
+    assert store.get(paletted).convert("RGB").getpixel((0, 0)) == palette.convert("RGB").getpixel((0, 0))
+
+
+def test_remove_and_close(tmp_path):
+    """Test that spilled files are removed with their pages"""
+    store = PageStore(budget=1, directory=str(tmp_path))
+    keys = [store.add(page(i)) for i in range(3)]
+    store.flush()
+
+    store.remove(keys[0])
+    assert keys[0] not in store
+    assert len(os.listdir(store.directory)) == 1
+
+    directory = store.directory
+    store.close()
+    assert not os.path.exists(directory)
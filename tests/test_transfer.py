@@ -0,0 +1,42 @@
+"""
+Test the wire format cost model
+"""
+
+from bridge.scan.transfer import LinkProfile, page_bytes
+
+MB = 1e6
+
+
+def test_page_bytes():
+    """Test the raw size of a letter page"""
+    assert page_bytes(100) == 850 * 1100 * 3
+    assert page_bytes(100, channels=1) == 850 * 1100
+
+
+def test_fast_link_slow_cpu():
+    """Test that a slow host on a fast link sends raw pixels"""
+    link = LinkProfile(bandwidth=100 * MB, cpu_rate=5 * MB)
+    assert link.choose(page_bytes(300)) == ("pnm", False)
+
+
+def test_slow_link_fast_cpu():
+    """Test that a fast host on a slow link compresses"""
+    link = LinkProfile(bandwidth=1 * MB, cpu_rate=200 * MB)
+    fmt, compress = link.choose(page_bytes(300))
+    assert fmt == "png" and not compress
+
+
+def test_lossy_is_opt_in():
+    """Test that jpeg is only picked when allowed"""
+    link = LinkProfile(bandwidth=0.5 * MB, cpu_rate=50 * MB)
+    raw = page_bytes(300)
+
+    assert "jpeg" not in [fmt for _, fmt, _ in link.rank(raw)]
+    assert link.choose(raw, lossy=True) == ("jpeg", False)
+
+
+def test_estimate_includes_latency():
+    """Test that every estimate pays the round trip"""
+    link = LinkProfile(bandwidth=10 * MB, cpu_rate=10 * MB, latency=0.2)
+    assert link.estimate("pnm", False, 0) == 0.2
+    assert link.estimate("pnm", True, 10 * MB) > link.estimate("pnm", False, 0)
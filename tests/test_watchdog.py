@@ -0,0 +1,97 @@
+"""
+Test the stall watchdog and profiler hooks
+"""
+
+import os
+import time
+
+from bridge.watchdog import ENV_PROFILE, ENV_WATCHDOG, StallWatchdog, instrumented, profiled
+
+
+def busy_action(seconds: float):
+    """Hold the thread without beating"""
+    time.sleep(seconds)
+
+
+def test_stall_reported(tmp_path):
+    """Test that a stall is caught with its action and stack, and timed once it ends"""
+    watchdog = StallWatchdog(threshold=0.1, directory=str(tmp_path))
+    watchdog.start()
+    try:
+        with watchdog.action("Save"):
+            busy_action(0.4)
+        watchdog.beat()
+    finally:
+        watchdog.stop()
+
+    stalls = watchdog.stalls
+    assert len(stalls) == 1
+    assert stalls[0].action == "Save"
+    assert "busy_action" in stalls[0].stack
+    assert stalls[0].seconds >= 0.4
+
+    with open(stalls[0].path, encoding="UTF-8") as o:
+        report = o.read()
+    assert report.startswith("stall of 0.4")
+    assert "busy_action" in report
+
+
+def test_no_stall():
+    """Test that a thread beating in time is not reported"""
+    watchdog = StallWatchdog(threshold=0.2)
+    watchdog.start()
+    try:
+        for _ in range(10):
+            time.sleep(0.02)
+            watchdog.beat()
+    finally:
+        watchdog.stop()
+    assert watchdog.stalls == []
+    assert not watchdog.running
+
+
+def test_from_env(tmp_path, monkeypatch):
+    """Test that the watchdog is only made when asked for"""
+    monkeypatch.delenv(ENV_WATCHDOG, raising=False)
+    assert StallWatchdog.from_env() is None
+
+    monkeypatch.setenv(ENV_WATCHDOG, "250")
+    monkeypatch.setenv(ENV_PROFILE, str(tmp_path))
+    watchdog = StallWatchdog.from_env()
+    assert watchdog.threshold == 0.25
+
+    monkeypatch.setenv(ENV_WATCHDOG, "500.0")
+    assert StallWatchdog.from_env().threshold == 0.5
+    # beats are still spaced out for a tiny threshold
+    monkeypatch.setenv(ENV_WATCHDOG, "0.5")
+    assert StallWatchdog.from_env().interval >= 0.001
+
+    # a typo leaves the GUI running, without the watchdog
+    for value in ("50O", "-5", "nan"):
+        monkeypatch.setenv(ENV_WATCHDOG, value)
+        assert StallWatchdog.from_env() is None
+
+
+def test_profiled(tmp_path):
+    """Test that a profiled block leaves a profile and a summary"""
+    with profiled("Load", str(tmp_path)):
+        sum(range(10000))
+
+    files = sorted(os.listdir(tmp_path))
+    assert len(files) == 2
+    assert files[0].startswith("Load-") and files[0].endswith(".prof")
+    assert files[1].endswith(".txt")
+
+
+def test_instrumented(tmp_path):
+    """Test that a wrapped slot ignores the signal arguments and is profiled"""
+    calls = []
+    watchdog = StallWatchdog()
+    slot = instrumented("Scan", lambda: calls.append(1), watchdog=watchdog, directory=str(tmp_path))
+
+    slot(False)
+    assert calls == [1]
+    assert any(name.startswith("Scan-") for name in os.listdir(tmp_path))
+
+    instrumented("Scan", lambda: calls.append(2))(True)
+    assert calls == [1, 2]